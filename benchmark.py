@@ -0,0 +1,423 @@
+"""Headless benchmark of the dashboard's data path on synthetic exports.
+
+``generate`` writes DoorDash (detailed transactions, promotion, sponsored
+listing) and GrubHub (all eight tables) exports ``scale`` times the size of
+the bundled ones. Each replica of a source file renames its stores and
+shifts its IDs, so every replica adds new stores, campaigns and orders
+while keeping the columns, dtypes, date range and value distributions of
+the real exports. IDs are shifted the same way in every table, so the
+links between tables are kept.
+
+``run`` then times what a dashboard rerun does, section by section, without
+Streamlit:
+
+- ``ingest``: the first load of each export, which converts the CSV to Parquet.
+- ``load``: the following loads from the Parquet cache.
+- ``filter``, ``aggregate``, ``kpis`` and ``chart`` for each section.
+
+Every timing is the best of ``--repeat`` runs. The results are written to
+a JSON file. Pass an earlier file as ``--baseline`` to compare two versions.
+
+    python benchmark.py --scales 10 100 1000 --output benchmark_results.json
+    python benchmark.py --scales 10 --baseline benchmark_results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import heatmaps
+import metrics
+import rollups
+import segments
+import tables
+from data_cache import CACHE_DIR
+from exports import ExportHistory, discover_exports
+from filters import before_end_of, date_slice
+from platforms import (GRUBHUB_FILES, available_grubhub_files, prepare_doordash_export, read_grubhub_table,
+                       read_grubhub_tables)
+from schema import CAMPAIGN_TABLE_COLUMNS, projected_columns
+
+WORKDIR = '.todc_bench'
+
+DOORDASH_KINDS = ['detailed_transactions', 'promotion', 'sponsored_listing']
+
+# Rows written per CSV append while generating
+WRITE_ROWS = 200000
+
+STORE_NAME_COLUMNS = ['Store name', 'store_name']
+ID_COLUMN = re.compile(r'( ID|_id|UUID|^order_number)$')
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    """Run the block inside ``path``; exports and the ingest cache are found relative to it"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+# Synthetic exports
+
+def _read_source(path):
+    return pd.read_csv(path, dtype={column: str for column in STORE_NAME_COLUMNS}, low_memory=False)
+
+
+def id_strides(sources):
+    """Numeric ID column -> power of ten above its largest value in any of ``sources``
+
+    One stride per column name keeps IDs shared by several tables (store and
+    order numbers) consistent between them.
+    """
+    strides = {}
+    for path in sources:
+        df = _read_source(path)
+        for column in df.columns:
+            if ID_COLUMN.search(column) and pd.api.types.is_numeric_dtype(df[column]) and df[column].notna().any():
+                stride = 10 ** len(str(int(df[column].abs().max())))
+                strides[column] = max(strides.get(column, 0), stride)
+    return strides
+
+
+def replica(df, k, strides):
+    """Copy ``k`` of a source export, with its own stores and IDs (copy 0 is the source itself)"""
+    df = df.copy()
+    for column in df.columns:
+        if column in strides:
+            # Int64 writes IDs with blanks as integers, not floats, in every copy
+            df[column] = df[column].astype('Int64') + k * strides[column]
+        elif k == 0:
+            continue
+        elif column in STORE_NAME_COLUMNS:
+            df[column] = df[column] + f' #{k}'
+        elif ID_COLUMN.search(column) and df[column].dtype == object:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str) + f'-{k}')
+    return df
+
+
+def write_scaled(source, target, scale, strides):
+    """Write ``scale`` replicas of the ``source`` CSV to ``target``, a few at a time"""
+    df = _read_source(source)
+    per_write = max(1, WRITE_ROWS // max(len(df), 1))
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    tmp_path = target + '.tmp'
+    for first in range(0, scale, per_write):
+        batch = pd.concat([replica(df, k, strides) for k in range(first, min(first + per_write, scale))],
+                          ignore_index=True)
+        batch.to_csv(tmp_path, mode='w' if first == 0 else 'a', header=first == 0, index=False)
+    os.replace(tmp_path, target)
+    return len(df) * scale
+
+
+def generate(root, scale, source_root='.'):
+    """Write every benchmarked export at ``scale`` times its bundled size under ``root``
+
+    Skipped when ``root`` already holds a complete dataset of this scale.
+    Returns dataset -> rows written.
+    """
+    marker = os.path.join(root, 'generated.json')
+    try:
+        with open(marker) as f:
+            previous = json.load(f)
+        if previous.get('scale') == scale:
+            return previous['rows']
+    except (OSError, ValueError):
+        pass
+
+    # dataset -> (bundled export, file to write)
+    files = {}
+    for kind in DOORDASH_KINDS:
+        exports = discover_exports(kind, source_root)
+        if exports:
+            source = exports[-1].path
+            files[kind] = source, os.path.join(root, os.path.basename(os.path.dirname(source)),
+                                               os.path.basename(source))
+    for key, path in GRUBHUB_FILES.items():
+        if os.path.exists(os.path.join(source_root, path)):
+            files[key] = os.path.join(source_root, path), os.path.join(root, path)
+
+    strides = id_strides(source for source, _ in files.values())
+    rows = {name: write_scaled(source, target, scale, strides) for name, (source, target) in files.items()}
+
+    with open(marker, 'w') as f:
+        json.dump({'scale': scale, 'rows': rows}, f, indent=2)
+    return rows
+
+
+# Timed dashboard sections
+
+def timed(func, repeat=1):
+    """Return ``(result, seconds)`` for the fastest of ``repeat`` calls"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return result, best
+
+
+class Recorder:
+    """Collects one result row per (platform, section, stage)"""
+
+    def __init__(self, scale, platform_name, repeat):
+        self.scale = scale
+        self.platform = platform_name
+        self.repeat = repeat
+        self.results = []
+
+    def __call__(self, section, stage, func, rows=None, repeat=None):
+        result, seconds = timed(func, repeat or self.repeat)
+        if rows is None and hasattr(result, '__len__'):
+            rows = len(result)
+        self.results.append({
+            'scale': self.scale,
+            'platform': self.platform,
+            'section': section,
+            'stage': stage,
+            'seconds': round(seconds, 6),
+            'rows': rows,
+        })
+        return result
+
+
+def _middle(dates):
+    """The middle half of the date range of ``dates``, as the default selection"""
+    low, high = dates.min(), dates.max()
+    quarter = (high - low) / 4
+    return (low + quarter).normalize(), (high - quarter).normalize()
+
+
+def bench_doordash(record):
+    frames = {}
+    for kind in DOORDASH_KINDS:
+        if not discover_exports(kind):
+            continue
+        columns = projected_columns(kind)
+        record(kind, 'ingest', lambda: ExportHistory(kind, columns=columns).refresh(), repeat=1)
+        frames[kind] = record(kind, 'load', lambda: prepare_doordash_export(
+            kind, ExportHistory(kind, columns=columns).refresh()))
+
+    if 'detailed_transactions' in frames:
+        financial = frames['detailed_transactions']
+        cube = record('financial_analysis', 'aggregate',
+                      lambda: rollups.build_dataset_cube(financial, 'detailed_transactions'), rows=len(financial))
+        date_range = _middle(cube[rollups.FINANCIAL_DATE])
+        selected = record('financial_analysis', 'filter', lambda: rollups.slice_cube(
+            metrics.delivered_orders(cube), rollups.FINANCIAL_DATE, date_range), rows=len(cube))
+        record('financial_analysis', 'kpis', lambda: metrics.doordash_financial_kpis(
+            metrics.totals(selected, metrics.DOORDASH_FINANCIAL_COLUMNS)), rows=len(selected))
+        record('financial_analysis', 'chart', lambda: rollups.top_stores(
+            selected, 'Subtotal', ['Subtotal', 'Net total']), rows=len(selected))
+
+    if 'promotion' in frames:
+        marketing = frames['promotion']
+        cube = record('marketing_analysis', 'aggregate',
+                      lambda: rollups.build_dataset_cube(marketing, 'promotion'), rows=len(marketing))
+        date_range = _middle(cube[rollups.MARKETING_DATE])
+        selected = record('marketing_analysis', 'filter', lambda: rollups.slice_cube(
+            cube, rollups.MARKETING_DATE, date_range), rows=len(cube))
+        record('marketing_analysis', 'kpis', lambda: metrics.doordash_marketing_kpis(
+            metrics.totals(selected, metrics.DOORDASH_MARKETING_COLUMNS)), rows=len(selected))
+        record('marketing_analysis', 'chart', lambda: rollups.top_stores(
+            selected, 'Sales', ['Sales', 'Orders', 'New customers acquired'], mean_measures=['ROAS']),
+            rows=len(selected))
+
+        # The campaign table reads row-level data of one store
+        store = marketing['Store name'].value_counts().index[0]
+
+        def store_campaigns():
+            rows = date_slice(marketing, rollups.MARKETING_DATE, date_range)
+            return rows[rows['Store name'] == store]
+
+        campaigns = record('campaign_table', 'filter', store_campaigns, rows=len(marketing))
+        campaigns = campaigns[CAMPAIGN_TABLE_COLUMNS]
+        order = record('campaign_table', 'aggregate', lambda: tables.sort_order(campaigns, 'Date', ascending=False),
+                       rows=len(campaigns))
+        record('campaign_table', 'chart', lambda: tables.highlight_below(
+            tables.format_page(tables.page(campaigns, order, 1), currency=['Sales', 'Average order value'],
+                               dates=['Date']), 'ROAS', 4, 'font-weight: bold').to_html(), rows=len(campaigns))
+
+    if 'sponsored_listing' in frames:
+        sponsored = frames['sponsored_listing']
+        cube = record('sponsored_listing', 'aggregate',
+                      lambda: rollups.build_dataset_cube(sponsored, 'sponsored_listing'), rows=len(sponsored))
+        date_range = _middle(cube[rollups.SPONSORED_DATE])
+        selected = record('sponsored_listing', 'filter', lambda: rollups.slice_cube(
+            cube, rollups.SPONSORED_DATE, date_range), rows=len(cube))
+        record('sponsored_listing', 'kpis', lambda: metrics.doordash_sponsored_kpis(
+            metrics.totals(selected, metrics.DOORDASH_SPONSORED_COLUMNS)), rows=len(selected))
+        record('sponsored_listing', 'chart', lambda: metrics.sponsored_breakdown(selected, 'Store name'),
+               rows=len(selected))
+
+
+def bench_grubhub(record):
+    keys = tuple(available_grubhub_files())
+    if not keys:
+        return
+    rows = 0
+    for key in keys:
+        record(key, 'ingest', lambda: read_grubhub_table(key), repeat=1)
+        rows += len(record(key, 'load', lambda: read_grubhub_table(key)))
+    # The dashboard loads every table its sections read in one parallel batch
+    tables = record('prefetch', 'load', lambda: read_grubhub_tables(keys)[0], rows=rows)
+
+    financial = tables.get('financial_summary')
+    if financial is None or financial.empty:
+        return
+    # The dashboard's default selection; summaries cover whole reporting periods
+    date_range = financial['start_date'].min(), financial['end_date'].max()
+
+    def dashboard_filter(df):
+        df = date_slice(df, 'start_date', (date_range[0], None))
+        return df[before_end_of(df['end_date'], date_range[1])]
+
+    selected = record('financial_performance', 'filter', lambda: dashboard_filter(financial), rows=len(financial))
+    record('financial_performance', 'kpis', lambda: metrics.grubhub_financial_kpis(
+        metrics.totals(selected, metrics.GRUBHUB_FINANCIAL_COLUMNS)), rows=len(selected))
+
+    operations = tables.get('operations_summary')
+    if operations is not None and not operations.empty:
+        operations_selected = record('operations_performance', 'filter', lambda: dashboard_filter(operations),
+                                     rows=len(operations))
+        record('operations_performance', 'kpis', lambda: metrics.grubhub_operations_kpis(
+            metrics.totals(operations_selected, metrics.GRUBHUB_OPERATIONS_COLUMNS)), rows=len(operations_selected))
+
+    stores = record('store_performance', 'aggregate', lambda: metrics.grubhub_store_performance(selected),
+                    rows=len(selected))
+    record('store_performance', 'chart', lambda: (stores.nlargest(10, 'subtotal_sales'),
+                                                  stores.nlargest(10, 'total_orders')), rows=len(stores))
+
+    products = tables.get('product_mix')
+    if products is not None and not products.empty:
+        record('product_performance', 'chart', lambda: (products.nlargest(15, 'quantity_sold'),
+                                                        products.nlargest(15, 'item_sales')), rows=len(products))
+
+    # A customer segment recomputes the KPIs from the order-level tables
+    orders, cancellations = (read_grubhub_table(key) if key in keys else None
+                             for key in ('order_details', 'cancellations'))
+    if orders is not None and cancellations is not None:
+        indexes = record('customer_segment', 'aggregate', lambda: (
+            segments.build_index('order_details', orders), segments.build_index('cancellations', cancellations)),
+            rows=len(orders) + len(cancellations))
+        segment = segments.segment_equals('Loyal', 'GH+')
+        segment_orders, segment_cancellations = record('customer_segment', 'filter', lambda: tuple(
+            index.select(date_range, segment=segment) for index in indexes), rows=len(orders) + len(cancellations))
+        record('customer_segment', 'kpis', lambda: metrics.grubhub_financial_kpis(
+            metrics.grubhub_order_sums(segment_orders, segment_cancellations)), rows=len(segment_orders))
+        record('customer_segment', 'chart', lambda: metrics.grubhub_order_store_performance(
+            segment_orders, segment_cancellations), rows=len(segment_orders))
+
+        # Heatmaps bin every order once, then sum slices of the histogram per filter state
+        histogram = record('demand_heatmap', 'aggregate', lambda: heatmaps.DemandHistogram(orders, cancellations),
+                           rows=len(orders) + len(cancellations))
+        store = orders['store_name'].iloc[0] if len(orders) else None
+        demand = record('demand_heatmap', 'filter', lambda: histogram.weekly(date_range, store),
+                        rows=len(orders) + len(cancellations))
+        record('demand_heatmap', 'chart', lambda: heatmaps.frame(demand, 'orders'), rows=7 * 24)
+
+
+PLATFORM_BENCHMARKS = {
+    'doordash': bench_doordash,
+    'grubhub': bench_grubhub,
+}
+
+
+def run(scales, platforms=tuple(PLATFORM_BENCHMARKS), workdir=WORKDIR, repeat=3, source_root='.'):
+    """Generate and benchmark every scale; returns the results document"""
+    source_root = os.path.abspath(source_root)
+    document = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'repeat': repeat,
+        'datasets': {},
+        'results': [],
+        'failures': [],
+    }
+    for scale in scales:
+        root = os.path.abspath(os.path.join(workdir, f'scale-{scale}'))
+        print(f"scale {scale}x: generating exports in {root}", file=sys.stderr)
+        document['datasets'][str(scale)] = generate(root, scale, source_root)
+        if not os.path.isabs(CACHE_DIR):
+            # Start from an empty ingest cache so the ingest timings are cold
+            shutil.rmtree(os.path.join(root, CACHE_DIR), ignore_errors=True)
+        with working_directory(root):
+            for name in platforms:
+                record = Recorder(scale, name, repeat)
+                print(f"scale {scale}x: benchmarking {name}", file=sys.stderr)
+                try:
+                    PLATFORM_BENCHMARKS[name](record)
+                except MemoryError as e:
+                    # Keep what finished before the failure; larger scales will not fare better
+                    document['failures'].append({'scale': scale, 'platform': name, 'error': repr(e)})
+                document['results'].extend(record.results)
+    return document
+
+
+# Reporting
+
+def _key(result):
+    return result['scale'], result['platform'], result['section'], result['stage']
+
+
+def summary(results, baseline=None):
+    """Results as a table, with the ratio to ``baseline`` when given"""
+    table = pd.DataFrame(results, columns=['scale', 'platform', 'section', 'stage', 'seconds', 'rows'])
+    if baseline:
+        previous = {_key(result): result['seconds'] for result in baseline}
+        table['baseline'] = [previous.get(_key(result)) for result in results]
+        table['ratio'] = table['seconds'] / table['baseline']
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard data path on synthetic exports')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000],
+                        help='sizes to generate, as multiples of the bundled exports')
+    parser.add_argument('--platform', choices=sorted(PLATFORM_BENCHMARKS), action='append',
+                        help='benchmark only this platform (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing; the fastest is kept')
+    parser.add_argument('--workdir', default=WORKDIR, help='where the synthetic exports are generated')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    document = run(args.scales, args.platform or tuple(PLATFORM_BENCHMARKS), args.workdir, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary(document['results'], baseline).to_string(index=False))
+    for failure in document['failures']:
+        print(f"scale {failure['scale']}x {failure['platform']} failed: {failure['error']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Chart data layer: minimal figure inputs and reusable figures.
+
+Charts never receive a whole filtered frame. Bar charts get the ``n``
+largest rows of the two columns they plot, funnels one total per stage and
+heatmaps one value per cell.
+
+Building a figure with Plotly Express costs far more than plotting it.
+Figures are therefore cached under a hash of their input arrays and
+options, and a rerun that plots the same data reuses the figure. The cache
+is measured by the size of the figures' data arrays and bounded by
+``TODC_FIGURE_CACHE_MB``. Cached figures are shared and must not be
+modified.
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from result_cache import ResultCache
+
+FIGURE_CACHE_MB = float(os.environ.get('TODC_FIGURE_CACHE_MB', '32'))
+
+
+def _data_size(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'O':
+            return sum(len(str(item)) for item in value)
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_data_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_data_size(item) for item in value)
+    if isinstance(value, str):
+        return len(value)
+    return 8
+
+
+def figure_size(figure):
+    """Estimated bytes of a figure: the size of its traces' data, without serializing it"""
+    return sum(_data_size(trace.to_plotly_json()) for trace in figure.data)
+
+
+FIGURES = ResultCache(max_bytes=int(FIGURE_CACHE_MB * 2 ** 20), sizeof=figure_size)
+
+
+def data_key(data, *options):
+    """Hash of a chart's input frame and options, the figure cache key"""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    digest.update(repr((list(data.columns), options)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _bar_figure(data, x, y, title, color_scale):
+    figure = px.bar(data, x=x, y=y, title=title, color=y, color_continuous_scale=color_scale)
+    figure.update_layout(xaxis_tickangle=-45, height=400)
+    return figure
+
+
+def bar_chart(frame, x, y, title, color_scale, n=None):
+    """Bar chart of ``y`` by ``x`` colored by ``y``, for the ``n`` largest ``y`` (all rows if ``None``)"""
+    data = frame.nlargest(n, y) if n else frame
+    # Plain labels: a categorical would carry every store of the dictionary
+    data = pd.DataFrame({x: data[x].astype(str).to_numpy(), y: data[y].to_numpy()})
+    return FIGURES.get('bar', None, data_key(data, title, color_scale),
+                       lambda: _bar_figure(data, x, y, title, color_scale))
+
+
+def _funnel_figure(data, title):
+    figure = go.Figure(go.Funnel(y=data['stage'], x=data['value'], textinfo='value+percent previous'))
+    figure.update_layout(title=title, height=400)
+    return figure
+
+
+def funnel_chart(stages, title):
+    """Funnel of ``stages`` (stage name -> count), each stage labelled with its share of the previous one"""
+    data = pd.DataFrame({'stage': list(stages), 'value': list(stages.values())})
+    return FIGURES.get('funnel', None, data_key(data, title), lambda: _funnel_figure(data, title))
+
+
+def _heatmap_figure(data, title, color_scale):
+    figure = px.imshow(data, title=title, color_continuous_scale=color_scale, aspect='auto',
+                       labels={'x': 'Hour', 'y': 'Day', 'color': title})
+    figure.update_layout(height=400)
+    return figure
+
+
+def heatmap_chart(frame, title, color_scale):
+    """Heatmap of a small row x column frame, e.g. weekday x hour"""
+    return FIGURES.get('heatmap', None, data_key(frame, list(frame.index), title, color_scale),
+                       lambda: _heatmap_figure(frame, title, color_scale))
@@ -0,0 +1,235 @@
+"""Columnar ingest cache for the DoorDash and GrubHub CSV exports.
+
+Every export is parsed once into a typed Parquet file under ``CACHE_DIR``.
+A small JSON manifest next to it records the source file's mtime, size and
+content hash, so later loads skip CSV parsing entirely and memory-map the
+Parquet file instead. If the source changes, the cache entry is rebuilt.
+
+The cache always holds every column of an export; callers pass ``columns``
+to read only the projection they need.
+
+``read_exports`` loads several exports at once. pandas' CSV parser holds the
+GIL, so stale exports are converted in worker processes, while Parquet reads
+release it and run on a thread pool.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (required by pandas for Parquet I/O)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CACHE_DIR = os.environ.get('TODC_CACHE_DIR', '.todc_cache')
+
+# Bump when the parsing rules change so existing cache entries are rebuilt
+INGEST_VERSION = 1
+
+# Worker pool size for read_exports; 0 means one worker per CPU
+LOAD_WORKERS = int(os.environ.get('TODC_LOAD_WORKERS', '0'))
+
+logger = logging.getLogger(__name__)
+
+# All export date columns use ISO dates; an explicit format avoids pandas'
+# slow per-value format inference
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def file_fingerprint(path):
+    """Return the cheap (mtime, size) fingerprint of a source file"""
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the SHA-1 content hash of a source file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_csv(path, date_columns=(), date_errors='raise', columns=None, dtypes=None):
+    """Parse an export CSV with explicit date formats and column dtypes"""
+    df = pd.read_csv(path, usecols=columns, dtype=dtypes)
+    for col in date_columns:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors=date_errors)
+    return df
+
+
+def _cache_stem(path):
+    # Exports from different windows share file names (e.g. grubhub/*.csv),
+    # so prefix the stem with a hash of the absolute source path
+    source = os.path.abspath(path)
+    prefix = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return f"{prefix}_{os.path.splitext(os.path.basename(path))[0]}"
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _ingest_options(date_columns, date_errors, dtypes):
+    return {
+        'version': INGEST_VERSION,
+        'date_columns': sorted(date_columns),
+        'date_errors': date_errors,
+        'dtypes': dict(sorted((dtypes or {}).items())),
+    }
+
+
+def is_cached(path, date_columns=(), date_errors='raise', dtypes=None, cache_dir=None):
+    """True when ``path`` has an up-to-date Parquet copy for these options"""
+    cache_dir = cache_dir or CACHE_DIR
+    manifest = _read_manifest(os.path.join(cache_dir, _cache_stem(path) + '.json'))
+    if manifest is None or manifest.get('options') != _ingest_options(date_columns, date_errors, dtypes):
+        return False
+    fingerprint = file_fingerprint(path)
+    return (all(manifest[k] == v for k, v in fingerprint.items())
+            and os.path.exists(os.path.join(cache_dir, manifest['parquet'])))
+
+
+def ingest(path, date_columns=(), date_errors='raise', dtypes=None, cache_dir=None):
+    """Make sure ``path`` has an up-to-date Parquet copy and return its manifest
+
+    ``cache_dir`` defaults to ``CACHE_DIR`` as it is when called.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = _cache_stem(path)
+    manifest_path = os.path.join(cache_dir, stem + '.json')
+    manifest = _read_manifest(manifest_path)
+    fingerprint = file_fingerprint(path)
+    options = _ingest_options(date_columns, date_errors, dtypes)
+
+    if manifest is not None and manifest.get('options') == options:
+        parquet_path = os.path.join(cache_dir, manifest['parquet'])
+        if os.path.exists(parquet_path):
+            if all(manifest[k] == v for k, v in fingerprint.items()):
+                return manifest
+            # The file was touched; only rebuild if its content actually changed
+            if file_hash(path) == manifest['sha1']:
+                manifest.update(fingerprint)
+                _write_json(manifest_path, manifest)
+                return manifest
+
+    sha1 = file_hash(path)
+    df = parse_csv(path, date_columns, date_errors, dtypes=dtypes)
+    parquet_name = f"{stem}-{sha1[:16]}.parquet"
+    parquet_path = os.path.join(cache_dir, parquet_name)
+    df.to_parquet(parquet_path + '.tmp', index=False)
+    os.replace(parquet_path + '.tmp', parquet_path)
+
+    # Remove the Parquet file of the previous version of this export
+    if manifest is not None and manifest.get('parquet') != parquet_name:
+        stale_path = os.path.join(cache_dir, manifest['parquet'])
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    manifest = {
+        'source': os.path.abspath(path),
+        'sha1': sha1,
+        'parquet': parquet_name,
+        'rows': len(df),
+        'options': options,
+        **fingerprint,
+    }
+    _write_json(manifest_path, manifest)
+    return manifest
+
+
+def read_export(path, date_columns=(), date_errors='raise', columns=None, dtypes=None, cache_dir=None):
+    """Load an export, going through the Parquet cache when pyarrow is available
+
+    ``columns`` restricts the load to those columns (``None`` reads all of
+    them); ``dtypes`` maps column names to explicit parse dtypes.
+    """
+    if not HAS_PYARROW:
+        return parse_csv(path, date_columns, date_errors, columns=columns, dtypes=dtypes)
+
+    cache_dir = cache_dir or CACHE_DIR
+    manifest = ingest(path, date_columns, date_errors, dtypes=dtypes, cache_dir=cache_dir)
+    return pd.read_parquet(os.path.join(cache_dir, manifest['parquet']), columns=columns, memory_map=True)
+
+
+def row_count(path, date_columns=(), date_errors='raise', dtypes=None):
+    """Return the number of rows in an export without keeping it in memory"""
+    if not HAS_PYARROW:
+        return len(parse_csv(path, date_columns, date_errors, dtypes=dtypes))
+    return ingest(path, date_columns, date_errors, dtypes=dtypes)['rows']
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _map(executor_class, func, jobs, max_workers):
+    """Run ``func(**job)`` for every job, returning name -> (result, seconds)"""
+    if len(jobs) <= 1 or max_workers == 1:
+        return {name: _timed(func, **job) for name, job in jobs.items()}
+    options = {'max_workers': min(max_workers, len(jobs))}
+    if executor_class is ProcessPoolExecutor:
+        # Streamlit runs several threads, which makes forking unsafe
+        options['mp_context'] = get_context('spawn')
+    with executor_class(**options) as executor:
+        futures = {name: executor.submit(_timed, func, **job) for name, job in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def read_exports(jobs, max_workers=None):
+    """Load several exports concurrently
+
+    ``jobs`` maps a name to the keyword arguments of ``read_export``. Returns
+    ``(frames, timings)``, both keyed by name; ``timings`` holds the seconds
+    spent on each file (CSV conversion plus read). Every job gets this
+    process's ``CACHE_DIR``: spawned workers re-import this module and would
+    otherwise use its default.
+    """
+    max_workers = max_workers or LOAD_WORKERS or os.cpu_count() or 1
+    timings = dict.fromkeys(jobs, 0.0)
+
+    if not HAS_PYARROW:
+        parsed = _map(ProcessPoolExecutor, parse_csv, jobs, max_workers)
+        frames = {name: result for name, (result, _) in parsed.items()}
+        timings.update({name: seconds for name, (_, seconds) in parsed.items()})
+    else:
+        jobs = {name: {'cache_dir': CACHE_DIR, **job} for name, job in jobs.items()}
+        ingest_keys = ('path', 'date_columns', 'date_errors', 'dtypes', 'cache_dir')
+        stale = {
+            name: {k: v for k, v in job.items() if k in ingest_keys}
+            for name, job in jobs.items()
+            if not is_cached(**{k: v for k, v in job.items() if k in ingest_keys})
+        }
+        for name, (_, seconds) in _map(ProcessPoolExecutor, ingest, stale, max_workers).items():
+            timings[name] += seconds
+        loaded = _map(ThreadPoolExecutor, read_export, jobs, max_workers)
+        frames = {name: result for name, (result, _) in loaded.items()}
+        for name, (_, seconds) in loaded.items():
+            timings[name] += seconds
+
+    for name, seconds in timings.items():
+        logger.info("loaded %s in %.3fs", name, seconds)
+    return frames, timings
@@ -1,9 +1,10 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, date
 import numpy as np
+from exports import ExportHistory, export_signature
+from filters import combine_masks, date_mask, equals_mask, take
 
 # Page configuration
 st.set_page_config(
@@ -64,18 +65,19 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# One history per export kind, shared across sessions so new windows are appended
+@st.cache_resource
+def get_export_history(kind):
+    return ExportHistory(kind)
+
 # Load data function
 @st.cache_data
-def load_data():
-    """Load and cache the marketing and financial data"""
+def load_data(signature):
+    """Load and cache the marketing and financial data across every export window"""
     try:
-        # Load marketing data
-        marketing_df = pd.read_csv('marketing_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z/MARKETING_PROMOTION_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z.csv')
-        marketing_df['Date'] = pd.to_datetime(marketing_df['Date'])
-        
-        # Load financial data
-        financial_df = pd.read_csv('financial_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z/FINANCIAL_DETAILED_TRANSACTIONS_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z.csv')
-        financial_df['Timestamp local date'] = pd.to_datetime(financial_df['Timestamp local date'])
+        # ``signature`` changes whenever an export window is added or removed
+        marketing_df = get_export_history('promotion').refresh()
+        financial_df = get_export_history('detailed_transactions').refresh()
         
         return marketing_df, financial_df
     except Exception as e:
@@ -110,7 +112,7 @@ if not doordash_btn and not ubereats_btn and not grubhub_btn:
     doordash_btn = True  # Default to DoorDash
 
 # Load data
-marketing_df, financial_df = load_data()
+marketing_df, financial_df = load_data(export_signature('promotion', 'detailed_transactions'))
 
 if marketing_df is not None and financial_df is not None:
     
@@ -155,39 +157,27 @@ if marketing_df is not None and financial_df is not None:
     financial_stores = ['All'] + sorted(financial_df['Store name'].unique().tolist())
     selected_financial_store = st.sidebar.selectbox("Select Store (Financial)", financial_stores)
     
-    # Apply filters to marketing data
-    marketing_filtered = marketing_df.copy()
-    
-    if len(marketing_date_range) == 2:
-        marketing_filtered = marketing_filtered[
-            (marketing_filtered['Date'].dt.date >= marketing_date_range[0]) &
-            (marketing_filtered['Date'].dt.date <= marketing_date_range[1])
-        ]
-    
-    if selected_self_serve != 'All':
-        self_serve_bool = selected_self_serve == 'True'
-        marketing_filtered = marketing_filtered[marketing_filtered['Is self serve campaign'] == self_serve_bool]
-    
-    if selected_marketing_store != 'All':
-        marketing_filtered = marketing_filtered[marketing_filtered['Store name'] == selected_marketing_store]
-    
-    # Apply filters to financial data
-    financial_filtered = financial_df.copy()
-    
-    # Apply transaction type and status filters
-    financial_filtered = financial_filtered[
-        (financial_filtered['Transaction type'] == 'Order') &
-        (financial_filtered['Final order status'] == 'Delivered')
-    ]
-    
-    if len(financial_date_range) == 2:
-        financial_filtered = financial_filtered[
-            (financial_filtered['Timestamp local date'].dt.date >= financial_date_range[0]) &
-            (financial_filtered['Timestamp local date'].dt.date <= financial_date_range[1])
-        ]
+    # Apply filters to marketing data: every filter becomes one mask and the
+    # cached frame is only copied once, for the selected rows
+    marketing_mask = combine_masks(
+        date_mask(marketing_df['Date'], marketing_date_range),
+        equals_mask(marketing_df, {
+            'Is self serve campaign': (selected_self_serve == 'True') if selected_self_serve != 'All' else None,
+            'Store name': selected_marketing_store if selected_marketing_store != 'All' else None
+        })
+    )
+    marketing_filtered = take(marketing_df, marketing_mask)
     
-    if selected_financial_store != 'All':
-        financial_filtered = financial_filtered[financial_filtered['Store name'] == selected_financial_store]
+    # Apply filters to financial data, including the transaction type and status filters
+    financial_mask = combine_masks(
+        equals_mask(financial_df, {
+            'Transaction type': 'Order',
+            'Final order status': 'Delivered',
+            'Store name': selected_financial_store if selected_financial_store != 'All' else None
+        }),
+        date_mask(financial_df['Timestamp local date'], financial_date_range)
+    )
+    financial_filtered = take(financial_df, financial_mask)
     
     # Two column layout
     col1, col2 = st.columns(2)
@@ -309,19 +299,16 @@ if marketing_df is not None and financial_df is not None:
     if selected_marketing_store != 'All':
         st.markdown('<div class="section-header">📋 Campaign Level Analysis - ' + selected_marketing_store + '</div>', unsafe_allow_html=True)
         
-        # Get campaign data for selected store
-        store_campaigns = marketing_filtered[marketing_filtered['Store name'] == selected_marketing_store].copy()
+        # Get campaign data for selected store (marketing_filtered is already limited to it)
+        store_campaigns = marketing_filtered
         
         if len(store_campaigns) > 0:
-            # Prepare campaign data for display
-            campaign_data = store_campaigns[['Campaign name', 'Type of promotion', 'Date', 'Orders', 'Sales', 'ROAS', 
-                                           'New customers acquired', 'New DP customers acquired', 'Average order value']].copy()
-            
-            # Sort by date
-            campaign_data = campaign_data.sort_values('Date', ascending=False)
+            # Prepare campaign data for display; the sorted frame is new, so it is formatted in place
+            campaign_display = store_campaigns[['Campaign name', 'Type of promotion', 'Date', 'Orders', 'Sales', 'ROAS', 
+                                              'New customers acquired', 'New DP customers acquired', 'Average order value']]
+            campaign_display = campaign_display.sort_values('Date', ascending=False)
             
             # Format the data for display
-            campaign_display = campaign_data.copy()
             campaign_display['Date'] = campaign_display['Date'].dt.strftime('%Y-%m-%d')
             campaign_display['Sales'] = campaign_display['Sales'].apply(lambda x: f"${x:,.2f}")
             campaign_display['Average order value'] = campaign_display['Average order value'].apply(lambda x: f"${x:,.2f}")
@@ -388,7 +375,7 @@ if marketing_df is not None and financial_df is not None:
 else:
     st.error("❌ Unable to load data. Please check that the CSV files are in the correct location.")
     st.info("""
-    **Required files:**
-    - `marketing_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z/MARKETING_PROMOTION_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z.csv`
-    - `financial_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z/FINANCIAL_DETAILED_TRANSACTIONS_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z.csv`
+    **Required files** (one or more export windows):
+    - `marketing_<start>_<end>_<tag>_<exported_at>/MARKETING_PROMOTION_*.csv`
+    - `financial_<start>_<end>_<tag>_<exported_at>/FINANCIAL_DETAILED_TRANSACTIONS_*.csv`
     """)
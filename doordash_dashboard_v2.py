@@ -1,9 +1,26 @@
+import functools
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, date
 import numpy as np
+from exports import ExportHistory
+import charts
+import heatmaps
+import metrics
+import rollups
+import tables
+from filters import before_end_of, combine_masks, date_slice, equals_mask, select, take
+from schema import CAMPAIGN_TABLE_COLUMNS, SECTION_COLUMNS, projected_columns
+from platforms import (GRUBHUB_FILES, LazyDatasets, grubhub_row_count, prepare_doordash_export, read_grubhub_table,
+                       read_grubhub_tables)
+from profiling import PROFILE_DEFAULT, Profiler
+from query_engine import QUERY_ENGINE, connect
+import reconciliation
+import segments
+import shared_data
+from result_cache import ResultCache, filter_key
+from watcher import DataWatcher, dataset_files
 
 # Page configuration
 st.set_page_config(
@@ -13,6 +30,37 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Keyed fragments and st.rerun(<fragment keys>) from widget callbacks need Streamlit 1.63
+STREAMLIT_MIN_VERSION = (1, 63)
+if tuple(int(part) for part in st.__version__.split('.')[:2]) < STREAMLIT_MIN_VERSION:
+    st.error(f"This dashboard needs Streamlit {'.'.join(map(str, STREAMLIT_MIN_VERSION))} or later "
+             f"(found {st.__version__}). Run `pip install -r requirements.txt`.")
+    st.stop()
+
+# Per-section timings and memory for the optional profiling panel
+# (TODC_PROFILE=1, or ?profile=1 in the URL). The session keeps one profiler:
+# a full run and a run of fragments alone are each a rerun of their own.
+if 'profiler' not in st.session_state:
+    st.session_state['profiler'] = Profiler(False)
+profiler = st.session_state['profiler']
+profiler.start(PROFILE_DEFAULT or 'profile' in getattr(st, 'query_params', {}))
+
+def finish_profile():
+    profiler.finish(result_cache=results.stats(), figure_cache=charts.FIGURES.stats())
+
+def profiled(fragment):
+    """Fragment profiled as a rerun of its own when it runs without the rest of the page"""
+    @functools.wraps(fragment)
+    def run(*args, **kwargs):
+        if profiler.running or not profiler.enabled:
+            return fragment(*args, **kwargs)
+        profiler.start()
+        try:
+            return fragment(*args, **kwargs)
+        finally:
+            finish_profile()
+    return run
+
 # Custom CSS for branding
 st.markdown("""
 <style>
@@ -64,63 +112,229 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Load data function
-@st.cache_data
-def load_data():
-    """Load and cache the marketing and financial data"""
+# One history per export kind, shared across sessions so new windows are appended.
+# Only the columns the dashboard sections read are loaded. With the shared store
+# the history appends to the memory-mapped frame instead of a private copy.
+@st.cache_resource
+def get_export_history(kind):
+    return ExportHistory(kind, columns=projected_columns(kind))
+
+# Load data function. Frames are memory-mapped from the shared store (see
+# shared_data.py) and handed to every session as is: they are read-only.
+@st.cache_resource
+def load_export(kind, signature):
+    """Load and cache every export window of one DoorDash export kind"""
     try:
-        # Load marketing data
-        marketing_df = pd.read_csv('marketing_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z/MARKETING_PROMOTION_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z.csv')
-        marketing_df['Date'] = pd.to_datetime(marketing_df['Date'])
-        
-        # Load financial data
-        financial_df = pd.read_csv('financial_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z/FINANCIAL_DETAILED_TRANSACTIONS_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z.csv')
-        financial_df['Timestamp local date'] = pd.to_datetime(financial_df['Timestamp local date'])
-        
-        return marketing_df, financial_df
+        # ``signature`` changes whenever an export window is added, removed or rewritten.
+        # Frames are kept sorted by date so date filters are binary searches,
+        # with store, campaign and status columns encoded as categoricals.
+        history = get_export_history(kind)
+        frame = shared_data.shared_frame(kind, signature, lambda: prepare_doordash_export(kind, history.refresh()))
+        if shared_data.enabled():
+            history.adopt(frame)
+        return frame
     except Exception as e:
         st.error(f"Error loading data: {e}")
-        return None, None
+        return None
+
+# Aggregate cubes answering the DoorDash metrics and charts
+CUBE_BUILDERS = {
+    'promotion': rollups.build_marketing_cube,
+    'sponsored_listing': rollups.build_sponsored_cube,
+    'detailed_transactions': rollups.build_financial_cube
+}
+
+@st.cache_resource
+def load_cube(kind, signature):
+    """Build and cache the aggregate cube of one DoorDash export kind"""
+    def build():
+        df = load_export(kind, signature)
+        return None if df is None else CUBE_BUILDERS[kind](df)
+    return shared_data.shared_frame(f'{kind} cube', signature, build)
+
+def doordash_datasets():
+    """DoorDash row-level frames and cubes, each loaded on first access"""
+    signatures = {kind: data_watcher.version(kind) for kind in CUBE_BUILDERS}
+    loaders = {
+        'marketing': lambda: load_export('promotion', signatures['promotion']),
+        'financial': lambda: load_export('detailed_transactions', signatures['detailed_transactions']),
+        'marketing_cube': lambda: load_cube('promotion', signatures['promotion']),
+        'financial_cube': lambda: load_cube('detailed_transactions', signatures['detailed_transactions'])
+    }
+    versions = {
+        'marketing': signatures['promotion'],
+        'financial': signatures['detailed_transactions'],
+        'marketing_cube': signatures['promotion'],
+        'financial_cube': signatures['detailed_transactions']
+    }
+    # Sponsored Listing is optional: its section is skipped when no export is on disk
+    if signatures['sponsored_listing']:
+        loaders['sponsored_cube'] = lambda: load_cube('sponsored_listing', signatures['sponsored_listing'])
+        versions['sponsored_cube'] = signatures['sponsored_listing']
+    return LazyDatasets({key: profiler.wrap(f'Load {key}', loader) for key, loader in loaders.items()},
+                        versions=versions)
 
 # Load GrubHub data function
-@st.cache_data
-def load_grubhub_data():
-    """Load and cache all GrubHub data files"""
+@st.cache_resource
+def load_grubhub_table(key, version):
+    """Load and cache one version of one GrubHub data file"""
     try:
-        import os
-        data = {}
-        
-        # Load all CSV files
-        files = {
-            'financial_summary': 'grubhub/financial_summary.csv',
-            'operations_summary': 'grubhub/operations_summary.csv',
-            'order_details': 'grubhub/order_details.csv',
-            'transactions': 'grubhub/transactions.csv',
-            'product_mix': 'grubhub/product_mix.csv',
-            'cancellations': 'grubhub/cancellations.csv',
-            'deposits': 'grubhub/deposits.csv',
-            'deposit_details': 'grubhub/deposit_details.csv'
-        }
-        
-        for key, file_path in files.items():
-            if os.path.exists(file_path):
-                df = pd.read_csv(file_path)
-                
-                # Convert date columns
-                date_columns = ['start_date', 'end_date', 'order_date', 'transaction_date', 'cancellation_date', 'payout_date']
-                for col in date_columns:
-                    if col in df.columns:
-                        df[col] = pd.to_datetime(df[col], errors='coerce')
-                
-                data[key] = df
-            else:
-                data[key] = pd.DataFrame()
-        
-        return data
+        return shared_data.shared_frame(key, version, lambda: read_grubhub_table(key))
+    except Exception as e:
+        st.error(f"Error loading GrubHub data: {e}")
+        return pd.DataFrame()
+
+@st.cache_resource(max_entries=8)
+def load_grubhub_tables(keys, versions):
+    """Load and cache several GrubHub data files in parallel"""
+    try:
+        return shared_data.shared_frames(dict(zip(keys, versions)), lambda missing: read_grubhub_tables(missing)[0])
     except Exception as e:
         st.error(f"Error loading GrubHub data: {e}")
+        return {key: pd.DataFrame() for key in keys}
+
+def grubhub_datasets():
+    """GrubHub tables found on disk, each loaded on first access"""
+    versions = {key: data_watcher.version(key) for key in GRUBHUB_FILES if data_watcher.version(key)}
+    return LazyDatasets(
+        {key: profiler.wrap(f'Load {key}', lambda key=key: load_grubhub_table(key, versions[key]))
+         for key in versions},
+        batch_loader=profiler.wrap('Load GrubHub tables', lambda keys: load_grubhub_tables(
+            keys, tuple(versions[key] for key in keys))),
+        versions=versions
+    )
+
+# Customer segment masks of a GrubHub order table (see segments.py), built once
+# per data version. ``versions`` holds ``(table, version)`` pairs: the table
+# itself and, for transactions, the order tables holding their customer types.
+@st.cache_resource
+def get_segment_index(key, versions):
+    tables = {name: load_grubhub_table(name, version) for name, version in versions}
+    return segments.build_index(key, tables.pop(key), **tables)
+
+# Hour x weekday demand histograms of every store (see heatmaps.py), built once
+# per version of order_details and cancellations; filters only sum slices of it
+@st.cache_resource
+def get_demand_histogram(versions):
+    orders, cancellations = (load_grubhub_table(name, version) for name, version in versions)
+    return heatmaps.DemandHistogram(orders, cancellations)
+
+# Filter results shared across sessions and reruns, keyed by data version and
+# filter state, within a memory budget (TODC_RESULT_CACHE_MB)
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+results = get_result_cache()
+
+# Versions of the files behind every dataset, kept current by a polling thread
+# (TODC_WATCH_INTERVAL). A data drop only evicts what was derived from the
+# datasets it changed, so the caches of every other dataset stay warm.
+def drop_stale(changes):
+    """Evict the frames and results of the old version of every changed dataset"""
+    for dataset, (old, _) in changes.items():
+        load_export.clear(dataset, old)
+        load_cube.clear(dataset, old)
+        load_grubhub_table.clear(dataset, old)
+        shared_data.evict(dataset, old)
+        shared_data.evict(f'{dataset} cube', old)
+        results.invalidate(old)
+        if dataset in GRUBHUB_FILES:
+            # Batches are keyed by every version they hold; the unchanged
+            # tables of a cleared batch attach their shared files again
+            load_grubhub_tables.clear()
+        if dataset in segments.ORDER_TABLES:
+            get_segment_index.clear()
+            get_demand_histogram.clear()
+
+@st.cache_resource
+def get_data_watcher():
+    data_watcher = DataWatcher(dataset_files())
+    data_watcher.subscribe(drop_stale)
+    return data_watcher
+
+data_watcher = get_data_watcher()
+
+# Optional embedded SQL engine answering the KPIs and store rankings
+# (TODC_QUERY_ENGINE=duckdb or sqlite); None keeps the pandas path.
+# Only the tables whose files changed are registered afresh.
+@st.cache_resource
+def get_query_engine(name):
+    engine = connect(name)
+    if engine:
+        data_watcher.subscribe(lambda changes: engine.forget(*changes))
+    return engine
+
+# Transactions matched to payouts (see reconciliation.py), once per data version
+@st.cache_data(max_entries=4)
+def load_reconciliation(platform, signature):
+    """Reconcile and cache one platform's transactions against its payouts"""
+    try:
+        if platform == "GrubHub":
+            return reconciliation.grubhub_reconciliation()
+        return reconciliation.doordash_reconciliation()
+    except Exception as e:
+        st.error(f"Error reconciling payouts: {e}")
         return {}
 
+# Sections with their own widgets are fragments: interacting with them reruns
+# the section alone, and keeps the rest of the page (and the platform) as is
+@st.fragment
+@profiled
+def reconciliation_section(platform, signature):
+    """Payout reconciliation summary and discrepancies, computed only on request"""
+    st.markdown('<div class="section-header">🧾 Payout Reconciliation</div>', unsafe_allow_html=True)
+    
+    if not st.checkbox("Reconcile transactions against payouts", key=f"reconcile_{platform}"):
+        return
+    
+    with profiler.section('Payout reconciliation') as record:
+        checks = load_reconciliation(platform, signature)
+        record['rows_out'] = sum(len(result) for result in checks.values())
+    if not checks:
+        st.info("No payout data available to reconcile.")
+        return
+    
+    overview = reconciliation.summary(checks)
+    include_edges = not st.checkbox(
+        f"Hide discrepancies within {reconciliation.EDGE_DAYS} days of the export window edges",
+        key=f"reconcile_edges_{platform}"
+    )
+    issues = reconciliation.discrepancies(checks, include_edges=include_edges)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        matched = int(overview.loc[overview['status'] == reconciliation.MATCHED, 'rows'].sum())
+        st.metric(label="✅ Matched", value=f"{matched:,}")
+    with col2:
+        st.metric(label="⚠️ Discrepancies", value=f"{len(issues):,}")
+    with col3:
+        at_stake = issues.filter(like=' difference').abs().max(axis=1).sum()
+        st.metric(label="💲 Amount at Stake", value=f"${at_stake:,.2f}")
+    
+    st.dataframe(overview, use_container_width=True, hide_index=True)
+    if not issues.empty:
+        st.dataframe(issues, use_container_width=True, hide_index=True, height=400)
+        st.download_button("Download discrepancies (CSV)", issues.to_csv(index=False),
+                           file_name=f"{platform.lower()}_reconciliation.csv", mime="text/csv")
+
+# Sidebar filters rerun the sections reading them; ``sections`` maps each
+# section's fragment key to the widget keys it reads. The sections run as one
+# profiled rerun, and the profiling panel, rerun last, closes and shows it.
+def rerun_sections(sections, widget):
+    """Widget callback rerunning only the sections (fragment keys) that read ``widget``"""
+    keys = [key for key, inputs in sections.items() if widget in inputs]
+    if profiler.enabled:
+        profiler.start()
+        keys.append('profiling_panel')
+    st.rerun(keys)
+
+# Platform registry: only the selected platform's datasets are ever loaded
+PLATFORM_DATASETS = {
+    'DoorDash': doordash_datasets,
+    'GrubHub': grubhub_datasets
+}
+
 # Main header
 st.markdown("""
 <div class="main-header">
@@ -148,10 +362,6 @@ if ubereats_btn:
 if not doordash_btn and not ubereats_btn and not grubhub_btn:
     doordash_btn = True  # Default to DoorDash
 
-# Load data
-marketing_df, financial_df = load_data()
-grubhub_data = load_grubhub_data()
-
 # Determine which platform to show
 selected_platform = "DoorDash"  # Default
 if grubhub_btn:
@@ -159,11 +369,23 @@ if grubhub_btn:
 elif doordash_btn:
     selected_platform = "DoorDash"
 
+# Datasets of the selected platform; each one loads on first use
+platform_data = PLATFORM_DATASETS[selected_platform]()
+engine = get_query_engine(QUERY_ENGINE)
+if selected_platform == "GrubHub":
+    grubhub_data = platform_data
+else:
+    marketing_cube = platform_data['marketing_cube']
+    financial_cube = platform_data['financial_cube']
+
 # Show platform-specific analysis
 if selected_platform == "GrubHub" and grubhub_data:
     # Platform indicator
     st.markdown(f"### 🍕 Currently Viewing: GrubHub Analytics")
     
+    # Load every table the sections below read in one parallel pass
+    grubhub_data.prefetch(SECTION_COLUMNS)
+    
     # GrubHub sidebar filters
     st.sidebar.markdown("## 🎛️ GrubHub Dashboard Controls")
     
@@ -195,39 +417,89 @@ if selected_platform == "GrubHub" and grubhub_data:
     
     # Customer type filter
     st.sidebar.markdown("### 👥 Customer Type Filter")
-    customer_types = ['All', 'New', 'Returning', 'Loyal']
+    customer_types = ['All'] + segments.CUSTOMER_TYPES
     selected_customer_type = st.sidebar.selectbox("Customer Type", customer_types)
     
     # GH+ filter
-    gh_plus_options = ['All', 'GH+', 'Non-GH+']
+    gh_plus_options = ['All'] + list(segments.GH_PLUS_VALUES)
     selected_gh_plus = st.sidebar.selectbox("GH+ Customer", gh_plus_options)
     
     # Apply filters function
-    def apply_grubhub_filters(df, date_col='start_date', end_col='end_date'):
-        filtered_df = df.copy()
+    def filter_grubhub(df, date_col, end_col):
+        filtered_df = df
+        mask = None
         
         if date_range and len(date_range) == 2 and date_col in filtered_df.columns:
-            filtered_df = filtered_df[
-                (filtered_df[date_col].dt.date >= date_range[0]) &
-                (filtered_df[end_col].dt.date <= date_range[1])
-            ]
+            # Frames are sorted by start date at load; bound the start by binary search
+            filtered_df = date_slice(filtered_df, date_col, (date_range[0], None))
+            mask = before_end_of(filtered_df[end_col], date_range[1])
         
         if selected_store != 'All' and 'store_name' in filtered_df.columns:
-            filtered_df = filtered_df[filtered_df['store_name'] == selected_store]
+            mask = combine_masks(mask, equals_mask(filtered_df, {'store_name': selected_store}))
         
+        # The cached frame is never copied; only the selected rows are
+        return take(filtered_df, mask)
+    
+    # Filtered tables are memoized per filter state in the shared result cache
+    segment = segments.segment_equals(selected_customer_type, selected_gh_plus)
+    segment_selected = any(value is not None for value in segment.values())
+    grubhub_filters = filter_key(date_range=date_range, store=selected_store, **segment)
+    grubhub_equals = {'store_name': selected_store if selected_store != 'All' else None}
+    
+    def apply_grubhub_filters(key, date_col='start_date', end_col='end_date'):
+        df = grubhub_data[key]
+        with profiler.section(f'Filter {key}', rows_in=len(df)) as record:
+            filtered_df = results.get(f'{key} filtered', grubhub_data.versions[key], grubhub_filters,
+                                      lambda: filter_grubhub(df, date_col, end_col))
+            record['rows_out'] = len(filtered_df)
         return filtered_df
     
+    def segment_versions(key):
+        lookups = ['order_details', 'cancellations'] if key == 'transactions' else []
+        return tuple((name, grubhub_data.versions[name]) for name in [key] + lookups if name in grubhub_data)
+    
+    def apply_segment_filters(key):
+        """Rows of an order-level table in the selected date range, store and customer segment"""
+        index = get_segment_index(key, segment_versions(key))
+        with profiler.section(f'Filter {key}', rows_in=index.rows) as record:
+            # Precomputed segment masks ANDed with the date slice and store
+            orders = results.get(f'{key} filtered', segment_versions(key), grubhub_filters,
+                                 lambda: index.select(date_range, grubhub_equals['store_name'], segment))
+            record['rows_out'] = len(orders)
+        return orders
+    
+    # The period summaries carry no customer attributes: with a segment selected,
+    # the KPIs and store rankings are recomputed from that segment's orders
+    segment_sums = None
+    if segment_selected:
+        if 'order_details' in grubhub_data and 'cancellations' in grubhub_data:
+            segment_orders = apply_segment_filters('order_details')
+            segment_cancellations = apply_segment_filters('cancellations')
+            segment_sums = metrics.grubhub_order_sums(segment_orders, segment_cancellations)
+        else:
+            st.warning("⚠️ Customer Type and GH+ filters need order_details.csv and cancellations.csv; "
+                       "showing all customers.")
+    
     # Financial Analysis Section
     st.markdown('<div class="section-header">💰 Financial Performance</div>', unsafe_allow_html=True)
     
     if 'financial_summary' in grubhub_data and not grubhub_data['financial_summary'].empty:
-        financial_filtered = apply_grubhub_filters(grubhub_data['financial_summary'])
+        financial_filtered = apply_grubhub_filters('financial_summary')
         
         if not financial_filtered.empty:
+            with profiler.section('Financial Performance KPIs', rows_in=len(financial_filtered)):
+                if segment_sums is not None:
+                    financial_sums = segment_sums
+                elif engine:
+                    financial_sums = engine.totals('financial_summary', metrics.GRUBHUB_FINANCIAL_COLUMNS,
+                                                   date_range, grubhub_equals)
+                else:
+                    financial_sums = metrics.totals(financial_filtered, metrics.GRUBHUB_FINANCIAL_COLUMNS)
+                financial_kpis = metrics.grubhub_financial_kpis(financial_sums)
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                total_orders = financial_filtered['total_orders'].sum()
+                total_orders = financial_kpis['total_orders']
                 st.metric(
                     label="📦 Total Orders",
                     value=f"{total_orders:,}",
@@ -235,7 +507,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col2:
-                total_sales = financial_filtered['subtotal_sales'].sum()
+                total_sales = financial_kpis['total_sales']
                 st.metric(
                     label="💵 Total Sales",
                     value=f"${total_sales:,.2f}",
@@ -243,7 +515,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col3:
-                net_total = financial_filtered['merchant_net_total'].sum()
+                net_total = financial_kpis['net_total']
                 st.metric(
                     label="💰 Net Total",
                     value=f"${net_total:,.2f}",
@@ -251,7 +523,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col4:
-                avg_order_value = total_sales / total_orders if total_orders > 0 else 0
+                avg_order_value = financial_kpis['avg_order_value']
                 st.metric(
                     label="💵 Average Order Value",
                     value=f"${avg_order_value:.2f}",
@@ -262,7 +534,7 @@ if selected_platform == "GrubHub" and grubhub_data:
             col1, col2, col3 = st.columns(3)
             
             with col1:
-                total_commission = abs(financial_filtered['commission'].sum())
+                total_commission = financial_kpis['total_commission']
                 st.metric(
                     label="💸 Total Commission",
                     value=f"${total_commission:,.2f}",
@@ -270,7 +542,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col2:
-                commission_rate = (total_commission / total_sales * 100) if total_sales > 0 else 0
+                commission_rate = financial_kpis['commission_rate']
                 st.metric(
                     label="📊 Commission Rate",
                     value=f"{commission_rate:.1f}%",
@@ -278,7 +550,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col3:
-                total_tips = financial_filtered['tip'].sum()
+                total_tips = financial_kpis['total_tips']
                 st.metric(
                     label="💝 Total Tips",
                     value=f"${total_tips:,.2f}",
@@ -289,13 +561,22 @@ if selected_platform == "GrubHub" and grubhub_data:
     st.markdown('<div class="section-header">⚙️ Operations Performance</div>', unsafe_allow_html=True)
     
     if 'operations_summary' in grubhub_data and not grubhub_data['operations_summary'].empty:
-        ops_filtered = apply_grubhub_filters(grubhub_data['operations_summary'])
+        ops_filtered = apply_grubhub_filters('operations_summary')
         
         if not ops_filtered.empty:
+            with profiler.section('Operations Performance KPIs', rows_in=len(ops_filtered)):
+                if segment_sums is not None:
+                    operations_sums = segment_sums
+                elif engine:
+                    operations_sums = engine.totals('operations_summary', metrics.GRUBHUB_OPERATIONS_COLUMNS,
+                                                    date_range, grubhub_equals)
+                else:
+                    operations_sums = metrics.totals(ops_filtered, metrics.GRUBHUB_OPERATIONS_COLUMNS)
+                operations_kpis = metrics.grubhub_operations_kpis(operations_sums)
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                total_orders_ops = ops_filtered['total_orders'].sum()
+                total_orders_ops = operations_kpis['total_orders']
                 st.metric(
                     label="📦 Total Orders",
                     value=f"{total_orders_ops:,}",
@@ -303,8 +584,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col2:
-                cancelled_orders = ops_filtered['total_canceled_orders'].sum()
-                cancellation_rate = (cancelled_orders / total_orders_ops * 100) if total_orders_ops > 0 else 0
+                cancellation_rate = operations_kpis['cancellation_rate']
                 st.metric(
                     label="❌ Cancellation Rate",
                     value=f"{cancellation_rate:.1f}%",
@@ -312,8 +592,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col3:
-                new_customers = ops_filtered['new_customer_orders'].sum()
-                new_customer_rate = (new_customers / total_orders_ops * 100) if total_orders_ops > 0 else 0
+                new_customer_rate = operations_kpis['new_customer_rate']
                 st.metric(
                     label="🆕 New Customer Rate",
                     value=f"{new_customer_rate:.1f}%",
@@ -321,8 +600,7 @@ if selected_platform == "GrubHub" and grubhub_data:
                 )
             
             with col4:
-                gh_plus_orders = ops_filtered['gh_plus_customer_orders'].sum()
-                gh_plus_rate = (gh_plus_orders / total_orders_ops * 100) if total_orders_ops > 0 else 0
+                gh_plus_rate = operations_kpis['gh_plus_rate']
                 st.metric(
                     label="⭐ GH+ Customer Rate",
                     value=f"{gh_plus_rate:.1f}%",
@@ -334,37 +612,67 @@ if selected_platform == "GrubHub" and grubhub_data:
     
     if 'financial_summary' in grubhub_data and not grubhub_data['financial_summary'].empty:
         # Top performing stores
-        store_performance = financial_filtered.groupby('store_name').agg({
-            'total_orders': 'sum',
-            'subtotal_sales': 'sum',
-            'merchant_net_total': 'sum',
-            'commission': 'sum'
-        }).reset_index()
-        
-        store_performance['avg_order_value'] = store_performance['subtotal_sales'] / store_performance['total_orders']
-        store_performance['commission_rate'] = abs(store_performance['commission']) / store_performance['subtotal_sales'] * 100
+        with profiler.section('Store Performance Analysis', rows_in=len(financial_filtered)) as record:
+            if segment_sums is not None:
+                store_performance = results.get(
+                    'segment store performance', segment_versions('order_details') + segment_versions('cancellations'),
+                    grubhub_filters,
+                    lambda: metrics.grubhub_order_store_performance(segment_orders, segment_cancellations)
+                )
+            else:
+                store_performance = results.get(
+                    'store performance', (QUERY_ENGINE, grubhub_data.versions['financial_summary']), grubhub_filters,
+                    lambda: (engine.grubhub_store_performance(date_range, grubhub_equals) if engine
+                             else metrics.grubhub_store_performance(financial_filtered))
+                )
+            record['rows_out'] = len(store_performance)
         
         col1, col2 = st.columns(2)
         
-        with col1:
-            # Top stores by sales
-            top_stores_sales = store_performance.nlargest(10, 'subtotal_sales')
-            fig_sales = px.bar(top_stores_sales, x='store_name', y='subtotal_sales',
-                              title='Top 10 Stores by Sales',
-                              color='subtotal_sales',
-                              color_continuous_scale='Oranges')
-            fig_sales.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_sales, use_container_width=True)
-        
-        with col2:
-            # Top stores by orders
-            top_stores_orders = store_performance.nlargest(10, 'total_orders')
-            fig_orders = px.bar(top_stores_orders, x='store_name', y='total_orders',
-                               title='Top 10 Stores by Orders',
-                               color='total_orders',
-                               color_continuous_scale='Blues')
-            fig_orders.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_orders, use_container_width=True)
+        with profiler.section('Store Performance charts', rows_in=len(store_performance)):
+            with col1:
+                # Top stores by sales
+                fig_sales = charts.bar_chart(store_performance, 'store_name', 'subtotal_sales',
+                                             'Top 10 Stores by Sales', 'Oranges', n=10)
+                st.plotly_chart(fig_sales, use_container_width=True)
+            
+            with col2:
+                # Top stores by orders
+                fig_orders = charts.bar_chart(store_performance, 'store_name', 'total_orders',
+                                              'Top 10 Stores by Orders', 'Blues', n=10)
+                st.plotly_chart(fig_orders, use_container_width=True)
+    
+    # Demand Heatmap
+    st.markdown('<div class="section-header">🕐 Demand by Hour and Weekday</div>', unsafe_allow_html=True)
+    
+    # The measure picker reruns the heatmap alone; the sidebar filters it reads
+    # rerun the whole page
+    @st.fragment
+    @profiled
+    def demand_heatmap_section():
+        heatmap_measure = st.radio("Heatmap measure", list(heatmaps.MEASURES), horizontal=True,
+                                   format_func=heatmaps.MEASURES.get, key="grubhub_heatmap_measure")
+        
+        with profiler.section('Demand Heatmap', rows_in=len(grubhub_data['order_details'])) as record:
+            if segment_sums is not None:
+                # The histogram has no customer dimension: bin the segment's orders
+                demand = heatmaps.weekly_histogram(segment_orders, segment_cancellations)
+            else:
+                histogram = get_demand_histogram(segment_versions('order_details') + segment_versions('cancellations'))
+                demand = histogram.weekly(date_range, grubhub_equals['store_name'])
+            demand_frame = heatmaps.frame(demand, heatmap_measure)
+            record['rows_out'] = demand_frame.size
+        
+        with profiler.section('Demand Heatmap chart', rows_in=demand_frame.size):
+            store_label = selected_store if selected_store != 'All' else 'All Stores'
+            fig_heatmap = charts.heatmap_chart(demand_frame, f"{heatmaps.MEASURES[heatmap_measure]} - {store_label}",
+                                               'Reds' if heatmap_measure == 'cancellation_rate' else 'Oranges')
+            st.plotly_chart(fig_heatmap, use_container_width=True)
+    
+    if 'order_details' in grubhub_data and 'cancellations' in grubhub_data:
+        demand_heatmap_section()
+    else:
+        st.info("ℹ️ Demand heatmaps need order_details.csv and cancellations.csv.")
     
     # Product Performance Analysis
     st.markdown('<div class="section-header">🍽️ Product Performance</div>', unsafe_allow_html=True)
@@ -374,25 +682,21 @@ if selected_platform == "GrubHub" and grubhub_data:
         
         col1, col2 = st.columns(2)
         
-        with col1:
-            # Top selling items
-            top_items = product_data.nlargest(15, 'quantity_sold')
-            fig_items = px.bar(top_items, x='menu_item_name', y='quantity_sold',
-                              title='Top 15 Items by Quantity Sold',
-                              color='quantity_sold',
-                              color_continuous_scale='Greens')
-            fig_items.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_items, use_container_width=True)
-        
-        with col2:
-            # Top revenue items
-            top_revenue = product_data.nlargest(15, 'item_sales')
-            fig_revenue = px.bar(top_revenue, x='menu_item_name', y='item_sales',
-                                title='Top 15 Items by Revenue',
-                                color='item_sales',
-                                color_continuous_scale='Purples')
-            fig_revenue.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_revenue, use_container_width=True)
+        with profiler.section('Product Performance charts', rows_in=len(product_data)):
+            with col1:
+                # Top selling items
+                fig_items = charts.bar_chart(product_data, 'menu_item_name', 'quantity_sold',
+                                             'Top 15 Items by Quantity Sold', 'Greens', n=15)
+                st.plotly_chart(fig_items, use_container_width=True)
+            
+            with col2:
+                # Top revenue items
+                fig_revenue = charts.bar_chart(product_data, 'menu_item_name', 'item_sales',
+                                               'Top 15 Items by Revenue', 'Purples', n=15)
+                st.plotly_chart(fig_revenue, use_container_width=True)
+    
+    # Payout reconciliation (opt-in: it reads every transaction and payout)
+    reconciliation_section("GrubHub", data_watcher.version('transactions', 'deposit_details', 'deposits'))
     
     # Data Summary
     st.markdown('<div class="section-header">📋 Data Summary</div>', unsafe_allow_html=True)
@@ -401,9 +705,11 @@ if selected_platform == "GrubHub" and grubhub_data:
     
     with col1:
         st.markdown("**GrubHub Data Summary:**")
-        for key, df in grubhub_data.items():
-            if not df.empty:
-                st.write(f"- {key.replace('_', ' ').title()}: {len(df):,} records")
+        for key in grubhub_data:
+            # Counts come from the ingest cache so unused tables are not loaded
+            records = grubhub_row_count(key)
+            if records > 0:
+                st.write(f"- {key.replace('_', ' ').title()}: {records:,} records")
     
     with col2:
         st.markdown("**Filter Summary:**")
@@ -411,6 +717,11 @@ if selected_platform == "GrubHub" and grubhub_data:
         st.write(f"- Store: {selected_store}")
         st.write(f"- Customer Type: {selected_customer_type}")
         st.write(f"- GH+ Status: {selected_gh_plus}")
+        if segment_sums is not None:
+            st.write(f"- Orders in Segment: {len(segment_orders):,}")
+            st.write(f"- Cancellations in Segment: {len(segment_cancellations):,}")
+            if 'transactions' in grubhub_data:
+                st.write(f"- Transactions in Segment: {len(apply_segment_filters('transactions')):,}")
 
 elif selected_platform == "GrubHub" and not grubhub_data:
     st.error("❌ Unable to load GrubHub data. Please check that the CSV files are in the correct location.")
@@ -426,95 +737,129 @@ elif selected_platform == "GrubHub" and not grubhub_data:
     - deposit_details.csv
     """)
 
-elif selected_platform == "DoorDash" and marketing_df is not None and financial_df is not None:
+elif selected_platform == "DoorDash" and marketing_cube is not None and financial_cube is not None:
     # Platform indicator
     st.markdown(f"### 🚀 Currently Viewing: DoorDash Analytics")
     
     # Sidebar filters
     st.sidebar.markdown("## 🎛️ DoorDash Dashboard Controls")
     
+    # Sections and the sidebar filters they read. A filter change reruns only
+    # the sections reading it (keyed st.fragment reruns), not the whole page;
+    # widgets inside a section rerun that section alone.
+    marketing_inputs = ['marketing_date_range', 'marketing_self_serve', 'marketing_store']
+    financial_inputs = ['financial_date_range', 'financial_store']
+    doordash_sections = {
+        'doordash_financial': financial_inputs,
+        'doordash_marketing': marketing_inputs,
+        'doordash_campaigns': marketing_inputs,
+        'doordash_sponsored': marketing_inputs,
+        'doordash_marketing_summary': marketing_inputs,
+        'doordash_financial_summary': financial_inputs
+    }
+    
+    def on_filter_change(widget):
+        return {'key': widget, 'on_change': rerun_sections, 'args': (doordash_sections, widget)}
+    
     # Marketing filters
     st.sidebar.markdown("### 📊 Marketing Analysis Filters")
     
     # Date range for marketing
-    marketing_date_min = marketing_df['Date'].min().date()
-    marketing_date_max = marketing_df['Date'].max().date()
-    marketing_date_range = st.sidebar.date_input(
+    marketing_date_min = marketing_cube['Date'].min().date()
+    marketing_date_max = marketing_cube['Date'].max().date()
+    st.sidebar.date_input(
         "Marketing Date Range",
         value=(marketing_date_min, marketing_date_max),
         min_value=marketing_date_min,
-        max_value=marketing_date_max
+        max_value=marketing_date_max,
+        **on_filter_change('marketing_date_range')
     )
     
     # Self-serve filter
     self_serve_options = ['All', 'True', 'False']
-    selected_self_serve = st.sidebar.selectbox("Self-Serve Campaign", self_serve_options)
+    st.sidebar.selectbox("Self-Serve Campaign", self_serve_options, **on_filter_change('marketing_self_serve'))
     
     # Store filter for marketing
-    marketing_stores = ['All'] + sorted(marketing_df['Store name'].unique().tolist())
-    selected_marketing_store = st.sidebar.selectbox("Select Store (Marketing)", marketing_stores)
+    marketing_stores = ['All'] + sorted(marketing_cube['Store name'].unique().tolist())
+    st.sidebar.selectbox("Select Store (Marketing)", marketing_stores, **on_filter_change('marketing_store'))
     
     # Financial filters
     st.sidebar.markdown("### 💰 Financial Analysis Filters")
     
     # Date range for financial
-    financial_date_min = financial_df['Timestamp local date'].min().date()
-    financial_date_max = financial_df['Timestamp local date'].max().date()
-    financial_date_range = st.sidebar.date_input(
+    financial_date_min = financial_cube['Timestamp local date'].min().date()
+    financial_date_max = financial_cube['Timestamp local date'].max().date()
+    st.sidebar.date_input(
         "Financial Date Range",
         value=(financial_date_min, financial_date_max),
         min_value=financial_date_min,
-        max_value=financial_date_max
+        max_value=financial_date_max,
+        **on_filter_change('financial_date_range')
     )
     
     # Store filter for financial
-    financial_stores = ['All'] + sorted(financial_df['Store name'].unique().tolist())
-    selected_financial_store = st.sidebar.selectbox("Select Store (Financial)", financial_stores)
-    
-    # Apply filters to marketing data
-    marketing_filtered = marketing_df.copy()
-    
-    if len(marketing_date_range) == 2:
-        marketing_filtered = marketing_filtered[
-            (marketing_filtered['Date'].dt.date >= marketing_date_range[0]) &
-            (marketing_filtered['Date'].dt.date <= marketing_date_range[1])
-        ]
-    
-    if selected_self_serve != 'All':
-        self_serve_bool = selected_self_serve == 'True'
-        marketing_filtered = marketing_filtered[marketing_filtered['Is self serve campaign'] == self_serve_bool]
-    
-    if selected_marketing_store != 'All':
-        marketing_filtered = marketing_filtered[marketing_filtered['Store name'] == selected_marketing_store]
+    financial_stores = ['All'] + sorted(financial_cube['Store name'].unique().tolist())
+    st.sidebar.selectbox("Select Store (Financial)", financial_stores, **on_filter_change('financial_store'))
     
-    # Apply filters to financial data
-    financial_filtered = financial_df.copy()
+    # Filter state of each side, read back from the sidebar widgets: a section
+    # rerun on its own must see their current values, not those of the last full run
+    def marketing_state():
+        date_range = st.session_state['marketing_date_range']
+        store = st.session_state['marketing_store']
+        self_serve = st.session_state['marketing_self_serve']
+        store_filter = store if store != 'All' else None
+        self_serve_filter = (self_serve == 'True') if self_serve != 'All' else None
+        filters = filter_key(date_range=date_range, store=store_filter, self_serve=self_serve_filter)
+        equals = {'Store name': store_filter, 'Is self serve campaign': self_serve_filter}
+        return date_range, store, self_serve_filter, filters, equals
     
-    # Apply transaction type and status filters
-    financial_filtered = financial_filtered[
-        (financial_filtered['Transaction type'] == 'Order') &
-        (financial_filtered['Final order status'] == 'Delivered')
-    ]
+    def financial_state():
+        date_range = st.session_state['financial_date_range']
+        store = st.session_state['financial_store']
+        store_filter = store if store != 'All' else None
+        # Only delivered orders count towards the financial metrics
+        equals = {**metrics.DELIVERED_ORDERS, 'Store name': store_filter}
+        return date_range, store, filter_key(date_range=date_range, store=store_filter), equals
     
-    if len(financial_date_range) == 2:
-        financial_filtered = financial_filtered[
-            (financial_filtered['Timestamp local date'].dt.date >= financial_date_range[0]) &
-            (financial_filtered['Timestamp local date'].dt.date <= financial_date_range[1])
-        ]
-    
-    if selected_financial_store != 'All':
-        financial_filtered = financial_filtered[financial_filtered['Store name'] == selected_financial_store]
+    # Slices of the aggregate cubes, memoized per filter state; row-level data is
+    # only needed for the campaign table
+    def marketing_slice(date_range, filters, equals):
+        with profiler.section('Slice marketing cube', rows_in=len(marketing_cube)) as record:
+            marketing_filtered = results.get(
+                'marketing filtered', platform_data.versions['marketing'], filters,
+                lambda: rollups.slice_cube(marketing_cube, 'Date', date_range, equals=equals)
+            )
+            record['rows_out'] = len(marketing_filtered)
+        return marketing_filtered
     
-    # Two column layout
-    col1, col2 = st.columns(2)
+    def financial_slice(date_range, filters, equals):
+        with profiler.section('Slice financial cube', rows_in=len(financial_cube)) as record:
+            financial_filtered = results.get(
+                'financial filtered', platform_data.versions['financial'], filters,
+                lambda: rollups.slice_cube(financial_cube, 'Timestamp local date', date_range, equals=equals)
+            )
+            record['rows_out'] = len(financial_filtered)
+        return financial_filtered
     
     # Financial Analysis Column
-    with col1:
+    @st.fragment(key='doordash_financial')
+    @profiled
+    def financial_section():
+        financial_date_range, selected_financial_store, financial_filters, financial_equals = financial_state()
+        financial_filtered = financial_slice(financial_date_range, financial_filters, financial_equals)
+        
         st.markdown('<div class="section-header">💰 Financial Analysis</div>', unsafe_allow_html=True)
         
         # Financial metrics
-        overall_subtotal = financial_filtered['Subtotal'].sum()
-        net_total = financial_filtered['Net total'].sum()
+        with profiler.section('Financial Analysis KPIs', rows_in=len(financial_filtered)):
+            if engine:
+                financial_sums = engine.totals('detailed_transactions', metrics.DOORDASH_FINANCIAL_COLUMNS,
+                                               financial_date_range, financial_equals)
+            else:
+                financial_sums = metrics.totals(financial_filtered, metrics.DOORDASH_FINANCIAL_COLUMNS)
+            financial_kpis = metrics.doordash_financial_kpis(financial_sums)
+        overall_subtotal = financial_kpis['subtotal']
+        net_total = financial_kpis['net_total']
         
         st.metric(
             label="💵 Overall Subtotal",
@@ -530,30 +875,42 @@ elif selected_platform == "DoorDash" and marketing_df is not None and financial_
         
         # Store performance for financial
         if selected_financial_store == 'All':
-            financial_store_performance = financial_filtered.groupby('Store name').agg({
-                'Subtotal': 'sum',
-                'Net total': 'sum'
-            }).reset_index()
-            financial_store_performance = financial_store_performance.sort_values('Subtotal', ascending=False).head(10)
-            
-            fig_financial_stores = px.bar(financial_store_performance, x='Store name', y='Subtotal',
-                                         title='Top 10 Stores by Subtotal',
-                                         color='Subtotal',
-                                         color_continuous_scale='Oranges')
-            fig_financial_stores.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_financial_stores, use_container_width=True)
+            with profiler.section('Financial store chart', rows_in=len(financial_filtered)):
+                financial_store_performance = results.get(
+                    'financial top stores', (QUERY_ENGINE, platform_data.versions['financial']), financial_filters,
+                    lambda: (engine.top_stores('detailed_transactions', 'Subtotal', ['Subtotal', 'Net total'],
+                                               date_range=financial_date_range, equals=financial_equals) if engine
+                             else rollups.top_stores(financial_filtered, 'Subtotal', ['Subtotal', 'Net total']))
+                )
+                
+                fig_financial_stores = charts.bar_chart(financial_store_performance, 'Store name', 'Subtotal',
+                                                        'Top 10 Stores by Subtotal', 'Oranges')
+                st.plotly_chart(fig_financial_stores, use_container_width=True)
     
     # Marketing Analysis Column
-    with col2:
+    @st.fragment(key='doordash_marketing')
+    @profiled
+    def marketing_section():
+        (marketing_date_range, selected_marketing_store, self_serve_filter, marketing_filters,
+         marketing_equals) = marketing_state()
+        marketing_filtered = marketing_slice(marketing_date_range, marketing_filters, marketing_equals)
+        
         st.markdown('<div class="section-header">📊 Marketing Analysis</div>', unsafe_allow_html=True)
         
         # Marketing metrics
-        marketing_sales = marketing_filtered['Sales'].sum()
-        avg_roas = marketing_filtered['ROAS'].mean() if len(marketing_filtered) > 0 else 0
-        marketing_orders = marketing_filtered['Orders'].sum()
-        new_customers = marketing_filtered['New customers acquired'].sum()
-        new_dp_customers = marketing_filtered['New DP customers acquired'].sum()
-        avg_order_value = marketing_filtered['Average order value'].mean() if len(marketing_filtered) > 0 else 0
+        with profiler.section('Marketing Analysis KPIs', rows_in=len(marketing_filtered)):
+            if engine:
+                marketing_sums = engine.totals('promotion', metrics.DOORDASH_MARKETING_COLUMNS,
+                                               marketing_date_range, marketing_equals)
+            else:
+                marketing_sums = metrics.totals(marketing_filtered, metrics.DOORDASH_MARKETING_COLUMNS)
+            marketing_kpis = metrics.doordash_marketing_kpis(marketing_sums)
+        marketing_sales = marketing_kpis['marketing_sales']
+        avg_roas = marketing_kpis['avg_roas']
+        marketing_orders = marketing_kpis['marketing_orders']
+        new_customers = marketing_kpis['new_customers']
+        new_dp_customers = marketing_kpis['new_dp_customers']
+        avg_order_value = marketing_kpis['avg_order_value']
         
         st.metric(
             label="💰 Marketing Sales",
@@ -593,54 +950,79 @@ elif selected_platform == "DoorDash" and marketing_df is not None and financial_
         
         # Store performance for marketing
         if selected_marketing_store == 'All':
-            marketing_store_performance = marketing_filtered.groupby('Store name').agg({
-                'Sales': 'sum',
-                'Orders': 'sum',
-                'ROAS': 'mean',
-                'New customers acquired': 'sum'
-            }).reset_index()
-            marketing_store_performance = marketing_store_performance.sort_values('Sales', ascending=False).head(10)
-            
-            fig_marketing_stores = px.bar(marketing_store_performance, x='Store name', y='Sales',
-                                         title='Top 10 Stores by Marketing Sales',
-                                         color='Sales',
-                                         color_continuous_scale='Oranges')
-            fig_marketing_stores.update_layout(xaxis_tickangle=-45, height=400)
-            st.plotly_chart(fig_marketing_stores, use_container_width=True)
+            with profiler.section('Marketing store chart', rows_in=len(marketing_filtered)):
+                marketing_store_performance = results.get(
+                    'marketing top stores', (QUERY_ENGINE, platform_data.versions['marketing']), marketing_filters,
+                    lambda: (engine.top_stores('promotion', 'Sales', ['Sales', 'Orders', 'New customers acquired'],
+                                               ['ROAS'], date_range=marketing_date_range, equals=marketing_equals)
+                             if engine else
+                             rollups.top_stores(marketing_filtered, 'Sales', ['Sales', 'Orders', 'New customers acquired'],
+                                                mean_measures=['ROAS']))
+                )
+                
+                fig_marketing_stores = charts.bar_chart(marketing_store_performance, 'Store name', 'Sales',
+                                                        'Top 10 Stores by Marketing Sales', 'Oranges')
+                st.plotly_chart(fig_marketing_stores, use_container_width=True)
     
     # Campaign Level Analysis (only show when a specific store is selected)
-    if selected_marketing_store != 'All':
+    @st.fragment(key='doordash_campaigns')
+    @profiled
+    def campaign_section():
+        (marketing_date_range, selected_marketing_store, self_serve_filter, marketing_filters,
+         marketing_equals) = marketing_state()
+        if selected_marketing_store == 'All':
+            return
+        
         st.markdown('<div class="section-header">📋 Campaign Level Analysis - ' + selected_marketing_store + '</div>', unsafe_allow_html=True)
         
         # Get campaign data for selected store
-        store_campaigns = marketing_filtered[marketing_filtered['Store name'] == selected_marketing_store].copy()
+        # One mask over the date slice, then a single copy of the table columns;
+        # a memoized result skips loading the row-level export altogether
+        with profiler.section('Campaign table filter') as record:
+            store_campaigns = results.get(
+                'campaigns', platform_data.versions['marketing'], marketing_filters,
+                lambda: select(
+                    platform_data['marketing'], 'Date', marketing_date_range,
+                    equals={'Store name': selected_marketing_store, 'Is self serve campaign': self_serve_filter},
+                    columns=CAMPAIGN_TABLE_COLUMNS
+                )
+            )
+            record['rows_out'] = len(store_campaigns)
         
         if len(store_campaigns) > 0:
-            # Prepare campaign data for display
-            campaign_data = store_campaigns[['Campaign name', 'Type of promotion', 'Date', 'Orders', 'Sales', 'ROAS', 
-                                           'New customers acquired', 'New DP customers acquired', 'Average order value']].copy()
-            
-            # Sort by date
-            campaign_data = campaign_data.sort_values('Date', ascending=False)
-            
-            # Format the data for display
-            campaign_display = campaign_data.copy()
-            campaign_display['Date'] = campaign_display['Date'].dt.strftime('%Y-%m-%d')
-            campaign_display['Sales'] = campaign_display['Sales'].apply(lambda x: f"${x:,.2f}")
-            campaign_display['Average order value'] = campaign_display['Average order value'].apply(lambda x: f"${x:,.2f}")
+            # Sort server-side once per filter state and sort choice, then format
+            # and style only the visible page
+            sort_col1, sort_col2, sort_col3 = st.columns([2, 1, 1])
+            with sort_col1:
+                sort_column = st.selectbox("Sort by", CAMPAIGN_TABLE_COLUMNS, index=CAMPAIGN_TABLE_COLUMNS.index('Date'))
+            with sort_col2:
+                sort_ascending = st.radio("Order", ["Descending", "Ascending"], horizontal=True) == "Ascending"
+            with sort_col3:
+                page_number = st.number_input("Page", min_value=1, max_value=tables.page_count(len(store_campaigns)),
+                                              value=1, step=1)
             
-            # Create a styled dataframe with ROAS highlighting
-            def highlight_roas(val):
-                if isinstance(val, (int, float)) and val < 4:
-                    return 'background-color: #ffebee; color: #c62828; font-weight: bold'
-                return ''
-            
-            # Display the table
-            st.dataframe(
-                campaign_display.style.applymap(highlight_roas, subset=['ROAS']),
-                use_container_width=True,
-                height=400
-            )
+            with profiler.section('Campaign table', rows_in=len(store_campaigns)) as record:
+                campaign_order = results.get(
+                    'campaign order', platform_data.versions['marketing'],
+                    filter_key(filters=marketing_filters, sort=sort_column, ascending=sort_ascending),
+                    lambda: tables.sort_order(store_campaigns, sort_column, sort_ascending)
+                )
+                campaign_page = tables.page(store_campaigns, campaign_order, page_number)
+                record['rows_out'] = len(campaign_page)
+                
+                # Format the page for display
+                campaign_display = tables.format_page(campaign_page, currency=['Sales', 'Average order value'],
+                                                      dates=['Date'])
+                
+                # Display the page with ROAS below 4 highlighted
+                first_row = (page_number - 1) * tables.PAGE_SIZE + 1
+                st.caption(f"Campaigns {first_row:,}–{first_row + len(campaign_page) - 1:,} of {len(store_campaigns):,}")
+                st.dataframe(
+                    tables.highlight_below(campaign_display, 'ROAS', 4,
+                                           'background-color: #ffebee; color: #c62828; font-weight: bold'),
+                    use_container_width=True,
+                    height=400
+                )
             
             # Summary metrics for the selected store
             col1, col2, col3, col4 = st.columns(4)
@@ -678,31 +1060,149 @@ elif selected_platform == "DoorDash" and marketing_df is not None and financial_
         else:
             st.info(f"No campaign data found for {selected_marketing_store} in the selected date range.")
     
-    # Data summary
-    st.markdown('<div class="section-header">📋 Data Summary</div>', unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
+    # Sponsored Listing funnel, computed from the per-(campaign, store, day) cube
+    # built at load; ratios are recomputed from the summed measures of a slice
+    @st.fragment(key='doordash_sponsored')
+    @profiled
+    def sponsored_section():
+        (marketing_date_range, selected_marketing_store, self_serve_filter, marketing_filters,
+         marketing_equals) = marketing_state()
+        st.markdown('<div class="section-header">🎯 Sponsored Listing Performance</div>', unsafe_allow_html=True)
+        
+        sponsored_cube = platform_data['sponsored_cube'] if 'sponsored_cube' in platform_data else None
+        if sponsored_cube is not None and not sponsored_cube.empty:
+            sponsored_col1, sponsored_col2 = st.columns([2, 1])
+            with sponsored_col1:
+                sponsored_campaigns = ['All'] + sorted(sponsored_cube['Campaign name'].unique().tolist())
+                selected_sponsored_campaign = st.selectbox("Sponsored Listing Campaign", sponsored_campaigns)
+            with sponsored_col2:
+                sponsored_by = st.radio("Break down by", ["Store", "Campaign"], horizontal=True)
+            
+            # Same date, store and self-serve filters as the promotion metrics
+            sponsored_campaign_filter = selected_sponsored_campaign if selected_sponsored_campaign != 'All' else None
+            sponsored_filters = filter_key(filters=marketing_filters, campaign=sponsored_campaign_filter)
+            sponsored_equals = {**marketing_equals, 'Campaign name': sponsored_campaign_filter}
+            
+            with profiler.section('Sponsored Listing KPIs', rows_in=len(sponsored_cube)) as record:
+                sponsored_filtered = results.get(
+                    'sponsored filtered', platform_data.versions['sponsored_cube'], sponsored_filters,
+                    lambda: rollups.slice_cube(sponsored_cube, rollups.SPONSORED_DATE, marketing_date_range,
+                                               equals=sponsored_equals)
+                )
+                sponsored_kpis = metrics.doordash_sponsored_kpis(
+                    metrics.totals(sponsored_filtered, metrics.DOORDASH_SPONSORED_COLUMNS))
+                record['rows_out'] = len(sponsored_filtered)
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                fig_funnel = charts.funnel_chart({
+                    'Impressions': sponsored_kpis['impressions'],
+                    'Clicks': sponsored_kpis['clicks'],
+                    'Orders': sponsored_kpis['orders']
+                }, 'Impressions → Clicks → Orders')
+                st.plotly_chart(fig_funnel, use_container_width=True)
+            
+            with col2:
+                metric_col1, metric_col2 = st.columns(2)
+                with metric_col1:
+                    st.metric(label="💸 Ad Spend", value=f"${sponsored_kpis['spend']:,.2f}")
+                    st.metric(label="👆 Click-Through Rate", value=f"{sponsored_kpis['ctr']:.2f}%")
+                    st.metric(label="🎯 Average CPA", value=f"${sponsored_kpis['avg_cpa']:.2f}")
+                with metric_col2:
+                    st.metric(label="💰 Sponsored Sales", value=f"${sponsored_kpis['sales']:,.2f}")
+                    st.metric(label="🛒 Click Conversion", value=f"{sponsored_kpis['conversion_rate']:.2f}%")
+                    st.metric(label="📈 ROAS (Spend-Weighted)", value=f"{sponsored_kpis['roas']:.2f}x")
+            
+            # Per-store or per-campaign funnels of the slice, memoized per filter state
+            by_column = 'Store name' if sponsored_by == "Store" else 'Campaign name'
+            with profiler.section('Sponsored Listing breakdown', rows_in=len(sponsored_filtered)) as record:
+                sponsored_breakdown = results.get(
+                    'sponsored breakdown', platform_data.versions['sponsored_cube'],
+                    filter_key(filters=sponsored_filters, by=by_column),
+                    lambda: metrics.sponsored_breakdown(sponsored_filtered, by_column)
+                )
+                record['rows_out'] = len(sponsored_breakdown)
+            
+            st.dataframe(
+                sponsored_breakdown,
+                column_config={
+                    'impressions': st.column_config.NumberColumn("Impressions", format="%d"),
+                    'clicks': st.column_config.NumberColumn("Clicks", format="%d"),
+                    'orders': st.column_config.NumberColumn("Orders", format="%d"),
+                    'sales': st.column_config.NumberColumn("Sales", format="$%.2f"),
+                    'spend': st.column_config.NumberColumn("Spend", format="$%.2f"),
+                    'new_customers': st.column_config.NumberColumn("New Customers", format="%d"),
+                    'ctr': st.column_config.NumberColumn("CTR", format="%.2f%%"),
+                    'conversion_rate': st.column_config.NumberColumn("Conversion", format="%.2f%%"),
+                    'avg_cpa': st.column_config.NumberColumn("Avg CPA", format="$%.2f"),
+                    'roas': st.column_config.NumberColumn("ROAS", format="%.2fx")
+                },
+                use_container_width=True,
+                hide_index=True,
+                height=400
+            )
+        else:
+            st.info("No Sponsored Listing data found for the selected filters.")
     
-    with col1:
+    # Data summary of each side
+    @st.fragment(key='doordash_marketing_summary')
+    @profiled
+    def marketing_summary_section():
+        marketing_date_range, _, _, marketing_filters, marketing_equals = marketing_state()
+        marketing_filtered = marketing_slice(marketing_date_range, marketing_filters, marketing_equals)
+        
         st.markdown("**Marketing Data Summary:**")
         if len(marketing_filtered) > 0:
-            st.write(f"- Total Records: {len(marketing_filtered):,}")
+            st.write(f"- Total Records: {rollups.row_count(marketing_filtered):,}")
             st.write(f"- Date Range: {marketing_filtered['Date'].min().strftime('%Y-%m-%d')} to {marketing_filtered['Date'].max().strftime('%Y-%m-%d')}")
             st.write(f"- Unique Stores: {marketing_filtered['Store name'].nunique()}")
             st.write(f"- Campaign Types: {marketing_filtered['Type of promotion'].nunique()}")
         else:
             st.write("- No data available for selected filters")
     
-    with col2:
+    @st.fragment(key='doordash_financial_summary')
+    @profiled
+    def financial_summary_section():
+        financial_date_range, _, financial_filters, financial_equals = financial_state()
+        financial_filtered = financial_slice(financial_date_range, financial_filters, financial_equals)
+        
         st.markdown("**Financial Data Summary:**")
         if len(financial_filtered) > 0:
-            st.write(f"- Total Records: {len(financial_filtered):,}")
+            st.write(f"- Total Records: {rollups.row_count(financial_filtered):,}")
             st.write(f"- Date Range: {financial_filtered['Timestamp local date'].min().strftime('%Y-%m-%d')} to {financial_filtered['Timestamp local date'].max().strftime('%Y-%m-%d')}")
             st.write(f"- Unique Stores: {financial_filtered['Store name'].nunique()}")
-            st.write(f"- Total Subtotal: ${financial_filtered['Subtotal'].sum():,.2f}")
+            st.write(f"- Total Subtotal: ${rollups.total(financial_filtered, 'Subtotal'):,.2f}")
         else:
             st.write("- No data available for selected filters")
     
+    # Two column layout
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        financial_section()
+    
+    with col2:
+        marketing_section()
+    
+    campaign_section()
+    
+    sponsored_section()
+    
+    # Payout reconciliation (opt-in: it reads every transaction and payout)
+    reconciliation_section("DoorDash", data_watcher.version('detailed_transactions', 'payout_summary', 'error_charges'))
+    
+    # Data summary
+    st.markdown('<div class="section-header">📋 Data Summary</div>', unsafe_allow_html=True)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        marketing_summary_section()
+    
+    with col2:
+        financial_summary_section()
+    
     # Footer
     st.markdown("---")
     st.markdown("""
@@ -712,13 +1212,33 @@ elif selected_platform == "DoorDash" and marketing_df is not None and financial_
     </div>
     """, unsafe_allow_html=True)
 
-elif selected_platform == "DoorDash" and (marketing_df is None or financial_df is None):
+elif selected_platform == "DoorDash" and (marketing_cube is None or financial_cube is None):
     st.error("❌ Unable to load DoorDash data. Please check that the CSV files are in the correct location.")
     st.info("""
-    **Required files:**
-    - `marketing_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z/MARKETING_PROMOTION_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z.csv`
-    - `financial_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z/FINANCIAL_DETAILED_TRANSACTIONS_2025-09-22_2025-10-05_fZY06_2025-10-07T13-11-16Z.csv`
+    **Required files** (one or more export windows):
+    - `marketing_<start>_<end>_<tag>_<exported_at>/MARKETING_PROMOTION_*.csv`
+    - `financial_<start>_<end>_<tag>_<exported_at>/FINANCIAL_DETAILED_TRANSACTIONS_*.csv`
     """)
 
 else:
     st.info("👆 Please select a platform above to view analytics.")
+
+# Profiling panel (TODC_PROFILE=1, or ?profile=1 in the URL). A fragment of its
+# own, so a sidebar filter reruns it after the sections that filter reran
+@st.fragment(key='profiling_panel')
+def profiling_panel():
+    finish_profile()
+    with st.expander("🛠️ Profiling", expanded=True):
+        st.caption("Latest reruns, the newest last: wall time, rows and peak allocated memory per section. "
+                   "Sections rerun on their own are reruns of their own.")
+        st.dataframe(profiler.table(), use_container_width=True, hide_index=True)
+        st.caption("Result and figure caches (all sessions)")
+        st.dataframe(pd.DataFrame([results.stats(), charts.FIGURES.stats()], index=['results', 'figures']),
+                     use_container_width=True)
+        st.download_button("Download as JSON lines", profiler.json_lines(),
+                           file_name=f"profile_{profiler.rerun}.jsonl", mime="application/x-ndjson",
+                           on_click='ignore')
+
+if profiler.enabled:
+    with st.sidebar:
+        profiling_panel()
@@ -0,0 +1,155 @@
+"""Discovery and incremental loading of DoorDash export windows.
+
+DoorDash exports arrive as one directory per window, e.g.
+``marketing_2025-09-22_2025-10-05_IeW4u_2025-10-07T11-22-22Z``. Every window
+found on disk is loaded, and rows that appear in several overlapping windows
+are de-duplicated so that the most recent export wins.
+"""
+import glob
+import os
+import re
+import threading
+from collections import namedtuple
+
+import pandas as pd
+
+from data_cache import file_fingerprint, read_exports
+from schema import DTYPES
+
+# kind -> (directory prefix, file prefix)
+EXPORT_KINDS = {
+    'promotion': ('marketing', 'MARKETING_PROMOTION'),
+    'sponsored_listing': ('marketing', 'MARKETING_SPONSORED_LISTING'),
+    'detailed_transactions': ('financial', 'FINANCIAL_DETAILED_TRANSACTIONS'),
+    'payout_summary': ('financial', 'FINANCIAL_PAYOUT_SUMMARY'),
+    'error_charges': ('financial', 'FINANCIAL_ERROR_CHARGES_AND_ADJUSTMENTS'),
+}
+
+# Columns identifying the same row across overlapping export windows.
+# A campaign runs across many stores, so Store ID is part of the marketing key.
+DEDUP_KEYS = {
+    'promotion': ['Campaign ID', 'Store ID', 'Date'],
+    'sponsored_listing': ['Campaign ID', 'Store ID', 'Date'],
+    'detailed_transactions': ['DoorDash transaction ID'],
+    'payout_summary': ['Payout ID', 'Store ID', 'Channel'],
+    'error_charges': ['DoorDash transaction ID'],
+}
+
+DATE_COLUMNS = {
+    'promotion': ['Date'],
+    'sponsored_listing': ['Date'],
+    'detailed_transactions': ['Timestamp local date'],
+    'payout_summary': ['Payout date'],
+    'error_charges': [],
+}
+
+EXPORT_DIR_PATTERN = re.compile(
+    r'^(?P<prefix>[a-z]+)_(?P<start>\d{4}-\d{2}-\d{2})_(?P<end>\d{4}-\d{2}-\d{2})_(?P<tag>[^_]+)_(?P<exported_at>.+)$'
+)
+
+Export = namedtuple('Export', ['kind', 'path', 'start', 'end', 'exported_at'])
+
+
+def discover_exports(kind, root='.'):
+    """Return every export of ``kind`` under ``root``, oldest export first"""
+    dir_prefix, file_prefix = EXPORT_KINDS[kind]
+    exports = []
+    for directory in glob.glob(os.path.join(root, f'{dir_prefix}_*')):
+        match = EXPORT_DIR_PATTERN.match(os.path.basename(directory))
+        if not match or not os.path.isdir(directory):
+            continue
+        for path in glob.glob(os.path.join(directory, f'{file_prefix}_*.csv')):
+            exports.append(Export(kind, path, match['start'], match['end'], match['exported_at']))
+    return sorted(exports, key=lambda e: (e.exported_at, e.path))
+
+
+class ExportHistory:
+    """Combined, de-duplicated frame over every export window of one kind.
+
+    ``refresh()`` appends exports that appeared since the last call without
+    reloading the ones already combined. The frame is only rebuilt from
+    scratch when an export disappears or is rewritten in place, or an older
+    window is backfilled.
+    ``columns`` restricts every window to those columns plus the
+    de-duplication keys; ``None`` keeps every column.
+    ``adopt()`` swaps the combined frame for an equal copy kept elsewhere
+    (e.g. memory-mapped from the shared store); refreshes keep appending to it.
+    """
+
+    def __init__(self, kind, root='.', columns=None):
+        self.kind = kind
+        self.root = root
+        if columns is not None:
+            columns = list(dict.fromkeys(list(columns) + DEDUP_KEYS[kind]))
+        self.columns = columns
+        self.loaded = []
+        # path -> fingerprint of every loaded export, to notice rewritten files
+        self.fingerprints = {}
+        self.frame = None
+        # Seconds spent loading each export path, from the latest refresh
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def _read(self, exports):
+        """Load several export windows concurrently, oldest first"""
+        jobs = {
+            e.path: {
+                'path': e.path,
+                'date_columns': DATE_COLUMNS[self.kind],
+                'columns': self.columns,
+                'dtypes': DTYPES.get(self.kind),
+            }
+            for e in exports
+        }
+        frames, self.timings = read_exports(jobs)
+        return [frames[e.path] for e in exports]
+
+    def _dedupe(self, frame):
+        return frame.drop_duplicates(subset=DEDUP_KEYS[self.kind], keep='last', ignore_index=True)
+
+    def refresh(self):
+        """Pick up new export windows and return the combined frame"""
+        with self._lock:
+            exports = discover_exports(self.kind, self.root)
+            if not exports:
+                dir_prefix, file_prefix = EXPORT_KINDS[self.kind]
+                raise FileNotFoundError(f"No {file_prefix} exports found in {dir_prefix}_* directories")
+
+            known = set(self.loaded)
+            new_exports = [e for e in exports if e not in known]
+            fingerprints = {e.path: file_fingerprint(e.path) for e in exports}
+            rewritten = any(fingerprints[e.path] != self.fingerprints.get(e.path) for e in exports if e in known)
+            if not new_exports and not rewritten and len(exports) == len(self.loaded):
+                return self.frame
+
+            appendable = (
+                self.frame is not None
+                and not rewritten
+                and len(known) + len(new_exports) == len(exports)
+                and all(e.exported_at >= self.loaded[-1].exported_at for e in new_exports)
+            )
+            if appendable:
+                frames = [self.frame] + self._read(new_exports)
+            else:
+                frames = self._read(exports)
+
+            self.frame = self._dedupe(pd.concat(frames, ignore_index=True))
+            self.loaded = exports
+            self.fingerprints = fingerprints
+            return self.frame
+
+    def adopt(self, frame):
+        """Hold ``frame``, the combined frame as kept elsewhere, instead of a private copy
+
+        Its rows may be reordered and its columns re-encoded, as long as
+        they hold the combined rows of the windows already loaded. Does
+        nothing before the first refresh.
+        """
+        with self._lock:
+            if self.frame is not None:
+                self.frame = frame
+
+
+def export_signature(*kinds, root='.'):
+    """Return a hashable summary of the exports on disk, for use as a cache key"""
+    return tuple((e.kind, e.path) for kind in kinds for e in discover_exports(kind, root))
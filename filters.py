@@ -0,0 +1,107 @@
+"""Date-range filtering by binary search over date-sorted frames.
+
+Comparing ``df[col].dt.date`` against the sidebar dates builds a Python
+``date`` object for every row on every rerun. Frames are instead sorted by
+their date column once at load, and a date range becomes a pair of
+``searchsorted`` lookups followed by a positional slice.
+
+Filters never copy the cached frames. A date range is a slice view, every
+other condition becomes a boolean array, and the conditions are ANDed into
+one mask per dataset. ``take`` then copies only the selected rows and
+columns, so a rerun allocates memory in proportion to its output.
+"""
+import numpy as np
+import pandas as pd
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def sort_by_date(df, column):
+    """Return ``df`` sorted by ``column`` (missing dates last) with a fresh index"""
+    if column not in df.columns or df[column].is_monotonic_increasing:
+        return df
+    return df.sort_values(column, kind='stable', na_position='last', ignore_index=True)
+
+
+def date_bounds(df, column, date_range):
+    """Return the ``(start, stop)`` row positions covering ``date_range``
+
+    ``df`` must be sorted by ``column``. Both ends of the range are inclusive
+    calendar days, matching the sidebar ``st.date_input`` values; either end
+    may be ``None`` for an open range. Rows with a missing date never match.
+    """
+    values = df[column]
+    if date_range is None or len(date_range) != 2:
+        return 0, len(df)
+    first, last = date_range
+    # Missing dates are sorted last, so the dated rows are a prefix
+    start, stop = 0, values.count()
+    if first is not None:
+        start = values.searchsorted(pd.Timestamp(first), side='left')
+    if last is not None:
+        stop = values.searchsorted(pd.Timestamp(last) + ONE_DAY, side='left')
+    return int(start), int(stop)
+
+
+def date_slice(df, column, date_range):
+    """Rows of a date-sorted ``df`` whose ``column`` falls inside ``date_range``"""
+    start, stop = date_bounds(df, column, date_range)
+    return df.iloc[start:stop]
+
+
+def before_end_of(series, day):
+    """Vectorized ``series.dt.date <= day`` for a datetime64 series"""
+    return series < pd.Timestamp(day) + ONE_DAY
+
+
+def date_mask(series, date_range):
+    """Boolean mask of ``series`` inside ``date_range``, for frames not sorted by date
+
+    ``None`` (no filter) unless ``date_range`` has both ends.
+    """
+    if date_range is None or len(date_range) != 2:
+        return None
+    first, last = date_range
+    return ((series >= pd.Timestamp(first)) & before_end_of(series, last)).to_numpy()
+
+
+def equals_mask(df, equals):
+    """Boolean mask of the rows of ``df`` matching every ``column: value`` of ``equals``
+
+    A value of ``None`` means "do not filter on this column". Returns
+    ``None`` when nothing is filtered.
+    """
+    return combine_masks(*((df[column] == value).to_numpy()
+                           for column, value in (equals or {}).items() if value is not None))
+
+
+def combine_masks(*masks):
+    """AND of the given boolean masks, skipping ``None``; ``None`` if all are ``None``"""
+    combined = None
+    for mask in masks:
+        if mask is None:
+            continue
+        mask = np.asarray(mask, dtype=bool)
+        combined = mask if combined is None else combined & mask
+    return combined
+
+
+def take(df, mask=None, columns=None):
+    """The rows of ``df`` selected by ``mask`` restricted to ``columns``, in one copy
+
+    With neither a mask nor columns, ``df`` itself is returned.
+    """
+    if mask is None and columns is None:
+        return df
+    rows = slice(None) if mask is None else np.flatnonzero(mask)
+    cols = slice(None) if columns is None else df.columns.get_indexer(columns)
+    return df.iloc[rows, cols]
+
+
+def select(df, date_column, date_range=None, equals=None, columns=None):
+    """Rows of a date-sorted ``df`` inside ``date_range`` whose columns match ``equals``
+
+    Only the final selection of rows and ``columns`` is copied.
+    """
+    window = date_slice(df, date_column, date_range)
+    return take(window, equals_mask(window, equals), columns)
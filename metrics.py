@@ -0,0 +1,198 @@
+"""Dashboard KPIs as plain functions, independent of Streamlit.
+
+Every KPI is computed from summed measures (``totals``): a mapping of column
+name -> sum, such as ``totals(frame, columns)`` for one selection, or a frame
+of per-group sums for a batch of stores and date windows. The same formulas
+therefore serve the dashboard's single selection and ``report.py``'s
+all-stores batch run.
+"""
+import numpy as np
+import pandas as pd
+
+import rollups
+
+
+def safe_ratio(numerator, denominator, scale=1.0):
+    """``numerator / denominator * scale``, or 0 where the denominator is not positive"""
+    numerator = np.asarray(numerator, dtype='float64')
+    denominator = np.asarray(denominator, dtype='float64')
+    positive = denominator > 0
+    result = np.where(positive, numerator / np.where(positive, denominator, 1), 0) * scale
+    return float(result) if result.ndim == 0 else result
+
+
+def totals(frame, columns):
+    """Column sums of ``frame``, the input of the KPI functions
+
+    Summed per column so integer counts stay integers.
+    """
+    return {column: frame[column].sum() for column in columns}
+
+
+# DoorDash (computed from cube slices, see rollups.py)
+
+DOORDASH_FINANCIAL_COLUMNS = rollups.FINANCIAL_MEASURES + [rollups.ROWS]
+DOORDASH_MARKETING_COLUMNS = (
+    rollups.MARKETING_MEASURES + rollups.MARKETING_MEAN_MEASURES
+    + [f'{m} count' for m in rollups.MARKETING_MEAN_MEASURES] + [rollups.ROWS]
+)
+DOORDASH_SPONSORED_COLUMNS = rollups.SPONSORED_MEASURES + [rollups.ROWS]
+
+
+def doordash_financial_kpis(sums):
+    return {
+        'subtotal': sums['Subtotal'],
+        'net_total': sums['Net total'],
+        'net_subtotal_ratio': safe_ratio(sums['Net total'], sums['Subtotal']),
+    }
+
+
+def doordash_marketing_kpis(sums):
+    return {
+        'marketing_sales': sums['Sales'],
+        'avg_roas': safe_ratio(sums['ROAS'], sums['ROAS count']),
+        'marketing_orders': sums['Orders'],
+        'new_customers': sums['New customers acquired'],
+        'new_dp_customers': sums['New DP customers acquired'],
+        'avg_order_value': safe_ratio(sums['Average order value'], sums['Average order value count']),
+    }
+
+
+def doordash_sponsored_kpis(sums):
+    """Sponsored Listing funnel and its spend-weighted ratios"""
+    spend = sums[rollups.SPONSORED_SPEND]
+    return {
+        'impressions': sums['Impressions'],
+        'clicks': sums['Clicks'],
+        'orders': sums['Orders'],
+        'sales': sums['Sales'],
+        'spend': spend,
+        'new_customers': sums['New customers acquired'],
+        'ctr': safe_ratio(sums['Clicks'], sums['Impressions'], 100),
+        'conversion_rate': safe_ratio(sums['Orders'], sums['Clicks'], 100),
+        'avg_cpa': safe_ratio(spend, sums['Orders']),
+        'roas': safe_ratio(sums['Sales'], spend),
+    }
+
+
+def sponsored_breakdown(sponsored_cube, by):
+    """Sponsored Listing KPIs per value of ``by`` (e.g. store or campaign), largest spend first"""
+    sums = sponsored_cube.groupby(by, observed=True)[DOORDASH_SPONSORED_COLUMNS].sum()
+    kpis = doordash_sponsored_kpis(sums)
+    result = pd.DataFrame({name: np.asarray(value) for name, value in kpis.items()}, index=sums.index)
+    return result.sort_values('spend', ascending=False, kind='stable').reset_index()
+
+
+# Financial cube cells counted by the dashboard: delivered orders only
+DELIVERED_ORDERS = {
+    'Transaction type': 'Order',
+    'Final order status': 'Delivered',
+}
+
+
+def delivered_orders(financial_cube):
+    return rollups.slice_cube(financial_cube, rollups.FINANCIAL_DATE, equals=DELIVERED_ORDERS)
+
+
+# GrubHub (computed from the per-store period summaries)
+
+GRUBHUB_FINANCIAL_COLUMNS = ['total_orders', 'subtotal_sales', 'merchant_net_total', 'commission', 'tip']
+GRUBHUB_OPERATIONS_COLUMNS = ['total_orders', 'total_canceled_orders', 'new_customer_orders', 'gh_plus_customer_orders']
+
+
+def grubhub_financial_kpis(sums):
+    total_commission = abs(sums['commission'])
+    return {
+        'total_orders': sums['total_orders'],
+        'total_sales': sums['subtotal_sales'],
+        'net_total': sums['merchant_net_total'],
+        'avg_order_value': safe_ratio(sums['subtotal_sales'], sums['total_orders']),
+        'total_commission': total_commission,
+        'commission_rate': safe_ratio(total_commission, sums['subtotal_sales'], 100),
+        'total_tips': sums['tip'],
+    }
+
+
+def grubhub_operations_kpis(sums):
+    return {
+        'total_orders': sums['total_orders'],
+        'cancellation_rate': safe_ratio(sums['total_canceled_orders'], sums['total_orders'], 100),
+        'new_customer_rate': safe_ratio(sums['new_customer_orders'], sums['total_orders'], 100),
+        'gh_plus_rate': safe_ratio(sums['gh_plus_customer_orders'], sums['total_orders'], 100),
+    }
+
+
+def grubhub_store_performance(financial_summary):
+    """Per-store sales, orders, net total, AOV and commission rate"""
+    stores = financial_summary.groupby('store_name', observed=True).agg({
+        'total_orders': 'sum',
+        'subtotal_sales': 'sum',
+        'merchant_net_total': 'sum',
+        'commission': 'sum'
+    }).reset_index()
+    return grubhub_store_ratios(stores)
+
+
+def grubhub_store_ratios(stores):
+    """Add AOV and commission rate to per-store GrubHub sums, in place"""
+    stores['avg_order_value'] = stores['subtotal_sales'] / stores['total_orders']
+    stores['commission_rate'] = abs(stores['commission']) / stores['subtotal_sales'] * 100
+    return stores
+
+
+# GrubHub KPIs of a customer segment (computed from the order-level tables, see segments.py)
+
+def grubhub_order_sums(orders, cancellations):
+    """The period-summary sums of ``GRUBHUB_FINANCIAL_COLUMNS`` and ``GRUBHUB_OPERATIONS_COLUMNS`` rebuilt from orders
+
+    As in the summaries, ``total_orders`` includes canceled orders.
+    """
+    return {
+        'total_orders': len(orders) + len(cancellations),
+        'subtotal_sales': orders['order_subtotal'].sum(),
+        'merchant_net_total': orders['order_merchant_total'].sum(),
+        'commission': orders['order_commission'].sum(),
+        'tip': orders['order_tip'].sum(),
+        'total_canceled_orders': len(cancellations),
+        'new_customer_orders': int((orders['customer_type'] == 'New').sum()
+                                   + (cancellations['customer_type'] == 'New').sum()),
+        'gh_plus_customer_orders': int((orders['gh_plus_customer'] == 'GH+').sum()
+                                       + (cancellations['gh_plus_customer'] == 'GH+').sum()),
+    }
+
+
+def grubhub_order_store_performance(orders, cancellations):
+    """``grubhub_store_performance`` rebuilt from orders"""
+    # Plain store names: the two tables' categoricals need not share categories
+    stores = orders.groupby(orders['store_name'].astype(object)).agg(
+        subtotal_sales=('order_subtotal', 'sum'),
+        merchant_net_total=('order_merchant_total', 'sum'),
+        commission=('order_commission', 'sum'),
+        orders=('order_subtotal', 'size'),
+    )
+    canceled = cancellations.groupby(cancellations['store_name'].astype(object)).size().rename('canceled')
+    stores = stores.join(canceled, how='outer').fillna(0)
+    stores['total_orders'] = (stores.pop('orders') + stores.pop('canceled')).astype('int64')
+    stores = stores.rename_axis('store_name').reset_index()
+    return grubhub_store_ratios(stores.reindex(columns=['store_name', 'total_orders', 'subtotal_sales',
+                                                        'merchant_net_total', 'commission']))
+
+
+# Batch evaluation over every store and date window
+
+def window_starts(dates, start, days):
+    """Start date of the ``days``-long window (counted from ``start``) holding each date"""
+    start = pd.Timestamp(start)
+    width = pd.Timedelta(days=days)
+    return start + ((dates - start) // width) * width
+
+
+def grouped_kpis(frame, date_column, columns, kpis, start, days):
+    """Evaluate ``kpis`` for every (store, window) of ``frame`` in one groupby pass"""
+    keys = [frame['Store name'] if 'Store name' in frame.columns else frame['store_name'],
+            window_starts(frame[date_column], start, days).rename('window_start')]
+    sums = frame.groupby(keys, observed=True)[list(columns)].sum()
+    values = kpis(sums)
+    result = pd.DataFrame({name: np.asarray(value) for name, value in values.items()}, index=sums.index)
+    result.index = result.index.set_names(['store', 'window_start'])
+    return result
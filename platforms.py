@@ -0,0 +1,127 @@
+"""Lazily loaded per-platform datasets.
+
+The dashboard only shows one platform per rerun, and most sections only read
+one or two tables. Each platform exposes its datasets as a ``LazyDatasets``
+mapping whose values are loaded on first access, so a rerun only pays for
+the tables its visible sections actually touch.
+"""
+import os
+from collections.abc import Mapping
+
+from data_cache import file_fingerprint, read_export, read_exports, row_count
+from exports import DATE_COLUMNS
+from filters import sort_by_date
+from schema import DTYPES, apply_schema, projected_columns
+
+GRUBHUB_DIR = 'grubhub'
+
+# GrubHub dataset -> CSV file
+GRUBHUB_FILES = {
+    'financial_summary': os.path.join(GRUBHUB_DIR, 'financial_summary.csv'),
+    'operations_summary': os.path.join(GRUBHUB_DIR, 'operations_summary.csv'),
+    'order_details': os.path.join(GRUBHUB_DIR, 'order_details.csv'),
+    'transactions': os.path.join(GRUBHUB_DIR, 'transactions.csv'),
+    'product_mix': os.path.join(GRUBHUB_DIR, 'product_mix.csv'),
+    'cancellations': os.path.join(GRUBHUB_DIR, 'cancellations.csv'),
+    'deposits': os.path.join(GRUBHUB_DIR, 'deposits.csv'),
+    'deposit_details': os.path.join(GRUBHUB_DIR, 'deposit_details.csv'),
+}
+
+GRUBHUB_DATE_COLUMNS = ['start_date', 'end_date', 'order_date', 'transaction_date', 'cancellation_date', 'payout_date']
+
+# GrubHub dataset -> date column its frame is sorted by, when not start_date.
+# A cancellation belongs to the day its order was placed.
+GRUBHUB_SORT_COLUMNS = {
+    'order_details': 'order_date',
+    'transactions': 'transaction_date',
+    'cancellations': 'order_date',
+}
+
+
+class LazyDatasets(Mapping):
+    """Read-only mapping of dataset name -> frame, loaded on first access.
+
+    ``loaders`` maps each dataset name to a zero-argument callable. Membership
+    tests and iteration never trigger a load. ``versions`` maps each dataset
+    to the version of the files behind it, for caches of results derived
+    from that dataset alone; ``version`` identifies all of them together.
+    """
+
+    def __init__(self, loaders, batch_loader=None, versions=None):
+        self._loaders = dict(loaders)
+        self._batch_loader = batch_loader
+        self._loaded = {}
+        self.versions = dict(versions or {})
+        self.version = tuple(self.versions.values())
+
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            self._loaded[key] = self._loaders[key]()
+        return self._loaded[key]
+
+    def __contains__(self, key):
+        return key in self._loaders
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def prefetch(self, keys):
+        """Load several datasets in one ``batch_loader`` call (e.g. in parallel)"""
+        missing = tuple(key for key in keys if key in self._loaders and key not in self._loaded)
+        if not missing:
+            return
+        if self._batch_loader is None:
+            for key in missing:
+                self[key]
+        else:
+            self._loaded.update(self._batch_loader(missing))
+
+
+def available_grubhub_files():
+    """GrubHub datasets whose CSV file exists on disk"""
+    return {key: path for key, path in GRUBHUB_FILES.items() if os.path.exists(path)}
+
+
+def grubhub_signature():
+    """Hashable summary of the GrubHub files on disk; changes when any file is replaced"""
+    return tuple((key, *file_fingerprint(path).values()) for key, path in available_grubhub_files().items())
+
+
+def prepare_doordash_export(kind, frame):
+    """Sort a combined DoorDash export by date and encode its categoricals"""
+    return apply_schema(sort_by_date(frame, DATE_COLUMNS[kind][0]), kind)
+
+
+def _grubhub_job(key):
+    # Date columns are converted during ingest
+    return {
+        'path': GRUBHUB_FILES[key],
+        'date_columns': GRUBHUB_DATE_COLUMNS,
+        'date_errors': 'coerce',
+        'columns': projected_columns(key),
+        'dtypes': DTYPES.get(key),
+    }
+
+
+def _prepare_grubhub_table(key, df):
+    return apply_schema(sort_by_date(df, GRUBHUB_SORT_COLUMNS.get(key, 'start_date')), key)
+
+
+def read_grubhub_table(key):
+    """Read the columns the dashboard uses from one GrubHub table"""
+    return _prepare_grubhub_table(key, read_export(**_grubhub_job(key)))
+
+
+def read_grubhub_tables(keys, max_workers=None):
+    """Read several GrubHub tables concurrently; returns ``(tables, timings)``"""
+    frames, timings = read_exports({key: _grubhub_job(key) for key in keys}, max_workers)
+    return {key: _prepare_grubhub_table(key, df) for key, df in frames.items()}, timings
+
+
+def grubhub_row_count(key):
+    """Number of records in a GrubHub table, without loading it"""
+    return row_count(GRUBHUB_FILES[key], date_columns=GRUBHUB_DATE_COLUMNS, date_errors='coerce',
+                     dtypes=DTYPES.get(key))
@@ -0,0 +1,155 @@
+"""Per-rerun timing and memory profile of the dashboard sections.
+
+A ``Profiler`` records every ``section`` of a rerun: its wall time, the
+rows it read and produced, and the peak memory allocated while it ran
+(via ``tracemalloc``, which is only switched on while profiling). Sections
+may nest, e.g. a lazy load triggered inside a chart section. The peak of
+the inner section counts towards the outer one.
+
+A session keeps one profiler. ``start()`` opens a rerun, either a full run
+of the script or a run of fragments alone, and ``finish()`` closes it.
+Records of the latest ``PROFILE_RUNS`` reruns are kept for the panel.
+
+Profiling is off by default. ``TODC_PROFILE=1`` turns it on for every rerun;
+``?profile=1`` in the URL turns it on for one session. Each record is also
+logged as one JSON line on the ``profiling`` logger, and appended to the
+file named by ``TODC_PROFILE_LOG`` when that is set.
+
+tracemalloc is process-wide, so reruns of other sessions running at the
+same time inflate the memory figures.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+PROFILE_DEFAULT = os.environ.get('TODC_PROFILE', '') not in ('', '0')
+PROFILE_LOG = os.environ.get('TODC_PROFILE_LOG')
+PROFILE_RUNS = int(os.environ.get('TODC_PROFILE_RUNS', '10'))
+
+logger = logging.getLogger('profiling')
+if PROFILE_LOG:
+    _handler = logging.FileHandler(PROFILE_LOG)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+RECORD_COLUMNS = ['rerun', 'section', 'parent', 'seconds', 'rows_in', 'rows_out', 'peak_mb']
+
+
+def rows(value):
+    """Row count of a frame, or of every frame in a mapping; ``None`` for anything else"""
+    if isinstance(value, dict):
+        counts = [rows(v) for v in value.values()]
+        return sum(c for c in counts if c is not None)
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+class Profiler:
+    """Collects the section records of the latest reruns; the first one starts at once"""
+
+    def __init__(self, enabled=PROFILE_DEFAULT):
+        self.records = []
+        self._owns_tracemalloc = False
+        self.start(enabled)
+
+    def start(self, enabled=None):
+        """Open a new rerun, dropping the one still open if any
+
+        ``enabled`` switches profiling on or off from this rerun on.
+        """
+        if enabled is not None:
+            self.enabled = enabled
+        self.rerun = uuid.uuid4().hex[:8]
+        self.running = self.enabled
+        self._stack = []
+        self._started = time.perf_counter()
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        elif not self.enabled:
+            self._stop_tracemalloc()
+        self._baseline = tracemalloc.get_traced_memory()[0] if self.enabled else 0
+        self._peak = self._baseline
+        reruns = list(dict.fromkeys(record['rerun'] for record in self.records))
+        kept = set(reruns[max(len(reruns) - PROFILE_RUNS + 1, 0):]) if PROFILE_RUNS > 1 else set()
+        self.records = [record for record in self.records if record['rerun'] in kept]
+
+    def _stop_tracemalloc(self):
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+
+    @contextlib.contextmanager
+    def section(self, name, rows_in=None):
+        """Time the block and measure its peak memory
+
+        Yields the record; set ``record['rows_out']`` inside the block.
+        """
+        record = {'rerun': self.rerun, 'section': name, 'rows_in': rows_in, 'rows_out': None}
+        if not self.running:
+            yield record
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            # Keep the parent's peak so far before the counter is reset for this section
+            self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+        record.update(parent=self._stack[-1]['section'] if self._stack else None, _start=current, _peak=current)
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1])
+            record['seconds'] = round(seconds, 6)
+            record['peak_mb'] = round(max(peak - record.pop('_start'), 0) / 2 ** 20, 3)
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            self._peak = max(self._peak, peak)
+            tracemalloc.reset_peak()
+            self.records.append(record)
+            logger.info(json.dumps(record))
+
+    def wrap(self, name, func):
+        """``func`` run as a section whose output rows are counted from its result"""
+        def profiled(*args, **kwargs):
+            with self.section(name) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = rows(result)
+            return result
+        return profiled
+
+    def finish(self, **extra):
+        """Record the whole rerun and stop tracemalloc if this profiler started it
+
+        ``extra`` fields (e.g. cache counters) are added to the logged record.
+        Does nothing when no rerun is open.
+        """
+        if not self.running:
+            return
+        record = {
+            'rerun': self.rerun, 'section': 'Total rerun', 'parent': None,
+            'seconds': round(time.perf_counter() - self._started, 6),
+            'rows_in': None, 'rows_out': None,
+            'peak_mb': round((max(self._peak, tracemalloc.get_traced_memory()[1]) - self._baseline) / 2 ** 20, 3),
+        }
+        self.records.append(record)
+        logger.info(json.dumps({**record, **extra}))
+        self.running = False
+        self._stop_tracemalloc()
+
+    def table(self):
+        """Records in the order their sections finished, oldest rerun first, as a frame"""
+        return pd.DataFrame(self.records, columns=RECORD_COLUMNS)
+
+    def json_lines(self):
+        return '\n'.join(json.dumps(record) for record in self.records)
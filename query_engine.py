@@ -0,0 +1,451 @@
+"""Embedded SQL query engine, an alternative to the pandas query path.
+
+The DoorDash and GrubHub exports are registered as tables of an in-process
+database. The dashboard's KPI totals and top-N store rankings are then
+answered by SQL pushed down to it instead of pandas over loaded frames:
+
+- DuckDB (optional dependency) scans the Parquet ingest cache, or the CSVs
+  when pyarrow is missing, in place. It runs multi-threaded and spills to
+  disk, so exports larger than memory are queried without loading them.
+- SQLite ships with Python. It copies the columns it needs into an
+  in-memory database, so it serves parity checks and small deployments.
+
+DoorDash windows are combined like ``ExportHistory``: a row repeated in
+several export windows is taken from the most recent one. Ratios are not
+written in SQL. The summed measures go through the same ``metrics``
+functions as the pandas path, so both engines share one definition of
+every KPI.
+
+``TODC_QUERY_ENGINE`` selects ``pandas`` (default), ``duckdb`` or ``sqlite``.
+``--verify`` checks an engine against the pandas path:
+
+    python query_engine.py --engine sqlite --verify
+"""
+import argparse
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import rollups
+from data_cache import CACHE_DIR, HAS_PYARROW, ingest, parse_csv
+from exports import DATE_COLUMNS, DEDUP_KEYS, ExportHistory, discover_exports
+from filters import ONE_DAY
+from platforms import GRUBHUB_DATE_COLUMNS, GRUBHUB_FILES, available_grubhub_files, read_grubhub_table
+from schema import DTYPES, GRUBHUB_FILTER_COLUMNS
+from streaming import TOLERANCE
+
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+ENGINES = ['pandas', 'duckdb', 'sqlite']
+QUERY_ENGINE = os.environ.get('TODC_QUERY_ENGINE', 'pandas')
+
+# dataset -> (column bounded by the start of a date range, column bounded by its end)
+DATE_BOUNDS = {
+    'detailed_transactions': (rollups.FINANCIAL_DATE, rollups.FINANCIAL_DATE),
+    'promotion': (rollups.MARKETING_DATE, rollups.MARKETING_DATE),
+    'financial_summary': ('start_date', 'end_date'),
+    'operations_summary': ('start_date', 'end_date'),
+}
+
+# dataset -> columns registered in the database
+TABLE_COLUMNS = {
+    'detailed_transactions': rollups.FINANCIAL_DIMENSIONS + rollups.FINANCIAL_MEASURES,
+    'promotion': rollups.MARKETING_DIMENSIONS + rollups.MARKETING_MEASURES + rollups.MARKETING_MEAN_MEASURES,
+    'financial_summary': GRUBHUB_FILTER_COLUMNS + metrics.GRUBHUB_FINANCIAL_COLUMNS,
+    'operations_summary': GRUBHUB_FILTER_COLUMNS + metrics.GRUBHUB_OPERATIONS_COLUMNS,
+}
+
+# pandas dtype -> DuckDB type of the columns of a dataset with no export on disk
+DUCKDB_TYPES = {'int64': 'BIGINT', 'float64': 'DOUBLE', 'bool': 'BOOLEAN', 'datetime64[ns]': 'TIMESTAMP'}
+
+GRUBHUB_STORE_MEASURES = ['total_orders', 'subtotal_sales', 'merchant_net_total', 'commission']
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _ingest_options(dataset):
+    if dataset in GRUBHUB_FILES:
+        return {'date_columns': GRUBHUB_DATE_COLUMNS, 'date_errors': 'coerce', 'dtypes': DTYPES.get(dataset)}
+    return {'date_columns': DATE_COLUMNS[dataset], 'dtypes': DTYPES.get(dataset)}
+
+
+def _empty_windows(dataset, columns):
+    """Typed frame without rows, the windows table of a dataset with no export on disk"""
+    options = _ingest_options(dataset)
+    dtypes = options['dtypes'] or {}
+    frame = pd.DataFrame({
+        column: pd.Series(dtype='datetime64[ns]' if column in options['date_columns'] else dtypes.get(column, object))
+        for column in columns
+    })
+    return frame.assign(_window=pd.Series(dtype='int64'))
+
+
+def source_files(dataset, root='.'):
+    """Files holding ``dataset``, oldest export window first
+
+    Parquet copies from the ingest cache when pyarrow is available, the
+    source CSVs otherwise.
+    """
+    if dataset in GRUBHUB_FILES:
+        paths = [GRUBHUB_FILES[dataset]]
+    else:
+        paths = [e.path for e in discover_exports(dataset, root)]
+    if not HAS_PYARROW:
+        return paths
+    options = _ingest_options(dataset)
+    return [os.path.join(CACHE_DIR, ingest(path, cache_dir=CACHE_DIR, **options)['parquet']) for path in paths]
+
+
+def _aggregate(dataset, column):
+    """SQL aggregate producing the ``metrics`` measure named ``column``"""
+    if column == rollups.ROWS:
+        return 'COUNT(*)'
+    if column.endswith(' count'):
+        return f'COUNT({quote(column[:-len(" count")])})'
+    if DTYPES.get(dataset, {}).get(column) == 'int64':
+        return f'CAST(COALESCE(SUM({quote(column)}), 0) AS BIGINT)'
+    return f'COALESCE(SUM({quote(column)}), 0.0)'
+
+
+class QueryEngine(ABC):
+    """SQL over the registered exports; tables are registered on first use
+
+    Subclasses provide the database ``connection``: ``_register`` creates the
+    table of every export window of a dataset, ``_execute`` runs a query.
+    """
+
+    connection = None
+
+    def __init__(self, root='.'):
+        self.root = root
+        self._registered = set()
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _register(self, table, sources, columns):
+        """Create ``table`` over the export files ``sources``, oldest window first"""
+
+    @abstractmethod
+    def _unregister(self, table):
+        """Drop ``table``"""
+
+    @abstractmethod
+    def _execute(self, sql, params):
+        """Result of the query ``sql`` as a frame"""
+
+    def _param(self, value):
+        return value
+
+    def table(self, dataset):
+        """Name of the table of ``dataset``, registering it on first use"""
+        with self._lock:
+            if dataset not in self._registered:
+                columns = list(dict.fromkeys(TABLE_COLUMNS[dataset] + DEDUP_KEYS.get(dataset, [])))
+                self._register(f'_{dataset}_windows', source_files(dataset, self.root), columns)
+                self.connection.execute(f'CREATE VIEW {quote(dataset)} AS {self._latest_rows(dataset)}')
+                self._registered.add(dataset)
+        return quote(dataset)
+
+    def forget(self, *datasets):
+        """Drop the tables of ``datasets``, so their next use registers the files on disk afresh"""
+        with self._lock:
+            for dataset in datasets:
+                if dataset in self._registered:
+                    self.connection.execute(f'DROP VIEW {quote(dataset)}')
+                    self._unregister(f'_{dataset}_windows')
+                    self._registered.discard(dataset)
+
+    def _latest_rows(self, dataset):
+        # Of the copies of a row in several windows, keep the one of the newest window
+        columns = ', '.join(quote(c) for c in TABLE_COLUMNS[dataset])
+        keys = DEDUP_KEYS.get(dataset)
+        if not keys:
+            return f'SELECT {columns} FROM _{dataset}_windows'
+        return (
+            f'SELECT {columns} FROM (SELECT *, ROW_NUMBER() OVER '
+            f'(PARTITION BY {", ".join(quote(k) for k in keys)} ORDER BY _window DESC) AS _rank '
+            f'FROM _{dataset}_windows) WHERE _rank = 1'
+        )
+
+    def _where(self, dataset, date_range=None, equals=None):
+        """WHERE clause and parameters of a filter state, as ``slice_cube`` applies it"""
+        conditions, params = [], []
+        if date_range is not None and len(date_range) == 2:
+            start_column, end_column = DATE_BOUNDS[dataset]
+            first, last = date_range
+            if first is not None:
+                conditions.append(f'{quote(start_column)} >= ?')
+                params.append(self._param(pd.Timestamp(first).to_pydatetime()))
+            if last is not None:
+                conditions.append(f'{quote(end_column)} < ?')
+                params.append(self._param((pd.Timestamp(last) + ONE_DAY).to_pydatetime()))
+        for column, value in (equals or {}).items():
+            if value is not None:
+                conditions.append(f'{quote(column)} = ?')
+                params.append(self._param(value))
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def totals(self, dataset, columns, date_range=None, equals=None):
+        """``metrics.totals`` of the filtered rows of ``dataset``, computed by the database"""
+        where, params = self._where(dataset, date_range, equals)
+        select = ', '.join(_aggregate(dataset, c) for c in columns)
+        row = self._execute(f'SELECT {select} FROM {self.table(dataset)}{where}', params)
+        # Column by column: a row of mixed types would turn integer counts into floats
+        return {column: row.iloc[0, i].item() for i, column in enumerate(columns)}
+
+    def store_totals(self, dataset, measures, mean_measures=(), date_range=None, equals=None, by=None, n=None):
+        """Per-store sums of ``measures`` and means of ``mean_measures``
+
+        With ``by``, only the ``n`` stores with the largest ``by``, largest first.
+        """
+        where, params = self._where(dataset, date_range, equals)
+        store = 'Store name' if dataset in DEDUP_KEYS else 'store_name'
+        select = [quote(store)] + [f'{_aggregate(dataset, m)} AS {quote(m)}' for m in measures]
+        select += [f'SUM({quote(m)}) / COUNT({quote(m)}) AS {quote(m)}' for m in mean_measures]
+        sql = f'SELECT {", ".join(select)} FROM {self.table(dataset)}{where} GROUP BY {quote(store)}'
+        if by is not None:
+            sql += f' ORDER BY {quote(by)} DESC, {quote(store)}'
+            if n is not None:
+                sql += f' LIMIT {int(n)}'
+        return self._execute(sql, params)
+
+    def top_stores(self, dataset, by, measures, mean_measures=(), n=10, date_range=None, equals=None):
+        """``rollups.top_stores`` of the filtered rows of ``dataset``"""
+        return self.store_totals(dataset, measures, mean_measures, date_range, equals, by=by, n=n)
+
+    def grubhub_store_performance(self, date_range=None, equals=None):
+        """``metrics.grubhub_store_performance`` of the filtered financial summary"""
+        stores = self.store_totals('financial_summary', GRUBHUB_STORE_MEASURES, date_range=date_range,
+                                   equals=equals)
+        return metrics.grubhub_store_ratios(stores)
+
+
+class DuckDBEngine(QueryEngine):
+    """Queries the export files in place with DuckDB"""
+
+    def __init__(self, root='.'):
+        if not HAS_DUCKDB:
+            raise ImportError("TODC_QUERY_ENGINE=duckdb needs the duckdb package (pip install duckdb)")
+        super().__init__(root)
+        self.connection = duckdb.connect()
+
+    def _register(self, table, sources, columns):
+        if not sources:
+            empty = _empty_windows(table[1:-len('_windows')], columns)
+            typed = ', '.join(f'CAST(NULL AS {DUCKDB_TYPES.get(str(dtype), "VARCHAR")}) AS {quote(column)}'
+                              for column, dtype in empty.dtypes.items())
+            self.connection.execute(f'CREATE VIEW {quote(table)} AS SELECT {typed} WHERE false')
+            return
+        selected = ', '.join(quote(c) for c in columns)
+        windows = []
+        for position, path in enumerate(sources):
+            if path.endswith('.parquet'):
+                reader = f'read_parquet({_literal(path)})'
+            else:
+                reader = f"read_csv({_literal(path)}, header = true, dateformat = '%Y-%m-%d')"
+            windows.append(f'SELECT {selected}, {position} AS _window FROM {reader}')
+        self.connection.execute(f'CREATE VIEW {quote(table)} AS ' + ' UNION ALL BY NAME '.join(windows))
+
+    def _unregister(self, table):
+        self.connection.execute(f'DROP VIEW {quote(table)}')
+
+    def _execute(self, sql, params):
+        # One cursor per query: DuckDB connections must not be shared between threads
+        return self.connection.cursor().execute(sql, params).df()
+
+
+class SQLiteEngine(QueryEngine):
+    """Copies the registered columns into an in-memory SQLite database"""
+
+    def __init__(self, root='.'):
+        super().__init__(root)
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self._query_lock = threading.Lock()
+
+    def _register(self, table, sources, columns):
+        dataset = table[1:-len('_windows')]
+        # Without sources the table is still created, empty, so queries return zero totals
+        _empty_windows(dataset, columns).to_sql(table, self.connection, index=False)
+        for position, path in enumerate(sources):
+            if path.endswith('.parquet'):
+                frame = pd.read_parquet(path, columns=columns)
+            else:
+                frame = parse_csv(path, columns=columns, **_ingest_options(dataset))
+            frame.assign(_window=position).to_sql(table, self.connection, index=False, if_exists='append')
+
+    def _unregister(self, table):
+        self.connection.execute(f'DROP TABLE {quote(table)}')
+
+    def forget(self, *datasets):
+        # Not while a query reads the tables being dropped
+        with self._query_lock:
+            super().forget(*datasets)
+
+    def _param(self, value):
+        # pandas stores datetimes as ISO text in SQLite
+        if hasattr(value, 'strftime'):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+
+    def _execute(self, sql, params):
+        with self._query_lock:
+            return pd.read_sql_query(sql, self.connection, params=params)
+
+
+def connect(engine=QUERY_ENGINE, root='.'):
+    """Query engine named ``engine``; ``None`` for the pandas path"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown query engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    if engine == 'duckdb':
+        return DuckDBEngine(root)
+    if engine == 'sqlite':
+        return SQLiteEngine(root)
+    return None
+
+
+# Parity with the pandas path
+
+def _close(sql_value, pandas_value):
+    return np.allclose(np.asarray(sql_value, dtype='float64'), np.asarray(pandas_value, dtype='float64'),
+                       rtol=0, atol=TOLERANCE, equal_nan=True)
+
+
+def compare_kpis(sql_kpis, pandas_kpis, label):
+    for name, value in pandas_kpis.items():
+        if not _close(sql_kpis[name], value):
+            raise AssertionError(f"{label}: {name} is {sql_kpis[name]} in SQL and {value} in pandas")
+
+
+def compare_stores(sql_stores, pandas_stores, store, label):
+    """Per-store rows must match; the order may differ among stores with equal values"""
+    sql_stores = sql_stores.assign(**{store: sql_stores[store].astype(str)}).set_index(store).sort_index()
+    pandas_stores = pandas_stores.assign(**{store: pandas_stores[store].astype(str)}).set_index(store).sort_index()
+    if not sql_stores.index.equals(pandas_stores.index):
+        raise AssertionError(f"{label}: different stores in SQL and pandas")
+    for column in pandas_stores.columns:
+        if not _close(sql_stores[column], pandas_stores[column]):
+            raise AssertionError(f"{label}: {column} differs between SQL and pandas")
+
+
+def _filter_states(frame, store_column, date_column, stores=3):
+    """Filter states to check: everything, the last week, and a few of the busiest stores"""
+    last = frame[date_column].max()
+    states = [(None, None), (((last - pd.Timedelta(days=6)).date(), last.date()), None)]
+    busiest = frame[store_column].value_counts().index[:stores]
+    return states + [(None, str(store)) for store in busiest]
+
+
+def verify_doordash(engine, root='.'):
+    cubes = {}
+    for kind in ('detailed_transactions', 'promotion'):
+        history = ExportHistory(kind, root=root, columns=TABLE_COLUMNS[kind])
+        cubes[kind] = rollups.build_dataset_cube(history.refresh(), kind)
+    checked = 0
+    for date_range, store in _filter_states(cubes['detailed_transactions'], 'Store name', rollups.FINANCIAL_DATE):
+        equals = {**metrics.DELIVERED_ORDERS, 'Store name': store}
+        selected = rollups.slice_cube(cubes['detailed_transactions'], rollups.FINANCIAL_DATE, date_range, equals)
+        label = f"financial {date_range} {store}"
+        compare_kpis(
+            metrics.doordash_financial_kpis(engine.totals('detailed_transactions', metrics.DOORDASH_FINANCIAL_COLUMNS,
+                                                          date_range, equals)),
+            metrics.doordash_financial_kpis(metrics.totals(selected, metrics.DOORDASH_FINANCIAL_COLUMNS)), label)
+        if store is None:
+            measures = ['Subtotal', 'Net total']
+            compare_stores(engine.top_stores('detailed_transactions', 'Subtotal', measures, n=None,
+                                             date_range=date_range, equals=equals),
+                           rollups.top_stores(selected, 'Subtotal', measures, n=len(selected)), 'Store name', label)
+        checked += 1
+    for date_range, store in _filter_states(cubes['promotion'], 'Store name', rollups.MARKETING_DATE):
+        for self_serve in (None, True):
+            equals = {'Store name': store, 'Is self serve campaign': self_serve}
+            selected = rollups.slice_cube(cubes['promotion'], rollups.MARKETING_DATE, date_range, equals)
+            label = f"marketing {date_range} {store} self-serve={self_serve}"
+            compare_kpis(
+                metrics.doordash_marketing_kpis(engine.totals('promotion', metrics.DOORDASH_MARKETING_COLUMNS,
+                                                              date_range, equals)),
+                metrics.doordash_marketing_kpis(metrics.totals(selected, metrics.DOORDASH_MARKETING_COLUMNS)), label)
+            if store is None:
+                measures = ['Sales', 'Orders', 'New customers acquired']
+                compare_stores(engine.top_stores('promotion', 'Sales', measures, ['ROAS'], n=None,
+                                                 date_range=date_range, equals=equals),
+                               rollups.top_stores(selected, 'Sales', measures, ['ROAS'], n=len(selected)),
+                               'Store name', label)
+            checked += 1
+    return checked
+
+
+def _grubhub_slice(frame, date_range, store):
+    mask = np.ones(len(frame), dtype=bool)
+    if date_range is not None:
+        mask &= (frame['start_date'] >= pd.Timestamp(date_range[0])).to_numpy()
+        mask &= (frame['end_date'] < pd.Timestamp(date_range[1]) + ONE_DAY).to_numpy()
+    if store is not None:
+        mask &= (frame['store_name'] == store).to_numpy()
+    return frame[mask]
+
+
+def verify_grubhub(engine):
+    available = available_grubhub_files()
+    checked = 0
+    if 'financial_summary' in available:
+        financial = read_grubhub_table('financial_summary')
+        for date_range, store in _filter_states(financial, 'store_name', 'end_date'):
+            equals = {'store_name': store}
+            selected = _grubhub_slice(financial, date_range, store)
+            label = f"GrubHub financial {date_range} {store}"
+            compare_kpis(
+                metrics.grubhub_financial_kpis(engine.totals('financial_summary', metrics.GRUBHUB_FINANCIAL_COLUMNS,
+                                                             date_range, equals)),
+                metrics.grubhub_financial_kpis(metrics.totals(selected, metrics.GRUBHUB_FINANCIAL_COLUMNS)), label)
+            compare_stores(engine.grubhub_store_performance(date_range, equals),
+                           metrics.grubhub_store_performance(selected), 'store_name', label)
+            checked += 1
+    if 'operations_summary' in available:
+        operations = read_grubhub_table('operations_summary')
+        for date_range, store in _filter_states(operations, 'store_name', 'end_date'):
+            selected = _grubhub_slice(operations, date_range, store)
+            compare_kpis(
+                metrics.grubhub_operations_kpis(engine.totals('operations_summary', metrics.GRUBHUB_OPERATIONS_COLUMNS,
+                                                              date_range, {'store_name': store})),
+                metrics.grubhub_operations_kpis(metrics.totals(selected, metrics.GRUBHUB_OPERATIONS_COLUMNS)),
+                f"GrubHub operations {date_range} {store}")
+            checked += 1
+    return checked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check an embedded SQL engine against the pandas path')
+    parser.add_argument('--engine', choices=ENGINES[1:], default='duckdb' if HAS_DUCKDB else 'sqlite')
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--verify', action='store_true',
+                        help='compare KPIs and store rankings with pandas and exit non-zero on mismatch')
+    args = parser.parse_args(argv)
+
+    engine = connect(args.engine, args.root)
+    for dataset in TABLE_COLUMNS:
+        if dataset in GRUBHUB_FILES and dataset not in available_grubhub_files():
+            continue
+        rows = engine.totals(dataset, [rollups.ROWS])[rollups.ROWS]
+        print(f"{dataset}: {rows:,} rows registered in {args.engine}")
+    if args.verify:
+        checked = verify_doordash(engine, args.root) + verify_grubhub(engine)
+        print(f"{checked} filter states match the pandas path (tolerance {TOLERANCE:.0e})")
+
+
+if __name__ == '__main__':
+    main()
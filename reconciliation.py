@@ -0,0 +1,313 @@
+"""Reconciliation of order-level transactions against payouts.
+
+Each check joins two exports on the identifiers they share and compares
+the amounts and dates both of them report:
+
+- DoorDash payouts: detailed transactions summed per (Payout ID, Store ID,
+  Channel) against the payout summary.
+- DoorDash error charges: the error charges and adjustments export against
+  the detailed transactions, by DoorDash transaction ID.
+- GrubHub transactions: ``transactions.csv`` against ``deposit_details.csv``
+  by transaction ID.
+- GrubHub deposits: deposit details summed per (deposit, store) against
+  ``deposits.csv``.
+
+Every check is one hash join (``DataFrame.merge``), so it runs in time
+linear in the number of rows. No row is ever compared with more than its
+own counterpart.
+
+An export covers a fixed window. A payout early in the window may include
+orders from before it, and orders late in the window may not be paid out
+yet. Discrepancies dated within ``EDGE_DAYS`` of either end of the window
+are therefore marked ``window_edge``. They usually go away once the
+neighbouring export window is loaded. DoorDash windows are taken from the
+export directory names, so with several windows loaded only the ends of
+each window count. GrubHub files carry no window, so theirs is the range
+of the dates they hold. The margin stays below half of a window's length,
+so the middle of every window is never an edge.
+
+    python reconciliation.py doordash --output discrepancies.csv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_cache import read_export
+from exports import ExportHistory, discover_exports
+from platforms import GRUBHUB_DATE_COLUMNS, GRUBHUB_FILES, available_grubhub_files
+from schema import DTYPES
+
+# Largest difference between two amounts that still counts as equal
+TOLERANCE = 0.005
+
+# Discrepancies this close to either end of the export window are marked window_edge
+EDGE_DAYS = int(os.environ.get('TODC_RECONCILIATION_EDGE_DAYS', '7'))
+
+MATCHED = 'matched'
+STATUS_ORDER = ['amount mismatch', 'date mismatch', 'missing payout', 'missing transactions', 'not paid out']
+
+# DoorDash
+PAYOUT_KEYS = ['Payout ID', 'Store ID', 'Channel']
+PAYOUT_AMOUNTS = ['Subtotal', 'Commission', 'Error charges', 'Adjustments', 'Net total']
+ERROR_CHARGE_AMOUNTS = ['Error charges', 'Adjustments']
+DOORDASH_TRANSACTION_COLUMNS = (['DoorDash transaction ID', 'Timestamp local date', 'Payout date', 'Store name']
+                                + PAYOUT_KEYS + PAYOUT_AMOUNTS)
+
+# GrubHub
+GRUBHUB_TRANSACTION_AMOUNTS = ['subtotal', 'commission', 'tip', 'merchant_net_total']
+GRUBHUB_TRANSACTION_COLUMNS = ['transaction_id', 'transaction_date', 'store_name'] + GRUBHUB_TRANSACTION_AMOUNTS
+DEPOSIT_KEYS = ['deposit_id', 'grubhub_store_id']
+
+
+def reconcile(transactions, payouts, keys, amounts=(), dates=(), labels=(), date=None,
+              names=('transactions', 'payouts')):
+    """Hash-join ``transactions`` and ``payouts`` on ``keys`` and compare what both report
+
+    Each side must hold one row per key. ``amounts`` and ``dates`` are
+    columns of both sides. They come out suffixed with the side's name, plus
+    an ``<amount> difference`` column. ``labels`` (e.g. the store name) are
+    taken from whichever side has them. ``date`` names the column dating
+    each row, for ``mark_window_edges``. The ``status`` column says whether a
+    key is ``matched``, missing on one side, or disagrees on an amount or
+    date.
+    """
+    suffixes = tuple(f' ({name})' for name in names)
+    shared = set(transactions.columns) & set(payouts.columns) - set(keys)
+    merged = transactions.merge(payouts, on=keys, how='outer', suffixes=suffixes, indicator=True,
+                                validate='one_to_one')
+
+    for label in labels:
+        if label in shared:
+            merged[label] = merged.pop(label + suffixes[0]).combine_first(merged.pop(label + suffixes[1]))
+    if date is not None and date in shared:
+        merged['date'] = merged[date + suffixes[0]].combine_first(merged[date + suffixes[1]])
+    elif date is not None:
+        merged['date'] = merged[date]
+
+    amount_mismatch = np.zeros(len(merged), dtype=bool)
+    for amount in amounts:
+        # A key missing on one side differs by the whole amount of the other
+        difference = merged[amount + suffixes[0]].sub(merged[amount + suffixes[1]], fill_value=0)
+        merged[f'{amount} difference'] = difference.round(2)
+        amount_mismatch |= (difference.abs() > TOLERANCE).to_numpy()
+    date_mismatch = np.zeros(len(merged), dtype=bool)
+    for column in dates:
+        left, right = merged[column + suffixes[0]], merged[column + suffixes[1]]
+        date_mismatch |= (left.notna() & right.notna() & (left != right)).to_numpy()
+
+    side = merged.pop('_merge').to_numpy()
+    merged['status'] = np.select(
+        [side == 'left_only', side == 'right_only', amount_mismatch, date_mismatch],
+        ['missing payout', 'missing transactions', 'amount mismatch', 'date mismatch'],
+        MATCHED,
+    )
+    return merged
+
+
+def mark_window_edges(result, windows, days=EDGE_DAYS):
+    """Add ``window_edge``: the row's date is not in the middle of any of the ``(start, end)`` ``windows``
+
+    The middle of a window leaves out ``days`` at either end, or less than
+    half of the window when it is shorter. Rows without a date are no edge.
+    """
+    dates = result['date']
+    middle = np.zeros(len(result), dtype=bool)
+    for start, end in windows:
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        margin = pd.Timedelta(days=max(min(days, (end - start).days // 2), 0))
+        middle |= ((dates >= start + margin) & (dates <= end - margin)).fillna(False).to_numpy(dtype=bool)
+    result['window_edge'] = ~middle & dates.notna().to_numpy()
+    return result
+
+
+def export_windows(kind, root='.'):
+    """``(start, end)`` of every export window of ``kind``, from the export directory names"""
+    return [(export.start, export.end) for export in discover_exports(kind, root)]
+
+
+def _window(dates):
+    return [(dates.min(), dates.max())]
+
+
+def _to_dates(series):
+    return pd.to_datetime(series, format='%Y-%m-%d', errors='coerce')
+
+
+# DoorDash
+
+def doordash_payouts(transactions, payouts, windows):
+    """Detailed transactions summed per payout against the payout summary
+
+    ``windows`` are the ``(start, end)`` export windows of the transactions.
+    """
+    paid = transactions[transactions['Payout ID'].notna()]
+    grouped = paid.groupby(PAYOUT_KEYS, observed=True, sort=False)
+    totals = grouped[PAYOUT_AMOUNTS].sum()
+    totals['Payout date'] = grouped['Payout date'].max()
+    totals['Store name'] = grouped['Store name'].first()
+    totals['Transactions'] = grouped.size()
+    result = reconcile(totals.reset_index(), payouts[PAYOUT_KEYS + PAYOUT_AMOUNTS + ['Payout date', 'Store name']],
+                       PAYOUT_KEYS, PAYOUT_AMOUNTS, dates=['Payout date'], labels=['Store name'], date='Payout date')
+
+    # Orders without a payout yet are expected, not a discrepancy of any payout
+    unpaid = transactions[transactions['Payout ID'].isna() & (transactions['Transaction type'] == 'Order')]
+    if len(unpaid):
+        grouped = unpaid.groupby(['Store ID', 'Channel'], observed=True, sort=False)
+        pending = grouped[PAYOUT_AMOUNTS].sum().add_suffix(' (transactions)')
+        pending['Store name'] = grouped['Store name'].first()
+        pending['Transactions'] = grouped.size()
+        pending['date'] = grouped['Timestamp local date'].min()
+        pending['status'] = 'not paid out'
+        result = pd.concat([result, pending.reset_index()], ignore_index=True)
+    return mark_window_edges(result, windows)
+
+
+def doordash_error_charges(transactions, error_charges, windows):
+    """Error charges and adjustments export against the matching detailed transactions"""
+    keys = ['DoorDash transaction ID']
+    charged = transactions[transactions['DoorDash transaction ID'].isin(error_charges['DoorDash transaction ID'])]
+    result = reconcile(
+        error_charges[keys + ERROR_CHARGE_AMOUNTS + ['Store name', 'Timestamp local date']],
+        charged[keys + ERROR_CHARGE_AMOUNTS + ['Store name', 'Timestamp local date']],
+        keys, ERROR_CHARGE_AMOUNTS, labels=['Store name'], date='Timestamp local date',
+        names=('error charges', 'transactions'),
+    )
+    result['status'] = result['status'].replace({'missing payout': 'missing transactions'})
+    return mark_window_edges(result, windows)
+
+
+def load_doordash(root='.'):
+    """Detailed transactions, payout summary and error charges of every export window"""
+    transactions = ExportHistory('detailed_transactions', root=root,
+                                 columns=DOORDASH_TRANSACTION_COLUMNS + ['Transaction type']).refresh()
+    payouts = ExportHistory('payout_summary', root=root,
+                            columns=PAYOUT_KEYS + PAYOUT_AMOUNTS + ['Payout date', 'Store name']).refresh()
+    error_charges = ExportHistory('error_charges', root=root,
+                                  columns=['DoorDash transaction ID', 'Timestamp local time', 'Store name']
+                                  + ERROR_CHARGE_AMOUNTS).refresh()
+
+    transactions = transactions.assign(**{
+        'Payout ID': transactions['Payout ID'].astype('Int64'),
+        'Payout date': _to_dates(transactions['Payout date']),
+    })
+    payouts = payouts.assign(**{'Payout ID': payouts['Payout ID'].astype('Int64')})
+    error_charges = error_charges.assign(**{
+        'Timestamp local date': pd.to_datetime(error_charges['Timestamp local time'], errors='coerce').dt.normalize(),
+    })
+    return transactions, payouts, error_charges
+
+
+def doordash_reconciliation(root='.'):
+    """``{check: result}`` of every DoorDash check"""
+    transactions, payouts, error_charges = load_doordash(root)
+    windows = export_windows('detailed_transactions', root)
+    return {
+        'payouts': doordash_payouts(transactions, payouts, windows),
+        'error charges': doordash_error_charges(transactions, error_charges, windows),
+    }
+
+
+# GrubHub
+
+def grubhub_transactions(transactions, deposit_details):
+    """Transactions against the deposit details paying them out, by transaction ID"""
+    keys = ['transaction_id']
+    result = reconcile(
+        transactions[GRUBHUB_TRANSACTION_COLUMNS],
+        deposit_details[GRUBHUB_TRANSACTION_COLUMNS + ['deposit_id', 'payout_date']],
+        keys, GRUBHUB_TRANSACTION_AMOUNTS, dates=['transaction_date'], labels=['store_name'], date='transaction_date',
+    )
+    # Transactions newer than anything paid out yet are pending, not missing
+    last_paid = deposit_details['transaction_date'].max()
+    pending = (result['status'] == 'missing payout') & (result['date'] > last_paid)
+    result.loc[pending, 'status'] = 'not paid out'
+    return mark_window_edges(result, _window(transactions['transaction_date']))
+
+
+def grubhub_deposits(deposit_details, deposits):
+    """Deposit details summed per deposit and store against the deposits"""
+    grouped = deposit_details.groupby(DEPOSIT_KEYS, observed=True, sort=False)
+    totals = pd.DataFrame({
+        'payout_amount': grouped['merchant_net_total'].sum(),
+        'payout_date': grouped['payout_date'].max(),
+        'store_name': grouped['store_name'].first(),
+        'transactions': grouped.size(),
+    }).reset_index()
+    payouts = deposits[DEPOSIT_KEYS + ['payout_amount', 'payout_date', 'store_name']]
+    result = reconcile(totals, payouts, DEPOSIT_KEYS, ['payout_amount'], dates=['payout_date'],
+                       labels=['store_name'], date='payout_date', names=('deposit details', 'deposits'))
+    return mark_window_edges(result, _window(deposits['payout_date']))
+
+
+def _read_grubhub(key, columns):
+    return read_export(GRUBHUB_FILES[key], GRUBHUB_DATE_COLUMNS, 'coerce', columns=columns, dtypes=DTYPES.get(key))
+
+
+def grubhub_reconciliation():
+    """``{check: result}`` of every GrubHub check whose files are available"""
+    available = available_grubhub_files()
+    results = {}
+    if 'deposit_details' in available:
+        details = _read_grubhub('deposit_details', GRUBHUB_TRANSACTION_COLUMNS + DEPOSIT_KEYS + ['payout_date'])
+        if 'transactions' in available:
+            results['transactions'] = grubhub_transactions(
+                _read_grubhub('transactions', GRUBHUB_TRANSACTION_COLUMNS), details)
+        if 'deposits' in available:
+            results['deposits'] = grubhub_deposits(
+                details, _read_grubhub('deposits', DEPOSIT_KEYS + ['payout_amount', 'payout_date', 'store_name']))
+    return results
+
+
+# Reporting
+
+def summary(results):
+    """Rows per check and status, with the absolute amount at stake"""
+    rows = []
+    for check, result in results.items():
+        differences = result[[c for c in result.columns if c.endswith(' difference')]].abs()
+        at_stake = differences.max(axis=1).fillna(0) if differences.shape[1] else pd.Series(0.0, index=result.index)
+        for status, group in result.groupby('status', sort=False):
+            rows.append({'check': check, 'status': status, 'rows': len(group),
+                         'window_edge': int(group['window_edge'].sum()),
+                         'amount_difference': round(float(at_stake[group.index].sum()), 2)})
+    order = {status: i for i, status in enumerate([MATCHED] + STATUS_ORDER)}
+    table = pd.DataFrame(rows, columns=['check', 'status', 'rows', 'window_edge', 'amount_difference'])
+    return table.sort_values(['check', 'status'], key=lambda s: s.map(order) if s.name == 'status' else s,
+                             ignore_index=True)
+
+
+def discrepancies(results, include_edges=True):
+    """Every row of every check that is not ``matched``, with the check it came from"""
+    frames = []
+    for check, result in results.items():
+        rows = result[result['status'] != MATCHED]
+        if not include_edges:
+            rows = rows[~rows['window_edge']]
+        frames.append(rows.assign(check=check))
+    if not frames:
+        return pd.DataFrame(columns=['check', 'status'])
+    combined = pd.concat(frames, ignore_index=True)
+    front = ['check', 'status', 'window_edge', 'date']
+    return combined[front + [c for c in combined.columns if c not in front]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile transactions against payouts')
+    parser.add_argument('platform', choices=['doordash', 'grubhub'])
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--output', help='CSV file for every discrepancy (default: only print the summary)')
+    parser.add_argument('--no-edges', action='store_true', help='leave out discrepancies at the window edges')
+    args = parser.parse_args(argv)
+
+    results = doordash_reconciliation(args.root) if args.platform == 'doordash' else grubhub_reconciliation()
+    summary(results).to_string(sys.stdout, index=False)
+    print()
+    if args.output:
+        discrepancies(results, include_edges=not args.no_edges).to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
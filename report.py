@@ -0,0 +1,110 @@
+"""Batch per-store KPI reports without running the Streamlit app.
+
+Computes the dashboard KPIs for every store and every ``--days``-long date
+window in one grouped pass per dataset, and writes one row per
+(store, window) to CSV or JSON.
+
+    python report.py doordash --days 7 --output doordash_weekly.csv
+    python report.py grubhub --start 2025-09-22 --output grubhub.json
+
+``--stream`` builds the DoorDash cubes chunk by chunk (see streaming.py) for
+exports that do not fit in memory.
+"""
+import argparse
+import sys
+
+import pandas as pd
+
+import metrics
+import rollups
+from exports import ExportHistory
+from filters import date_slice
+from platforms import available_grubhub_files, prepare_doordash_export, read_grubhub_table
+from schema import projected_columns
+from streaming import stream_export_cube
+
+
+def load_doordash_cubes(root='.', stream=False):
+    """Marketing and financial cubes over every DoorDash export window under ``root``"""
+    cubes = {}
+    for kind in ('promotion', 'detailed_transactions'):
+        if stream:
+            cubes[kind] = stream_export_cube(kind, root)
+        else:
+            history = ExportHistory(kind, root=root, columns=projected_columns(kind))
+            cubes[kind] = rollups.build_dataset_cube(prepare_doordash_export(kind, history.refresh()), kind)
+    return cubes['promotion'], cubes['detailed_transactions']
+
+
+def _date_range(frame, date_column, start, end):
+    start = pd.Timestamp(start) if start else frame[date_column].min()
+    end = pd.Timestamp(end) if end else frame[date_column].max()
+    return start, end
+
+
+def doordash_report(marketing_cube, financial_cube, start=None, end=None, days=7):
+    """DoorDash financial and marketing KPIs per store and date window"""
+    financial = metrics.delivered_orders(financial_cube)
+    start, end = _date_range(financial, rollups.FINANCIAL_DATE, start, end)
+    financial = date_slice(financial, rollups.FINANCIAL_DATE, (start, end))
+    marketing = date_slice(marketing_cube, rollups.MARKETING_DATE, (start, end))
+
+    financial_kpis = metrics.grouped_kpis(financial, rollups.FINANCIAL_DATE, metrics.DOORDASH_FINANCIAL_COLUMNS,
+                                          metrics.doordash_financial_kpis, start, days)
+    marketing_kpis = metrics.grouped_kpis(marketing, rollups.MARKETING_DATE, metrics.DOORDASH_MARKETING_COLUMNS,
+                                          metrics.doordash_marketing_kpis, start, days)
+    return financial_kpis.join(marketing_kpis, how='outer').fillna(0)
+
+
+def grubhub_report(financial_summary, operations_summary, start=None, end=None, days=14):
+    """GrubHub financial and operations KPIs per store and date window"""
+    start, end = _date_range(financial_summary, 'start_date', start, end)
+    financial = date_slice(financial_summary, 'start_date', (start, end))
+    operations = date_slice(operations_summary, 'start_date', (start, end))
+
+    financial_kpis = metrics.grouped_kpis(financial, 'start_date', metrics.GRUBHUB_FINANCIAL_COLUMNS,
+                                          metrics.grubhub_financial_kpis, start, days)
+    operations_kpis = metrics.grouped_kpis(operations, 'start_date', metrics.GRUBHUB_OPERATIONS_COLUMNS,
+                                           metrics.grubhub_operations_kpis, start, days)
+    operations_kpis = operations_kpis.rename(columns={'total_orders': 'operations_total_orders'})
+    return financial_kpis.join(operations_kpis, how='outer').fillna(0)
+
+
+def write_report(report, output):
+    report = report.reset_index()
+    report['window_start'] = report['window_start'].dt.strftime('%Y-%m-%d')
+    if output is None:
+        report.to_csv(sys.stdout, index=False)
+    elif output.endswith('.json'):
+        report.to_json(output, orient='records', indent=2)
+    else:
+        report.to_csv(output, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('platform', choices=['doordash', 'grubhub'])
+    parser.add_argument('--start', help='first day of the first window (default: earliest date in the data)')
+    parser.add_argument('--end', help='last day to include (default: latest date in the data)')
+    parser.add_argument('--days', type=int, help='window length in days (default: 7 for DoorDash, 14 for GrubHub)')
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--output', help='CSV or .json file to write (default: CSV on stdout)')
+    parser.add_argument('--stream', action='store_true',
+                        help='build the DoorDash cubes in bounded-memory chunks')
+    args = parser.parse_args(argv)
+
+    if args.platform == 'doordash':
+        marketing_cube, financial_cube = load_doordash_cubes(args.root, args.stream)
+        report = doordash_report(marketing_cube, financial_cube, args.start, args.end, args.days or 7)
+    else:
+        missing = {'financial_summary', 'operations_summary'} - set(available_grubhub_files())
+        if missing:
+            parser.error(f"missing GrubHub files: {', '.join(sorted(missing))}")
+        report = grubhub_report(read_grubhub_table('financial_summary'), read_grubhub_table('operations_summary'),
+                                args.start, args.end, args.days or 14)
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Memoized filter results shared by every session.
+
+Users keep asking for the same few views: the full date range, a popular
+store, self-serve campaigns only. ``ResultCache`` keeps the frames those
+filters produce, keyed by what was computed, the version of the data it
+was computed from and the normalized filter values. It evicts the least
+recently used results once their total size exceeds a memory budget.
+
+Cached frames are shared between sessions and must be treated as
+read-only; derive a new frame instead of assigning into one.
+"""
+import datetime
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Memory budget of the shared result cache, in MB
+RESULT_CACHE_MB = float(os.environ.get('TODC_RESULT_CACHE_MB', '256'))
+
+
+def _normalize(value):
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    return value
+
+
+def filter_key(**filters):
+    """Hashable, order-independent key of a filter state
+
+    Dates, datetimes and Timestamps of the same day compare equal, and lists
+    and tuples are interchangeable.
+    """
+    return _normalize(filters)
+
+
+def _depends_on(key_version, version):
+    if key_version == version:
+        return True
+    return isinstance(key_version, tuple) and any(_depends_on(part, version) for part in key_version)
+
+
+def result_size(value):
+    """Approximate memory footprint of a cached result, in bytes"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (list, tuple)):
+        return sum(result_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(result_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Thread-safe LRU cache of computed results with a memory budget in bytes
+
+    ``sizeof`` measures a result in bytes (``result_size`` by default).
+    """
+
+    def __init__(self, max_bytes=int(RESULT_CACHE_MB * 2 ** 20), sizeof=result_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name, version, filters, compute):
+        """Return the cached ``compute()`` result for ``(name, version, filters)``
+
+        ``filters`` is a ``filter_key``. Results larger than the whole budget
+        are returned without being cached.
+        """
+        key = (name, version, filters)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # Computed outside the lock; concurrent misses on one key both compute
+        value = compute()
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.bytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, version):
+        """Drop every result computed from ``version`` of the data; returns how many
+
+        A result depends on ``version`` when it was cached under it or under a
+        tuple holding it, such as ``(engine, version)``.
+        """
+        with self._lock:
+            stale = [key for key in self._entries if _depends_on(key[1], version)]
+            for key in stale:
+                self.bytes -= self._entries.pop(key)[1]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current size, for the profiling panel and logs"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'mb': round(self.bytes / 2 ** 20, 3),
+                'budget_mb': round(self.max_bytes / 2 ** 20, 3),
+            }
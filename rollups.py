@@ -0,0 +1,126 @@
+"""Pre-aggregated cubes behind the DoorDash metrics and Top 10 charts.
+
+The row-level exports are rolled up once at load time to one row per
+combination of the cube dimensions (store, day, ...). Summable measures are
+stored as sums, and measures the dashboard averages (ROAS, Average order
+value) also keep their non-null count so the mean can be recovered exactly
+from any slice. Filter changes then only touch the much smaller cube.
+"""
+from collections import namedtuple
+
+import pandas as pd
+
+from filters import select, sort_by_date
+
+FINANCIAL_DATE = 'Timestamp local date'
+FINANCIAL_DIMENSIONS = ['Store name', FINANCIAL_DATE, 'Transaction type', 'Final order status']
+FINANCIAL_MEASURES = ['Subtotal', 'Net total']
+
+MARKETING_DATE = 'Date'
+MARKETING_DIMENSIONS = ['Store name', MARKETING_DATE, 'Is self serve campaign', 'Type of promotion']
+MARKETING_MEASURES = ['Sales', 'Orders', 'New customers acquired', 'New DP customers acquired']
+MARKETING_MEAN_MEASURES = ['ROAS', 'Average order value']
+
+# Sponsored Listing ratios (CTR, CPA, ROAS) are recomputed from these sums,
+# so every slice gets spend-weighted values
+SPONSORED_DATE = 'Date'
+SPONSORED_SPEND = 'Marketing fees | (including any applicable taxes)'
+SPONSORED_DIMENSIONS = ['Campaign name', 'Store name', SPONSORED_DATE, 'Is self serve campaign']
+SPONSORED_MEASURES = ['Impressions', 'Clicks', 'Orders', 'Sales', SPONSORED_SPEND, 'New customers acquired']
+
+GRUBHUB_TRANSACTION_DATE = 'transaction_date'
+GRUBHUB_TRANSACTION_DIMENSIONS = ['store_name', GRUBHUB_TRANSACTION_DATE, 'transaction_type']
+GRUBHUB_TRANSACTION_MEASURES = ['subtotal', 'commission', 'merchant_net_total', 'tip']
+
+# Number of source rows folded into each cube cell
+ROWS = 'Rows'
+
+CubeSpec = namedtuple('CubeSpec', ['date_column', 'dimensions', 'measures', 'mean_measures'])
+
+# dataset -> cube it is rolled up into
+CUBE_SPECS = {
+    'detailed_transactions': CubeSpec(FINANCIAL_DATE, FINANCIAL_DIMENSIONS, FINANCIAL_MEASURES, []),
+    'promotion': CubeSpec(MARKETING_DATE, MARKETING_DIMENSIONS, MARKETING_MEASURES, MARKETING_MEAN_MEASURES),
+    'sponsored_listing': CubeSpec(SPONSORED_DATE, SPONSORED_DIMENSIONS, SPONSORED_MEASURES, []),
+    'transactions': CubeSpec(GRUBHUB_TRANSACTION_DATE, GRUBHUB_TRANSACTION_DIMENSIONS,
+                             GRUBHUB_TRANSACTION_MEASURES, []),
+    'deposit_details': CubeSpec(GRUBHUB_TRANSACTION_DATE, GRUBHUB_TRANSACTION_DIMENSIONS,
+                                GRUBHUB_TRANSACTION_MEASURES, []),
+}
+
+
+def _count_column(measure):
+    return f'{measure} count'
+
+
+def build_cube(df, dimensions, measures, mean_measures=()):
+    """Roll ``df`` up to one row per distinct combination of ``dimensions``"""
+    grouped = df.groupby(dimensions, dropna=False, observed=True, sort=True)
+    cube = grouped[list(measures) + list(mean_measures)].sum()
+    for measure in mean_measures:
+        cube[_count_column(measure)] = grouped[measure].count()
+    cube[ROWS] = grouped.size()
+    return cube.reset_index()
+
+
+def combine_cubes(cubes, dimensions):
+    """Merge partial cubes built over the same dimensions into one
+
+    Every non-dimension column of a cube (sums, counts, rows) is additive.
+    """
+    combined = pd.concat(cubes, ignore_index=True)
+    values = [c for c in combined.columns if c not in dimensions]
+    grouped = combined.groupby(dimensions, dropna=False, observed=True, sort=True)
+    return grouped[values].sum().reset_index()
+
+
+def build_dataset_cube(df, dataset):
+    """Roll ``df`` up into the cube of ``dataset``, sorted by date"""
+    spec = CUBE_SPECS[dataset]
+    cube = build_cube(df, spec.dimensions, spec.measures, spec.mean_measures)
+    return sort_by_date(cube, spec.date_column)
+
+
+def build_financial_cube(financial_df):
+    return build_dataset_cube(financial_df, 'detailed_transactions')
+
+
+def build_marketing_cube(marketing_df):
+    return build_dataset_cube(marketing_df, 'promotion')
+
+
+def build_sponsored_cube(sponsored_df):
+    return build_dataset_cube(sponsored_df, 'sponsored_listing')
+
+
+def slice_cube(cube, date_column, date_range=None, equals=None):
+    """Return the cube cells inside ``date_range`` whose dimensions match ``equals``
+
+    The cube must be sorted by ``date_column``. ``equals`` maps dimension
+    columns to the required value; a value of ``None`` means "do not filter
+    on this column".
+    """
+    return select(cube, date_column, date_range, equals)
+
+
+def total(cube, measure):
+    return cube[measure].sum()
+
+
+def mean(cube, measure):
+    """Mean of ``measure`` over the source rows of the slice (NaN rows ignored)"""
+    count = cube[_count_column(measure)].sum()
+    return cube[measure].sum() / count if count > 0 else 0
+
+
+def row_count(cube):
+    return int(cube[ROWS].sum())
+
+
+def top_stores(cube, by, measures, mean_measures=(), n=10):
+    """Per-store rollup of a cube slice, top ``n`` stores by ``by``"""
+    grouped = cube.groupby('Store name', observed=True)
+    stores = grouped[list(measures) + list(mean_measures)].sum()
+    for measure in mean_measures:
+        stores[measure] = stores[measure] / grouped[_count_column(measure)].sum()
+    return stores.reset_index().sort_values(by, ascending=False).head(n)
@@ -0,0 +1,183 @@
+"""Categorical encoding of the low-cardinality text columns in the exports.
+
+Store names, campaign names, transaction types and statuses repeat on every
+row. Encoding them as pandas categoricals stores each distinct string once
+and turns equality filters, ``groupby`` and ``unique()`` into integer work.
+
+Store name columns of every DoorDash and GrubHub dataset share one
+append-only dictionary, so a store has the same category code wherever it
+appears.
+
+Each dashboard section also declares the columns it reads. Loaders project
+an export onto the union of its sections' columns and parse them with the
+explicit dtypes below, leaving the rest of a wide export on disk.
+"""
+import threading
+
+import pandas as pd
+
+import rollups
+
+# dataset -> text columns encoded as categoricals
+CATEGORY_COLUMNS = {
+    'promotion': ['Store name', 'Campaign name', 'Type of promotion'],
+    'sponsored_listing': ['Store name', 'Campaign name'],
+    'detailed_transactions': ['Store name', 'Business name', 'Transaction type', 'Final order status', 'Channel'],
+    'payout_summary': ['Store name', 'Business name', 'Channel'],
+    'error_charges': ['Store name', 'Business name', 'Transaction type', 'Channel'],
+    'financial_summary': ['store_name'],
+    'operations_summary': ['store_name'],
+    'order_details': ['store_name', 'customer_type', 'fulfillment_type', 'gh_plus_customer'],
+    'transactions': ['store_name', 'transaction_type', 'fulfillment_type', 'gh_plus_customer'],
+    'cancellations': ['store_name', 'customer_type', 'fulfillment_type', 'gh_plus_customer'],
+    'deposits': ['store_name'],
+    'deposit_details': ['store_name', 'transaction_type', 'fulfillment_type', 'gh_plus_customer'],
+    'product_mix': ['menu_item_category_name'],
+}
+
+STORE_COLUMNS = {'Store name', 'store_name'}
+
+# dataset -> explicit parse dtypes of its numeric and flag columns
+DTYPES = {
+    'promotion': {
+        'Is self serve campaign': 'bool',
+        'Store ID': 'int64',
+        'Orders': 'int64',
+        'Sales': 'float64',
+        'Average order value': 'float64',
+        'ROAS': 'float64',
+        'New customers acquired': 'int64',
+        'New DP customers acquired': 'int64',
+    },
+    'sponsored_listing': {
+        'Is self serve campaign': 'bool',
+        'Store ID': 'int64',
+        'Impressions': 'int64',
+        'Clicks': 'int64',
+        'Orders': 'int64',
+        'Sales': 'float64',
+        rollups.SPONSORED_SPEND: 'float64',
+        'New customers acquired': 'int64',
+    },
+    'detailed_transactions': {
+        'DoorDash transaction ID': 'int64',
+        'Subtotal': 'float64',
+        'Net total': 'float64',
+    },
+    'financial_summary': {
+        'total_orders': 'int64',
+        'subtotal_sales': 'float64',
+        'tip': 'float64',
+        'commission': 'float64',
+        'merchant_net_total': 'float64',
+    },
+    'operations_summary': {
+        'total_orders': 'int64',
+        'total_canceled_orders': 'int64',
+        'new_customer_orders': 'int64',
+        'gh_plus_customer_orders': 'int64',
+    },
+    'product_mix': {
+        'quantity_sold': 'int64',
+        'item_sales': 'float64',
+    },
+}
+
+CAMPAIGN_TABLE_COLUMNS = [
+    'Campaign name', 'Type of promotion', 'Date', 'Orders', 'Sales', 'ROAS',
+    'New customers acquired', 'New DP customers acquired', 'Average order value',
+]
+
+GRUBHUB_FILTER_COLUMNS = ['start_date', 'end_date', 'store_name']
+
+# dataset -> section -> columns that section reads
+SECTION_COLUMNS = {
+    'promotion': {
+        'marketing_cube': (rollups.MARKETING_DIMENSIONS + rollups.MARKETING_MEASURES
+                           + rollups.MARKETING_MEAN_MEASURES),
+        'campaign_table': CAMPAIGN_TABLE_COLUMNS + ['Store name', 'Is self serve campaign'],
+    },
+    'sponsored_listing': {
+        'sponsored_cube': rollups.SPONSORED_DIMENSIONS + rollups.SPONSORED_MEASURES,
+    },
+    'detailed_transactions': {
+        'financial_cube': rollups.FINANCIAL_DIMENSIONS + rollups.FINANCIAL_MEASURES,
+    },
+    'financial_summary': {
+        'filters': GRUBHUB_FILTER_COLUMNS,
+        'financial_performance': ['total_orders', 'subtotal_sales', 'merchant_net_total', 'commission', 'tip'],
+        'store_performance': ['total_orders', 'subtotal_sales', 'merchant_net_total', 'commission'],
+    },
+    'operations_summary': {
+        'filters': GRUBHUB_FILTER_COLUMNS,
+        'operations_performance': ['total_orders', 'total_canceled_orders', 'new_customer_orders',
+                                   'gh_plus_customer_orders'],
+    },
+    'product_mix': {
+        'product_performance': ['menu_item_name', 'quantity_sold', 'item_sales'],
+    },
+}
+
+
+def projected_columns(dataset, extra=()):
+    """Union of the columns the sections read from ``dataset``
+
+    ``extra`` adds columns the loader itself needs (e.g. de-duplication keys).
+    Returns ``None`` (read every column) for datasets no section declares.
+    """
+    sections = SECTION_COLUMNS.get(dataset)
+    if not sections:
+        return None
+    columns = []
+    for section_columns in list(sections.values()) + [list(extra)]:
+        for column in section_columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+class CategoryDictionary:
+    """Append-only list of categories shared by several columns.
+
+    New values are appended and existing codes never change, so columns
+    encoded at different times agree on the code of every value they share.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def encode(self, series):
+        """Return ``series`` as a categorical over the shared categories"""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.categories
+        else:
+            values = series.dropna().unique()
+        with self._lock:
+            for value in values:
+                if value not in self._known:
+                    self._known.add(value)
+                    self.categories.append(value)
+            dtype = pd.CategoricalDtype(list(self.categories))
+        return series.astype(dtype)
+
+
+STORE_NAMES = CategoryDictionary()
+
+
+def apply_schema(df, dataset):
+    """Return ``df`` with the categorical columns of ``dataset`` encoded
+
+    The input frame is left untouched.
+    """
+    columns = [c for c in CATEGORY_COLUMNS.get(dataset, []) if c in df.columns]
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for column in columns:
+        if column in STORE_COLUMNS:
+            df[column] = STORE_NAMES.encode(df[column])
+        else:
+            df[column] = df[column].astype('category')
+    return df
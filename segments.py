@@ -0,0 +1,95 @@
+"""Customer segment filters over the GrubHub order-level tables.
+
+The period summaries behind the GrubHub KPIs (``financial_summary``,
+``operations_summary``) carry no customer attributes. The order-level tables
+do: ``order_details`` and ``cancellations`` record each order's customer type
+and GH+ status, and ``transactions`` its GH+ status. A transaction's customer
+type is looked up from its order. When the sidebar selects a segment, the
+KPIs are recomputed from that segment's orders.
+
+Each order table is indexed once per version: ``SegmentIndex`` keeps a
+boolean mask for every value of the segment columns. A filter state is a
+date slice of the date-sorted frame ANDed with at most two precomputed
+masks and one store comparison on categorical codes. No string is compared
+per rerun.
+"""
+import numpy as np
+import pandas as pd
+
+from filters import combine_masks, date_bounds, equals_mask, take
+from platforms import GRUBHUB_SORT_COLUMNS
+
+SEGMENT_COLUMNS = ['customer_type', 'gh_plus_customer']
+
+# Order-level tables a segment filter applies to
+ORDER_TABLES = ['order_details', 'transactions', 'cancellations']
+
+CUSTOMER_TYPES = ['New', 'Returning', 'Loyal']
+
+# Sidebar option -> value in the exports
+GH_PLUS_VALUES = {'GH+': 'GH+', 'Non-GH+': 'non GH+'}
+
+
+def segment_equals(customer_type='All', gh_plus='All'):
+    """``{column: value}`` of a sidebar segment, ``None`` where it is not filtered"""
+    return {
+        'customer_type': customer_type if customer_type != 'All' else None,
+        'gh_plus_customer': GH_PLUS_VALUES.get(gh_plus),
+    }
+
+
+def with_customer_type(transactions, *orders):
+    """``transactions`` with the ``customer_type`` of their order, taken from ``orders`` tables"""
+    types = pd.concat([frame[['order_number', 'customer_type']].astype({'customer_type': object})
+                       for frame in orders], ignore_index=True).drop_duplicates('order_number', keep='last')
+    customer_type = transactions['order_number'].map(types.set_index('order_number')['customer_type'])
+    return transactions.assign(customer_type=customer_type.astype('category'))
+
+
+class SegmentIndex:
+    """Precomputed per-value masks of the segment columns of one date-sorted order table"""
+
+    def __init__(self, frame, date_column, columns=SEGMENT_COLUMNS):
+        self.frame = frame
+        self.date_column = date_column
+        self.columns = [column for column in columns if column in frame.columns]
+        self._masks = {}
+        for column in self.columns:
+            values = frame[column].astype('category')
+            codes = values.cat.codes.to_numpy()
+            for code, value in enumerate(values.cat.categories):
+                self._masks[(column, value)] = codes == code
+
+    @property
+    def rows(self):
+        return len(self.frame)
+
+    def mask(self, equals, start=0, stop=None):
+        """AND of the masks of ``equals`` over rows ``start:stop``; ``None`` when nothing is filtered
+
+        A value absent from the table, or a column the table lacks, matches no row.
+        """
+        stop = self.rows if stop is None else stop
+        masks = []
+        for column, value in equals.items():
+            if value is None:
+                continue
+            mask = self._masks.get((column, value))
+            masks.append(mask[start:stop] if mask is not None else np.zeros(stop - start, dtype=bool))
+        return combine_masks(*masks)
+
+    def select(self, date_range=None, store=None, segment=None):
+        """Rows inside ``date_range`` of ``store`` (``None``: all stores) in ``segment``"""
+        start, stop = date_bounds(self.frame, self.date_column, date_range)
+        window = self.frame.iloc[start:stop]
+        return take(window, combine_masks(self.mask(segment or {}, start, stop),
+                                          equals_mask(window, {'store_name': store})))
+
+
+def build_index(key, frame, order_details=None, cancellations=None):
+    """``SegmentIndex`` of one order table; ``transactions`` need the order tables for their customer type"""
+    if key == 'transactions' and 'customer_type' not in frame.columns:
+        orders = [table for table in (order_details, cancellations) if table is not None and not table.empty]
+        if orders:
+            frame = with_customer_type(frame, *orders)
+    return SegmentIndex(frame, GRUBHUB_SORT_COLUMNS[key])
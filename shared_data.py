@@ -0,0 +1,158 @@
+"""Zero-copy store of the prepared datasets, shared by sessions and processes.
+
+``st.cache_data`` pickles every frame it returns and unpickles a private
+copy for each caller, and every app process behind a load balancer parses
+and holds its own copy of every export. Here each prepared frame (sorted,
+categorical-encoded, cube or table) is written once per data version as an
+uncompressed Arrow IPC file under ``SHARED_DIR``, named by the data version
+and by how the frame is built: its projected columns, dtypes, category
+columns and, for cubes, the cube spec. Every session and process
+then memory-maps that file and wraps its buffers without copying or
+deserializing. The pages live in the OS page cache once, however many
+sessions and workers read them.
+
+Attached frames are read-only: their numeric and date columns are views of
+the mapped file, and text columns stay Arrow-backed (``string[pyarrow]``).
+Only the small category codes are decoded per process, so store names keep
+their codes from the shared store dictionary (see schema.py). Float NaNs are
+written as values rather than nulls, so those columns map without a copy
+too.
+
+Set ``TODC_SHARED_DIR`` to an empty string, or run without pyarrow, to keep
+every frame in process memory instead.
+"""
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+import rollups
+from data_cache import CACHE_DIR
+from schema import CATEGORY_COLUMNS, DTYPES, STORE_COLUMNS, STORE_NAMES, projected_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+SHARED_DIR = os.environ.get('TODC_SHARED_DIR', os.path.join(CACHE_DIR, 'shared'))
+
+# Bump when the file layout changes so existing shared files are not attached
+SHARED_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return HAS_PYARROW and bool(SHARED_DIR)
+
+
+def _shared_key(dataset, version):
+    # A frame depends on its files (``version``) and on how it is built from
+    # them, so a change to the projection, dtypes or cube spec is a new file
+    kind = dataset[:-len(' cube')] if dataset.endswith(' cube') else dataset
+    return (
+        SHARED_FORMAT,
+        dataset,
+        version,
+        projected_columns(kind),
+        sorted((DTYPES.get(kind) or {}).items()),
+        CATEGORY_COLUMNS.get(kind),
+        tuple(rollups.CUBE_SPECS[kind]) if dataset.endswith(' cube') else None,
+    )
+
+
+def shared_path(dataset, version):
+    """File holding one version of one dataset; the same in every process"""
+    digest = hashlib.sha1(repr(_shared_key(dataset, version)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SHARED_DIR, f"{dataset.replace(' ', '_')}-{digest}.arrow")
+
+
+def _column(series):
+    if series.dtype.kind == 'f':
+        # NaN as a value, not a null, so the column maps back without a copy
+        return pa.array(series.to_numpy(), from_pandas=False)
+    return pa.Array.from_pandas(series)
+
+
+def _to_arrow(frame):
+    return pa.Table.from_arrays([_column(frame[column]) for column in frame.columns],
+                                names=[str(column) for column in frame.columns])
+
+
+def publish(dataset, version, frame):
+    """Write ``frame`` as the shared copy of ``dataset`` at ``version``; returns its path"""
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    path = shared_path(dataset, version)
+    table = _to_arrow(frame.reset_index(drop=True))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    # Atomic, so a concurrent attach sees the whole file or none
+    os.replace(tmp_path, path)
+    return path
+
+
+def _string_dtype(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype('pyarrow')
+    return None
+
+
+def attach(dataset, version):
+    """Memory-mapped frame of ``dataset`` at ``version``; ``None`` if it was never published"""
+    path = shared_path(dataset, version)
+    try:
+        source = pa.memory_map(path, 'r')
+    except FileNotFoundError:
+        return None
+    table = pa.ipc.open_file(source).read_all()
+    frame = table.to_pandas(split_blocks=True, types_mapper=_string_dtype)
+    for column in frame.columns:
+        if column in STORE_COLUMNS and isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = STORE_NAMES.encode(frame[column])
+    return frame
+
+
+def shared_frames(versions, load):
+    """Shared frames of several datasets; ``load(missing)`` builds those not yet published
+
+    ``versions`` maps each dataset to its version and ``load`` returns a
+    dict of frames for a list of datasets. Each missing frame is published
+    and attached in place of the one ``load`` built, so this process holds
+    no private copy.
+    """
+    if not enabled():
+        return load(list(versions))
+    frames = {dataset: attach(dataset, version) for dataset, version in versions.items()}
+    missing = [dataset for dataset, frame in frames.items() if frame is None]
+    if missing:
+        for dataset, frame in load(missing).items():
+            if frame is None or frame.empty:
+                frames[dataset] = frame
+                continue
+            publish(dataset, versions[dataset], frame)
+            frames[dataset] = attach(dataset, versions[dataset])
+    return frames
+
+
+def shared_frame(dataset, version, load):
+    """Shared frame of one dataset; ``load()`` builds it when not yet published"""
+    return shared_frames({dataset: version}, lambda missing: {dataset: load()})[dataset]
+
+
+def evict(dataset, version):
+    """Delete the shared file of an old version; processes still mapping it keep their view"""
+    if not enabled():
+        return
+    try:
+        os.remove(shared_path(dataset, version))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # Windows refuses to delete a mapped file; a later data drop retries
+        logger.warning('Could not remove the shared copy of %s', dataset)
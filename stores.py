@@ -0,0 +1,314 @@
+"""Unified store dimension across DoorDash and GrubHub.
+
+DoorDash identifies a store by ``Store ID`` and a name that often carries
+its location in parentheses ("The Gourmet Burger (1st Ave)"). GrubHub uses
+``grubhub_store_id``, a name and a street address. Many brands run several
+locations under one name, so a name alone does not identify a store.
+
+``build_index`` matches the two store lists once, offline. Names are
+normalized and compared with ``difflib``. When a DoorDash name carries a
+location, it must also agree with the GrubHub address. Stores are only
+scored against candidates sharing a name token, and every store is matched
+at most once, best score first. A DoorDash store whose best GrubHub
+candidates tie, e.g. a chain without a location in its name, is left
+unmatched rather than guessed.
+
+The index is saved under ``CACHE_DIR`` together with the signature of the
+exports it was built from, and rebuilt when they change. A ``StoreIndex``
+maps either platform's store ID to a unified ``store_key`` with one dict
+lookup, so per-store rollups of both platforms join in constant time per
+store.
+
+    python stores.py build
+    python stores.py compare --output stores.csv
+"""
+import argparse
+import difflib
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+
+import pandas as pd
+
+import metrics
+from data_cache import CACHE_DIR, read_export
+from exports import ExportHistory, export_signature
+from filters import select
+from platforms import GRUBHUB_DATE_COLUMNS, GRUBHUB_FILES, available_grubhub_files, grubhub_signature
+from schema import DTYPES
+
+# Bump when the matching rules change so saved indexes are rebuilt
+INDEX_VERSION = 1
+
+INDEX_PATH = os.path.join(CACHE_DIR, 'store_index.parquet')
+
+# Least name similarity (difflib ratio) of a match
+NAME_THRESHOLD = 0.95
+# Weight of the location agreement when the DoorDash name carries a location
+LOCATION_WEIGHT = 0.4
+# Least share of the location words of a DoorDash name found in the GrubHub address
+LOCATION_THRESHOLD = 0.5
+
+DOORDASH_STORE_KINDS = ['detailed_transactions', 'promotion']
+GRUBHUB_STORE_TABLES = ['financial_summary', 'operations_summary', 'order_details', 'cancellations', 'deposits']
+GRUBHUB_STORE_COLUMNS = ['grubhub_store_id', 'store_name', 'street_address', 'city', 'state', 'store_number']
+
+# Tokens too common in store names to find candidates by
+STOPWORDS = {'the', 'and', 'of', 'co', 'company', 'shop', 'bar'}
+
+# Address spellings normalized before comparing locations
+ABBREVIATIONS = {
+    'avenue': 'ave', 'street': 'st', 'boulevard': 'blvd', 'road': 'rd', 'place': 'pl', 'drive': 'dr',
+    'lane': 'ln', 'square': 'sq', 'east': 'e', 'west': 'w', 'north': 'n', 'south': 's',
+}
+
+# Words in parentheses that say nothing about which street a store is on,
+# including labels such as "(Virtual Brand)"
+GENERIC_ADDRESS_WORDS = set(ABBREVIATIONS.values()) | {'unit', 'suite', 'ste', 'apt', 'fl', 'floor', 'virtual', 'brand'}
+
+_LOCATION = re.compile(r'\(([^)]*)\)')
+_PUNCTUATION = re.compile(r'[^a-z0-9]+')
+
+
+def tokens(text):
+    """Lowercase words of ``text`` with apostrophes dropped and address words abbreviated"""
+    if not isinstance(text, str):
+        return []
+    text = text.lower().replace('&', ' and ').replace("'", '').replace('’', '')
+    return [ABBREVIATIONS.get(word, word) for word in _PUNCTUATION.sub(' ', text).split()]
+
+
+def split_name(name):
+    """``(base name, location)`` of a store name such as ``"Taco Bar (1st Ave)"``"""
+    locations = _LOCATION.findall(name)
+    return ' '.join(tokens(_LOCATION.sub(' ', name))), set(tokens(' '.join(locations))) - GENERIC_ADDRESS_WORDS
+
+
+def doordash_stores(root='.'):
+    """One row per DoorDash ``Store ID`` with its most recent name"""
+    frames = [ExportHistory(kind, root=root, columns=['Store ID', 'Store name']).refresh()[['Store ID', 'Store name']]
+              for kind in DOORDASH_STORE_KINDS]
+    stores = pd.concat(frames, ignore_index=True).dropna()
+    return stores.drop_duplicates('Store ID', keep='last').reset_index(drop=True)
+
+
+def grubhub_stores():
+    """One row per ``grubhub_store_id`` with its name and address"""
+    frames = []
+    for key in GRUBHUB_STORE_TABLES:
+        if key in available_grubhub_files():
+            frames.append(read_export(GRUBHUB_FILES[key], GRUBHUB_DATE_COLUMNS, 'coerce',
+                                      columns=GRUBHUB_STORE_COLUMNS, dtypes=DTYPES.get(key)))
+    if not frames:
+        return pd.DataFrame(columns=GRUBHUB_STORE_COLUMNS)
+    stores = pd.concat(frames, ignore_index=True).dropna(subset=['grubhub_store_id', 'store_name'])
+    return stores.drop_duplicates('grubhub_store_id', keep='last').reset_index(drop=True)
+
+
+def _score(doordash, grubhub):
+    """Match score of two split stores, or ``None`` when they cannot be the same store"""
+    name = difflib.SequenceMatcher(None, doordash['base'], grubhub['base']).ratio()
+    if name < NAME_THRESHOLD:
+        return None
+    if not doordash['location']:
+        return name
+    common = doordash['location'] & grubhub['location']
+    agreement = len(common) / len(doordash['location'])
+    # A street number in the DoorDash name must be the GrubHub one
+    numbers = {word for word in doordash['location'] if word.isdigit()}
+    if agreement < LOCATION_THRESHOLD or not numbers <= common:
+        return None
+    return (1 - LOCATION_WEIGHT) * name + LOCATION_WEIGHT * agreement
+
+
+def match_stores(doordash, grubhub):
+    """``{Store ID: (grubhub_store_id, score)}`` of the stores found on both platforms"""
+    candidates = defaultdict(list)
+    gh_stores = {}
+    for row in grubhub.itertuples(index=False):
+        base, location = split_name(row.store_name)
+        location |= set(tokens(f'{row.street_address} {row.city} {row.state} {row.store_number}'))
+        gh_stores[row.grubhub_store_id] = {'base': base, 'location': location}
+        for token in set(base.split()) - STOPWORDS:
+            candidates[token].append(row.grubhub_store_id)
+
+    pairs = []
+    for row in doordash.itertuples(index=False):
+        base, location = split_name(row[1])
+        dd_store = {'base': base, 'location': location}
+        blocked = {gh_id for token in set(base.split()) - STOPWORDS for gh_id in candidates.get(token, ())}
+        scored = sorted(((s, gh_id) for gh_id in blocked
+                         if (s := _score(dd_store, gh_stores[gh_id])) is not None), reverse=True)
+        # Several equally good locations: nothing tells them apart
+        if len(scored) > 1 and scored[0][0] - scored[1][0] < 1e-9:
+            continue
+        pairs.extend((score, row[0], gh_id) for score, gh_id in scored)
+
+    matches, taken = {}, set()
+    for score, dd_id, gh_id in sorted(pairs, key=lambda p: p[0], reverse=True):
+        if dd_id not in matches and gh_id not in taken:
+            matches[dd_id] = (gh_id, score)
+            taken.add(gh_id)
+    return matches
+
+
+def build_dimension(doordash, grubhub):
+    """Unified store table: one row per matched pair and per store found on one platform only"""
+    matches = match_stores(doordash, grubhub)
+    gh = grubhub.set_index('grubhub_store_id')
+    rows = []
+    for dd_id, dd_name in doordash.itertuples(index=False):
+        gh_id, score = matches.get(dd_id, (None, None))
+        rows.append({'doordash_store_id': dd_id, 'doordash_store_name': dd_name, 'grubhub_store_id': gh_id,
+                     'grubhub_store_name': gh.at[gh_id, 'store_name'] if gh_id is not None else None,
+                     'street_address': gh.at[gh_id, 'street_address'] if gh_id is not None else None,
+                     'match_score': score})
+    matched = {gh_id for gh_id, _ in matches.values()}
+    for gh_id, store in gh.iterrows():
+        if gh_id not in matched:
+            rows.append({'doordash_store_id': None, 'doordash_store_name': None, 'grubhub_store_id': gh_id,
+                         'grubhub_store_name': store['store_name'], 'street_address': store['street_address'],
+                         'match_score': None})
+    stores = pd.DataFrame(rows)
+    stores.insert(0, 'store_key', range(len(stores)))
+    stores['store_name'] = stores['doordash_store_name'].fillna(stores['grubhub_store_name'])
+    for column in ('doordash_store_id', 'grubhub_store_id'):
+        stores[column] = stores[column].astype('Int64')
+    return stores
+
+
+def sources_signature(root='.'):
+    """Exports the index is built from, as stored next to it"""
+    signature = (export_signature(*DOORDASH_STORE_KINDS, root=root), grubhub_signature())
+    return json.loads(json.dumps(signature))
+
+
+def _manifest_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def build_index(root='.', path=INDEX_PATH):
+    """Match the stores of both platforms and save the unified dimension at ``path``"""
+    stores = build_dimension(doordash_stores(root), grubhub_stores())
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    stores.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    with open(_manifest_path(path), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'sources': sources_signature(root)}, f)
+    return StoreIndex(stores)
+
+
+def load_index(root='.', path=INDEX_PATH):
+    """The saved store index, rebuilt first if the exports changed since it was built"""
+    try:
+        with open(_manifest_path(path)) as f:
+            manifest = json.load(f)
+        current = manifest['version'] == INDEX_VERSION and manifest['sources'] == sources_signature(root)
+    except (OSError, ValueError, KeyError):
+        current = False
+    if not current or not os.path.exists(path):
+        return build_index(root, path)
+    return StoreIndex(pd.read_parquet(path))
+
+
+def _keyed(totals, keys):
+    # Nullable integers, so counts of stores missing on one platform stay integers after the join
+    counts = {c: 'Int64' for c in totals.columns if pd.api.types.is_integer_dtype(totals[c])}
+    return totals.astype(counts).set_axis(totals.index.map(keys))
+
+
+class StoreIndex:
+    """Unified store dimension with constant-time lookups from either platform's store ID"""
+
+    def __init__(self, stores):
+        self.stores = stores
+        self._doordash = self._lookup('doordash_store_id')
+        self._grubhub = self._lookup('grubhub_store_id')
+
+    def _lookup(self, column):
+        ids = self.stores[column]
+        present = ids.notna()
+        return dict(zip(ids[present].astype('int64'), self.stores['store_key'][present]))
+
+    def doordash_key(self, store_id):
+        return self._doordash.get(store_id)
+
+    def grubhub_key(self, store_id):
+        return self._grubhub.get(store_id)
+
+    def matched(self):
+        return self.stores[self.stores['doordash_store_id'].notna() & self.stores['grubhub_store_id'].notna()]
+
+    def combine(self, doordash_totals, grubhub_totals):
+        """Join per-store DoorDash and GrubHub totals (indexed by store ID) on ``store_key``
+
+        Columns are prefixed with the platform. Stores unknown to the index
+        are dropped; rebuild the index to pick them up.
+        """
+        doordash_totals = _keyed(doordash_totals, self._doordash).add_prefix('doordash_')
+        grubhub_totals = _keyed(grubhub_totals, self._grubhub).add_prefix('grubhub_')
+        combined = (self.stores.set_index('store_key')[['store_name', 'street_address']]
+                    .join(doordash_totals[doordash_totals.index.notna()], how='left')
+                    .join(grubhub_totals[grubhub_totals.index.notna()], how='left'))
+        totals = [c for c in combined.columns if c.startswith(('doordash_', 'grubhub_'))]
+        return combined[combined[totals].notna().any(axis=1)]
+
+
+# Per-store totals by store ID, the inputs of StoreIndex.combine
+
+STORE_TOTALS = ['orders', 'sales', 'net_total']
+
+
+def doordash_store_totals(transactions):
+    """Delivered orders, subtotal and net total per DoorDash ``Store ID``"""
+    delivered = select(transactions, 'Timestamp local date', equals=metrics.DELIVERED_ORDERS)
+    grouped = delivered.groupby('Store ID')
+    return pd.DataFrame({'orders': grouped.size(), 'sales': grouped['Subtotal'].sum(),
+                         'net_total': grouped['Net total'].sum()})
+
+
+def grubhub_store_totals(financial_summary):
+    """Orders, subtotal sales and net total per ``grubhub_store_id``"""
+    grouped = financial_summary.groupby('grubhub_store_id')
+    return pd.DataFrame({'orders': grouped['total_orders'].sum(), 'sales': grouped['subtotal_sales'].sum(),
+                         'net_total': grouped['merchant_net_total'].sum()})
+
+
+def compare_platforms(index, root='.'):
+    """Both platforms' totals side by side for every store"""
+    transactions = ExportHistory('detailed_transactions', root=root, columns=[
+        'Store ID', 'Timestamp local date', 'Transaction type', 'Final order status', 'Subtotal', 'Net total',
+    ]).refresh()
+    if 'financial_summary' in available_grubhub_files():
+        financial_summary = read_export(GRUBHUB_FILES['financial_summary'], GRUBHUB_DATE_COLUMNS, 'coerce',
+                                        columns=['grubhub_store_id', 'total_orders', 'subtotal_sales',
+                                                 'merchant_net_total'],
+                                        dtypes=DTYPES.get('financial_summary'))
+    else:
+        financial_summary = pd.DataFrame(columns=['grubhub_store_id', 'total_orders', 'subtotal_sales',
+                                                  'merchant_net_total'])
+    return index.combine(doordash_store_totals(transactions), grubhub_store_totals(financial_summary))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the cross-platform store index or compare stores')
+    parser.add_argument('command', choices=['build', 'compare'])
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--output', help='CSV file for the comparison (default: stdout)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        index = build_index(args.root)
+        stores = index.stores
+        print(f"{len(index.matched()):,} stores on both platforms, "
+              f"{int(stores['grubhub_store_id'].isna().sum()):,} DoorDash only, "
+              f"{int(stores['doordash_store_id'].isna().sum()):,} GrubHub only; saved to {INDEX_PATH}")
+    else:
+        comparison = compare_platforms(load_index(args.root), args.root)
+        comparison.to_csv(args.output or sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
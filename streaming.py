@@ -0,0 +1,175 @@
+"""Bounded-memory cube building for exports larger than RAM.
+
+Instead of materializing a whole export, the CSV is read ``chunk_rows`` rows
+at a time and each chunk is rolled up into a partial cube that is folded
+into the running total (see ``rollups.combine_cubes``). Peak memory is one
+chunk plus the cube, whatever the size of the file.
+
+DoorDash rows repeated across overlapping export windows are skipped by
+reading windows newest first and remembering a 64-bit hash of the
+de-duplication key of every row already folded in (8 bytes per row of the
+newer windows). The hashes are kept sorted, so a chunk is checked by binary
+search; they are merged and sorted again once per window, not per chunk.
+Rows within one window are assumed unique, as they are in the exports.
+
+    python streaming.py detailed_transactions --verify
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import rollups
+from data_cache import DATE_FORMAT
+from filters import sort_by_date
+from exports import DATE_COLUMNS, DEDUP_KEYS, ExportHistory, discover_exports
+from platforms import GRUBHUB_DATE_COLUMNS, GRUBHUB_FILES, prepare_doordash_export, read_grubhub_table
+from schema import DTYPES, apply_schema
+
+CHUNK_ROWS = int(os.environ.get('TODC_CHUNK_ROWS', '250000'))
+
+# Largest measure difference compare_cubes accepts. Chunked sums only differ
+# from one-pass sums by floating-point summation order, far below a cent.
+TOLERANCE = 1e-6
+
+
+def _cube_columns(dataset, extra=()):
+    spec = rollups.CUBE_SPECS[dataset]
+    return list(dict.fromkeys(spec.dimensions + spec.measures + spec.mean_measures + list(extra)))
+
+
+def iter_chunks(path, dataset, columns, date_columns, date_errors='raise', chunk_rows=CHUNK_ROWS):
+    """Yield ``path`` as frames of at most ``chunk_rows`` rows, parsed like the Parquet ingest"""
+    reader = pd.read_csv(path, usecols=columns, dtype=DTYPES.get(dataset), chunksize=chunk_rows)
+    with reader:
+        for chunk in reader:
+            for col in date_columns:
+                if col in chunk.columns:
+                    chunk[col] = pd.to_datetime(chunk[col], format=DATE_FORMAT, errors=date_errors)
+            yield chunk
+
+
+def _fold(cube, chunk, spec):
+    partial = rollups.build_cube(chunk, spec.dimensions, spec.measures, spec.mean_measures)
+    return partial if cube is None else rollups.combine_cubes([cube, partial], spec.dimensions)
+
+
+def _finish(cube, dataset):
+    spec = rollups.CUBE_SPECS[dataset]
+    if cube is None:
+        columns = _cube_columns(dataset) + [f'{m} count' for m in spec.mean_measures] + [rollups.ROWS]
+        cube = pd.DataFrame(columns=columns)
+    return sort_by_date(apply_schema(cube, dataset), spec.date_column)
+
+
+def _isin_sorted(values, sorted_values):
+    """``np.isin(values, sorted_values)`` by binary search into an already sorted array"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+def stream_export_cube(kind, root='.', chunk_rows=CHUNK_ROWS):
+    """Cube of a DoorDash export kind over every window under ``root``, chunk by chunk"""
+    spec = rollups.CUBE_SPECS[kind]
+    keys = DEDUP_KEYS[kind]
+    columns = _cube_columns(kind, keys)
+    exports = discover_exports(kind, root)[::-1]
+
+    cube = None
+    seen = np.empty(0, dtype='uint64')
+    for position, export in enumerate(exports):
+        # Nothing older than the oldest window needs checking against it
+        track = position < len(exports) - 1
+        window = []
+        for chunk in iter_chunks(export.path, kind, columns, DATE_COLUMNS[kind], chunk_rows=chunk_rows):
+            if len(exports) > 1:
+                hashes = pd.util.hash_pandas_object(chunk[keys], index=False).to_numpy()
+                chunk = chunk[~_isin_sorted(hashes, seen)]
+                if track:
+                    window.append(hashes)
+            cube = _fold(cube, chunk, spec)
+        if window:
+            seen = np.sort(np.concatenate([seen] + window), kind='stable')
+    return _finish(cube, kind)
+
+
+def stream_grubhub_cube(key, chunk_rows=CHUNK_ROWS):
+    """Cube of one GrubHub table (``transactions`` or ``deposit_details``), chunk by chunk"""
+    spec = rollups.CUBE_SPECS[key]
+    cube = None
+    for chunk in iter_chunks(GRUBHUB_FILES[key], key, _cube_columns(key), GRUBHUB_DATE_COLUMNS,
+                             date_errors='coerce', chunk_rows=chunk_rows):
+        cube = _fold(cube, chunk, spec)
+    return _finish(cube, key)
+
+
+def stream_cube(dataset, root='.', chunk_rows=CHUNK_ROWS):
+    if dataset in GRUBHUB_FILES:
+        return stream_grubhub_cube(dataset, chunk_rows)
+    return stream_export_cube(dataset, root, chunk_rows)
+
+
+def in_memory_cube(dataset, root='.'):
+    """The same cube built the regular way, from the fully loaded export"""
+    if dataset in GRUBHUB_FILES:
+        df = read_grubhub_table(dataset)
+    else:
+        history = ExportHistory(dataset, root=root, columns=_cube_columns(dataset))
+        df = prepare_doordash_export(dataset, history.refresh())
+    return rollups.build_dataset_cube(df, dataset)
+
+
+def compare_cubes(streamed, in_memory, dataset):
+    """Check a streamed cube against the in-memory one
+
+    Cells, row counts and non-null counts must be identical and every sum
+    must agree within ``TOLERANCE``. Returns the largest sum difference.
+    """
+    dimensions = rollups.CUBE_SPECS[dataset].dimensions
+
+    def normalized(cube):
+        cube = cube.copy()
+        for column in dimensions:
+            cube[column] = cube[column].astype(object).where(cube[column].notna(), None)
+        return cube.sort_values(dimensions, key=lambda s: s.astype(str), ignore_index=True)
+
+    streamed, in_memory = normalized(streamed), normalized(in_memory)
+    if len(streamed) != len(in_memory) or not streamed[dimensions].equals(in_memory[dimensions]):
+        raise AssertionError(f"{dataset}: streamed and in-memory cubes have different cells")
+    difference = 0.0
+    for column in streamed.columns.difference(dimensions):
+        if column == rollups.ROWS or column.endswith(' count'):
+            if not np.array_equal(streamed[column].to_numpy(), in_memory[column].to_numpy()):
+                raise AssertionError(f"{dataset}: {column} differs")
+        else:
+            gap = np.abs(streamed[column].to_numpy(float) - in_memory[column].to_numpy(float)).max(initial=0)
+            if gap > TOLERANCE:
+                raise AssertionError(f"{dataset}: {column} differs by up to {gap}")
+            difference = max(difference, float(gap))
+    return difference
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build an export cube in bounded-memory chunks')
+    parser.add_argument('dataset', choices=sorted(rollups.CUBE_SPECS))
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--verify', action='store_true',
+                        help='compare against the in-memory cube and exit non-zero on mismatch')
+    parser.add_argument('--output', help='write the cube to this CSV file')
+    args = parser.parse_args(argv)
+
+    cube = stream_cube(args.dataset, args.root, args.chunk_rows)
+    print(f"{args.dataset}: {len(cube):,} cells from {int(cube[rollups.ROWS].sum()):,} rows")
+    if args.output:
+        cube.to_csv(args.output, index=False)
+    if args.verify:
+        difference = compare_cubes(cube, in_memory_cube(args.dataset, args.root), args.dataset)
+        print(f"matches in-memory cube (largest measure difference {difference:.2e})")
+
+
+if __name__ == '__main__':
+    main()
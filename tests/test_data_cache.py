@@ -0,0 +1,36 @@
+import glob
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import data_cache
+from exports import DATE_COLUMNS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.skipif(not data_cache.HAS_PYARROW, reason='the Parquet cache needs pyarrow')
+def test_read_exports_workers_write_to_the_cache_dir_set_at_runtime(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(cache_dir))
+    # Workers inherit this working directory: the module default would land here
+    monkeypatch.chdir(tmp_path)
+
+    jobs = {}
+    for kind, pattern in [('promotion', 'marketing_*/MARKETING_PROMOTION_*.csv'),
+                          ('detailed_transactions', 'financial_*/FINANCIAL_DETAILED_TRANSACTIONS_*.csv')]:
+        path = str(tmp_path / f'{kind}.csv')
+        shutil.copy(glob.glob(os.path.join(ROOT, pattern))[0], path)
+        jobs[kind] = {'path': path, 'date_columns': DATE_COLUMNS[kind]}
+
+    frames, timings = data_cache.read_exports(jobs, max_workers=2)
+
+    assert len(glob.glob(str(cache_dir / '*.parquet'))) == len(jobs)
+    assert not os.path.exists(tmp_path / '.todc_cache')
+    for kind, job in jobs.items():
+        assert data_cache.is_cached(job['path'], job['date_columns'])
+        pd.testing.assert_frame_equal(frames[kind], data_cache.read_export(**job))
+        assert len(frames[kind]) == len(data_cache.parse_csv(job['path'], job['date_columns']))
+        assert timings[kind] > 0
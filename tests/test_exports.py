@@ -0,0 +1,50 @@
+import csv
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+import data_cache
+import shared_data
+from exports import EXPORT_KINDS, ExportHistory
+from platforms import prepare_doordash_export
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KIND = 'promotion'
+
+
+def _write_window(root, start, end, exported_at, header, rows):
+    dir_prefix, file_prefix = EXPORT_KINDS[KIND]
+    directory = os.path.join(root, f'{dir_prefix}_{start}_{end}_test_{exported_at}')
+    os.makedirs(directory)
+    path = os.path.join(directory, f'{file_prefix}_{start}_{end}_test_{exported_at}.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.mark.skipif(not shared_data.HAS_PYARROW, reason='the shared store needs pyarrow')
+def test_history_appends_to_the_adopted_shared_frame(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(shared_data, 'SHARED_DIR', str(tmp_path / 'shared'))
+    with open(glob.glob(os.path.join(ROOT, 'marketing_*/MARKETING_PROMOTION_*.csv'))[0], newline='') as f:
+        header, *rows = list(csv.reader(f))
+    root = str(tmp_path / 'exports')
+    _write_window(root, '2025-09-22', '2025-09-28', '2025-09-29T00-00-00Z', header, rows[:600])
+
+    history = ExportHistory(KIND, root=root)
+    shared = shared_data.shared_frame(KIND, 1, lambda: prepare_doordash_export(KIND, history.refresh()))
+    history.adopt(shared)
+    assert history.frame is shared
+
+    # The newer window repeats rows 300-599: only it is read, and its copies win
+    newer = _write_window(root, '2025-09-25', '2025-10-05', '2025-10-06T00-00-00Z', header, rows[300:900])
+    appended = shared_data.shared_frame(KIND, 2, lambda: prepare_doordash_export(KIND, history.refresh()))
+    assert list(history.timings) == [newer]
+
+    rebuilt = shared_data.shared_frame(
+        KIND, 3, lambda: prepare_doordash_export(KIND, ExportHistory(KIND, root=root).refresh()))
+    pd.testing.assert_frame_equal(appended, rebuilt)
@@ -0,0 +1,61 @@
+import datetime
+import os
+
+import pandas as pd
+import pytest
+
+import data_cache
+import metrics
+import query_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(query_engine, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+
+@pytest.fixture(params=['sqlite', 'duckdb'])
+def engine_name(request):
+    if request.param == 'duckdb':
+        pytest.importorskip('duckdb')
+    return request.param
+
+
+def test_engine_matches_pandas(engine_name, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    engine = query_engine.connect(engine_name, ROOT)
+    assert query_engine.verify_doordash(engine, ROOT) > 0
+    query_engine.verify_grubhub(engine)
+
+
+@pytest.mark.parametrize('dataset, columns', [
+    ('promotion', metrics.DOORDASH_MARKETING_COLUMNS),
+    ('detailed_transactions', metrics.DOORDASH_FINANCIAL_COLUMNS),
+])
+def test_dataset_without_exports_has_zero_totals(engine_name, tmp_path, dataset, columns):
+    engine = query_engine.connect(engine_name, str(tmp_path))
+    empty = pd.DataFrame({column: pd.Series(dtype='float64') for column in columns})
+    date_range = (datetime.date(2025, 9, 22), datetime.date(2025, 9, 28))
+
+    for state in [(None, None), (date_range, {'Store name': 'Store A'})]:
+        query_engine.compare_kpis(engine.totals(dataset, columns, *state), metrics.totals(empty, columns), dataset)
+    assert engine.top_stores(dataset, columns[0], columns[:1], date_range=date_range).empty
+
+    # Exports that appear later are registered on the next use
+    engine.forget(dataset)
+    assert engine.totals(dataset, columns[:1]) == {columns[0]: 0}
+
+
+def test_incomplete_engine_fails_when_created():
+    class NoQueries(query_engine.QueryEngine):
+        def _register(self, table, sources, columns):
+            pass
+
+        def _unregister(self, table):
+            pass
+
+    with pytest.raises(TypeError, match='_execute'):
+        NoQueries()
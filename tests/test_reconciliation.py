@@ -0,0 +1,45 @@
+import pandas as pd
+
+import reconciliation
+
+WINDOW = ('2025-09-22', '2025-10-05')
+
+
+def _payouts_check(payout_dates, mismatched):
+    """Payouts check of one transaction per payout, the payouts in ``mismatched`` off by a dollar"""
+    ids = pd.array(range(1, len(payout_dates) + 1), dtype='Int64')
+    dates = pd.to_datetime(payout_dates)
+    amounts = {amount: [10.0] * len(ids) for amount in reconciliation.PAYOUT_AMOUNTS}
+    transactions = pd.DataFrame({
+        'DoorDash transaction ID': range(len(ids)), 'Timestamp local date': dates, 'Payout date': dates,
+        'Store name': 'Store A', 'Payout ID': ids, 'Store ID': 1, 'Channel': 'Marketplace',
+        'Transaction type': 'Order', **amounts,
+    })
+    payouts = transactions[reconciliation.PAYOUT_KEYS + reconciliation.PAYOUT_AMOUNTS
+                           + ['Payout date', 'Store name']].copy()
+    payouts.loc[payouts['Payout ID'].isin(mismatched), 'Subtotal'] += 1
+    return reconciliation.doordash_payouts(transactions, payouts, [WINDOW]).set_index('Payout ID')
+
+
+def test_discrepancy_in_the_middle_of_the_window_is_not_an_edge():
+    result = _payouts_check(['2025-09-22', '2025-09-28', '2025-09-29', '2025-10-05'], mismatched=[1, 2, 3, 4])
+
+    assert (result['status'] == 'amount mismatch').all()
+    assert result['window_edge'].tolist() == [True, False, False, True]
+    issues = reconciliation.discrepancies({'payouts': result.reset_index()}, include_edges=False)
+    assert sorted(issues['Payout ID']) == [2, 3]
+
+
+def test_only_the_ends_of_each_window_are_edges():
+    result = pd.DataFrame({'date': pd.to_datetime(['2025-09-22', '2025-09-30', '2025-10-06', '2025-10-19', None])})
+    windows = [WINDOW, ('2025-10-06', '2025-10-19')]
+
+    # 2025-10-05/06 is where two windows meet: an edge of both
+    edges = reconciliation.mark_window_edges(result, windows, days=3)['window_edge']
+    assert edges.tolist() == [True, False, True, True, False]
+
+    # A margin of half the window or more is capped, leaving its middle unflagged
+    edges = reconciliation.mark_window_edges(result, windows, days=30)['window_edge']
+    assert edges.tolist() == [True, True, True, True, False]
+    middle = pd.DataFrame({'date': pd.to_datetime(['2025-09-28', '2025-09-29'])})
+    assert not reconciliation.mark_window_edges(middle, [WINDOW], days=30)['window_edge'].any()
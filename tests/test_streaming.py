@@ -0,0 +1,79 @@
+import csv
+import glob
+import os
+
+import pytest
+
+import data_cache
+import streaming
+from exports import EXPORT_KINDS
+
+# kind -> (measure changed in the newer window, bundled export)
+CASES = {
+    'detailed_transactions': ('Subtotal', 'financial_*/FINANCIAL_DETAILED_TRANSACTIONS_*.csv'),
+    'promotion': ('Sales', 'marketing_*/MARKETING_PROMOTION_*.csv'),
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _read_rows(kind):
+    path = glob.glob(os.path.join(ROOT, CASES[kind][1]))[0]
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+
+def _write_window(root, kind, start, end, exported_at, header, rows):
+    dir_prefix, file_prefix = EXPORT_KINDS[kind]
+    directory = os.path.join(root, f'{dir_prefix}_{start}_{end}_test_{exported_at}')
+    os.makedirs(directory)
+    with open(os.path.join(directory, f'{file_prefix}_{start}_{end}_test_{exported_at}.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+
+@pytest.mark.parametrize('kind', sorted(CASES))
+def test_streamed_cube_matches_in_memory_over_overlapping_windows(tmp_path, kind):
+    header, rows = _read_rows(kind)
+    rows = rows[:900]
+    # The newer window repeats rows 300-599 and changes one of them
+    newer = [list(row) for row in rows[300:]]
+    column = header.index(CASES[kind][0])
+    newer[0][column] = f'{float(newer[0][column]) + 1000:.2f}'
+
+    root = str(tmp_path / 'exports')
+    _write_window(root, kind, '2025-09-22', '2025-09-28', '2025-09-29T00-00-00Z', header, rows[:600])
+    _write_window(root, kind, '2025-09-25', '2025-10-05', '2025-10-06T00-00-00Z', header, newer)
+
+    streamed = streaming.stream_export_cube(kind, root, chunk_rows=64)
+    in_memory = streaming.in_memory_cube(kind, root)
+    assert streaming.compare_cubes(streamed, in_memory, kind) <= streaming.TOLERANCE
+    assert streamed[CASES[kind][0]].sum() == pytest.approx(
+        sum(float(row[column]) for row in rows[:300] + newer if row[column] not in ('', 'NULL')))
+
+
+def test_compare_cubes_rejects_a_cube_missing_the_older_rows(tmp_path):
+    kind = 'detailed_transactions'
+    header, rows = _read_rows(kind)
+    rows = rows[:400]
+    column = header.index('Subtotal')
+    changed = [list(row) for row in rows[100:]]
+    changed[0][column] = f'{float(changed[0][column]) + 1000:.2f}'
+
+    root = str(tmp_path / 'exports')
+    _write_window(root, kind, '2025-09-22', '2025-09-28', '2025-09-29T00-00-00Z', header, rows)
+    _write_window(root, kind, '2025-09-25', '2025-10-05', '2025-10-06T00-00-00Z', header, changed)
+    in_memory = streaming.in_memory_cube(kind, root)
+
+    # Only the newer window: the older copies of its rows must not be folded in
+    only_newer = str(tmp_path / 'newer')
+    _write_window(only_newer, kind, '2025-09-25', '2025-10-05', '2025-10-06T00-00-00Z', header, changed)
+    with pytest.raises(AssertionError):
+        streaming.compare_cubes(streaming.stream_export_cube(kind, only_newer, chunk_rows=64), in_memory, kind)
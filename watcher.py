@@ -0,0 +1,149 @@
+"""Watcher of the export files behind each dataset.
+
+Each dataset is one DoorDash export kind or one GrubHub table, and it is
+backed by a few files on disk. ``DataWatcher`` keeps one version per
+dataset, made of the (path, mtime, size) of its files. A background thread
+polls them every ``TODC_WATCH_INTERVAL`` seconds, so a rerun can read the
+versions without touching the disk.
+
+When a data drop adds, replaces or removes files, only the versions of the
+affected datasets change. Caches keyed by a dataset's version then miss for
+that dataset alone, and the frames and results of every other dataset stay
+warm. Subscribed listeners are told which datasets changed, so they can drop
+the stale entries right away instead of waiting for them to be evicted.
+
+Run it on its own to log data drops as they are detected:
+
+    python watcher.py --interval 2
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from exports import EXPORT_KINDS, discover_exports
+from platforms import GRUBHUB_FILES
+
+# Seconds between two polls of the data files; 0 disables the polling thread
+WATCH_INTERVAL = float(os.environ.get('TODC_WATCH_INTERVAL', '5'))
+
+logger = logging.getLogger(__name__)
+
+
+def dataset_files(root='.'):
+    """dataset -> callable listing its files, for every DoorDash export kind and GrubHub table"""
+    sources = {kind: (lambda kind=kind: [e.path for e in discover_exports(kind, root)]) for kind in EXPORT_KINDS}
+    sources.update({key: (lambda path=path: [path] if os.path.exists(path) else [])
+                     for key, path in GRUBHUB_FILES.items()})
+    return sources
+
+
+class DataWatcher:
+    """Per-dataset versions of the files on disk, kept current by a polling thread
+
+    ``sources`` maps each dataset to a zero-argument callable listing its
+    files. With ``interval`` > 0 a daemon thread calls ``poll()`` every
+    ``interval`` seconds; otherwise versions only change when ``poll()`` is
+    called.
+    """
+
+    def __init__(self, sources, interval=WATCH_INTERVAL):
+        self._sources = dict(sources)
+        self._versions = {name: self._fingerprint(name) for name in self._sources}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.changes = 0
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='data-watcher', daemon=True)
+            self._thread.start()
+
+    def _fingerprint(self, name):
+        files = []
+        for path in self._sources[name]():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Removed between listing and stat
+                continue
+            files.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(files)
+
+    def version(self, *names):
+        """Version of one dataset, or the tuple of versions of several"""
+        with self._lock:
+            if len(names) == 1:
+                return self._versions[names[0]]
+            return tuple(self._versions[name] for name in names)
+
+    def subscribe(self, listener):
+        """Call ``listener(changes)`` after every poll that found changes
+
+        ``changes`` maps each changed dataset to its ``(old, new)`` versions.
+        Listeners run on the polling thread, after the new versions are
+        visible to ``version()``.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def poll(self):
+        """Fingerprint every dataset again and notify listeners of the changed ones"""
+        current = {name: self._fingerprint(name) for name in self._sources}
+        with self._lock:
+            changes = {name: (self._versions[name], version) for name, version in current.items()
+                       if version != self._versions[name]}
+            self._versions.update(current)
+            self.changes += len(changes)
+            listeners = list(self._listeners)
+        if not changes:
+            return changes
+
+        logger.info('Data changed: %s', ', '.join(sorted(changes)))
+        for listener in listeners:
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception('Data watcher listener failed')
+        return changes
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling the data files failed')
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def _log_changes(changes):
+    for name, (old, new) in sorted(changes.items()):
+        logger.info('  %s: %d -> %d files', name, len(old), len(new))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Log the datasets whose export files change')
+    parser.add_argument('--root', default='.', help='directory holding the DoorDash export folders')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL or 5, help='seconds between polls')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    sources = dataset_files(args.root)
+    watcher = DataWatcher(sources, interval=0)
+    watcher.subscribe(_log_changes)
+    logger.info('Watching %d datasets every %gs', len(sources), args.interval)
+    try:
+        while True:
+            time.sleep(args.interval)
+            watcher.poll()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()